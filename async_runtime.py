@@ -0,0 +1,138 @@
+# async_runtime.py
+
+import asyncio
+import sys
+import time
+import redis
+from factory_redis import AsyncFactoryRedis
+from line_redis import AsyncLineRedis
+from product_stock_redis import AsyncProductStockRedis
+from supplier_redis import AsyncSupplierRedis
+from warehouse_redis import AsyncWarehouseRedis
+from supplier_model import supplier_specs
+from warehouse_shards import warehouse_specs
+from utils import print_update, format_pool_stats, make_async_redis_client, TIME_SLEEP, REDIS_POOL_SIZE, REDIS_POOL_HEADROOM
+
+# Mesma topologia do start_simulation.sh: fornecedor, almoxarifado, estoque de
+# produtos, Fábrica 1 (empurrada, 5 linhas) e Fábrica 2 (puxada, 8 linhas).
+DEFAULT_TOPOLOGY = (
+    [*supplier_specs(), *warehouse_specs(), "product_stock",
+     "factory:empurrada:1:5", "factory:puxada:2:8"]
+    + [f"line:{i}:1" for i in range(1, 6)]
+    + [f"line:{i}:2" for i in range(1, 9)]
+)
+
+
+# Classes usadas por build_entity para cada tipo de entidade. O motor de
+# simulação (simulation_engine.py) passa a tabela com as variantes síncronas.
+ASYNC_ENTITY_CLASSES = {
+    "supplier": AsyncSupplierRedis,
+    "warehouse": AsyncWarehouseRedis,
+    "product_stock": AsyncProductStockRedis,
+    "factory": AsyncFactoryRedis,
+    "line": AsyncLineRedis,
+}
+
+
+def build_entity(spec, redis_client, classes=ASYNC_ENTITY_CLASSES):
+    """
+    Cria uma entidade a partir de uma especificação em texto:
+      supplier | warehouse | product_stock
+      supplier:{supplier_id} | warehouse:{shard}
+      factory:{empurrada|puxada}:{factory_id}:{lines_number}
+      line:{line_id}:{factory_id}
+    """
+    kind, *args = spec.split(":")
+    if kind in ("supplier", "warehouse", "product_stock") and not args:
+        return classes[kind](redis_client)
+    if kind in ("supplier", "warehouse") and len(args) == 1:
+        return classes[kind](redis_client, int(args[0]))
+    if kind == "factory" and len(args) == 3:
+        fabric_type, factory_id, lines_number = args
+        return classes[kind](fabric_type, factory_id, int(lines_number), redis_client)
+    if kind == "line" and len(args) == 2:
+        line_id, factory_id = args
+        return classes[kind](line_id, factory_id, redis_client)
+    raise ValueError(f"Especificação de entidade inválida: '{spec}'")
+
+
+async def report_pool_stats(redis_client):
+    """Registra a utilização do pool de conexões uma vez por dia simulado."""
+    while True:
+        await asyncio.sleep(TIME_SLEEP)
+        print_update(format_pool_stats(redis_client), 'async-runtime')
+
+
+# Espera antes de reiniciar uma tarefa que falhou: dobra a cada falha seguida, até
+# o máximo, e volta ao mínimo se a tarefa ficou de pé por TASK_RESTART_RESET_AFTER s.
+TASK_RESTART_BACKOFF_MIN = 1
+TASK_RESTART_BACKOFF_MAX = 60
+TASK_RESTART_RESET_AFTER = 60
+
+
+async def supervise(name, make_coro):
+    """
+    Roda uma tarefa de entidade e, se ela falhar, a recria sozinha com espera
+    crescente: o erro de uma entidade não derruba as outras do mesmo processo. O
+    listener volta lendo as pendências do stream e o loop de dias continua do dia
+    em que parou.
+    """
+    backoff = TASK_RESTART_BACKOFF_MIN
+    while True:
+        started_at = time.monotonic()
+        try:
+            return await make_coro()
+        except Exception as e:
+            if time.monotonic() - started_at >= TASK_RESTART_RESET_AFTER:
+                backoff = TASK_RESTART_BACKOFF_MIN
+            print_update(f"Tarefa {name} falhou ({e!r}). Reiniciando em {backoff}s.", 'async-runtime')
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, TASK_RESTART_BACKOFF_MAX)
+
+
+async def run_entities(specs, redis_client):
+    """Hospeda as entidades como tarefas no loop atual: um listener e um loop de dias por entidade."""
+    entities = [build_entity(spec, redis_client) for spec in specs]
+    tasks = [asyncio.create_task(report_pool_stats(redis_client), name="pool-stats")]
+    for entity in entities:
+        for routine in (entity.listen, entity.run):
+            name = f"{entity.entity_name}:{routine.__name__}"
+            tasks.append(asyncio.create_task(supervise(name, routine), name=name))
+    print_update(f"{len(entities)} entidades rodando em um único processo.", 'async-runtime')
+    # Assim como no main() de cada entidade, os listeners continuam ativos depois
+    # do último dia; o processo só termina com Ctrl+C.
+    await asyncio.gather(*tasks)
+
+
+def pool_size_for(specs):
+    """Conexões do pool do processo: uma por listener mais REDIS_POOL_HEADROOM."""
+    return max(REDIS_POOL_SIZE, len(specs) + REDIS_POOL_HEADROOM)
+
+
+async def main_async(specs):
+    r = make_async_redis_client(pool_size_for(specs))
+    try:
+        await r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+    try:
+        await run_entities(specs, r)
+    finally:
+        await r.aclose()
+
+
+def main():
+    """
+    Uso: python3 async_runtime.py [entidade ...]
+    Sem argumentos, sobe toda a topologia padrão (DEFAULT_TOPOLOGY) em um só processo.
+    """
+    specs = sys.argv[1:] or DEFAULT_TOPOLOGY
+    try:
+        asyncio.run(main_async(specs))
+    except KeyboardInterrupt:
+        print_update("Encerrado pelo usuário.", 'async-runtime')
+
+
+if __name__ == "__main__":
+    main()
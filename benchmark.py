@@ -0,0 +1,457 @@
+# benchmark.py
+
+import argparse
+import heapq
+import itertools
+import json
+import platform
+import random
+import redis
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+import init_redis
+import utils
+from async_runtime import build_entity
+from inventory_redis import line_inventory, product_inventory, warehouse_inventory
+from simulation_engine import MemoryRedis, SYNC_ENTITY_CLASSES, apply_overrides
+from supervisor import load_topology
+from utils import (
+    encode_message,
+    set_log_level,
+    BATCH_SIZE,
+    NUM_PARTS,
+    NUM_PRODUCTS,
+    PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    PARTS_TO_SEND_AMOUNT_SUPPLIER
+)
+
+# Mistura padrão de mensagens de cada tipo de entidade (comando -> peso). Pode ser
+# trocada na linha de comando com --mix tipo:comando=peso[,comando=peso].
+DEFAULT_MIXES = {
+    "line": {"receive_order": 0.85, "receive_parts": 0.15},
+    "warehouse": {"send_parts": 0.95, "receive_parts": 0.05},
+    "supplier": {"send_parts": 1.0},
+    "factory": {"update_factory": 1.0},
+    "product_stock": {"receive_products": 1.0},
+}
+
+BENCH_REDIS_PORT = 6390
+
+
+class CountingPipeline:
+    """Pipeline que conta os comandos enfileirados; o execute() é uma ida ao servidor."""
+
+    def __init__(self, owner, pipe):
+        self.owner = owner
+        self.pipe = pipe
+
+    def __getattr__(self, name):
+        method = getattr(self.pipe, name)
+
+        def queue(*args, **kwargs):
+            self.owner.commands += 1
+            method(*args, **kwargs)
+            return self
+        return queue
+
+    def execute(self):
+        self.owner.round_trips += 1
+        return self.pipe.execute()
+
+
+class CountingRedis:
+    """
+    Cliente Redis (ou MemoryRedis) que conta comandos e idas ao servidor. Cada
+    chamada direta vale um comando e uma ida; scripts Lua (EVALSHA) também; um
+    pipeline vale um comando por item e uma ida no execute().
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = 0
+        self.round_trips = 0
+
+    def _counted(self, method):
+        def call(*args, **kwargs):
+            self.commands += 1
+            self.round_trips += 1
+            return method(*args, **kwargs)
+        return call
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        return self._counted(attr) if callable(attr) else attr
+
+    def pipeline(self, transaction=True):
+        return CountingPipeline(self, self.client.pipeline(transaction=transaction))
+
+    def register_script(self, script):
+        return self._counted(self.client.register_script(script))
+
+
+class CountingTransport:
+    """
+    Transporte que só conta as publicações: o benchmark mede o handler de uma
+    entidade isolada, sem entregar as mensagens que ela gera a ninguém.
+    """
+
+    def __init__(self):
+        self.published = Counter()
+
+    def publish(self, channel, data):
+        self.published[utils.decode_message(data).command] += 1
+
+    def queue_publish(self, pipe, channel, data):
+        self.publish(channel, data)
+
+
+class TimerQueue:
+    """
+    Relógio e call_later das entidades no benchmark, em tempo virtual: cada
+    mensagem avança o relógio em --tick segundos e os temporizadores vencidos
+    (janela de alocação do almoxarifado, entregas do fornecedor, revisões, prazos)
+    rodam na mesma thread, entre uma mensagem e outra. Assim o tempo e os
+    comandos deles também são medidos, sem esperar o tempo real.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def call_later(self, delay, callback, *args):
+        heapq.heappush(self._heap, (self.now + delay, next(self._seq), callback, args))
+
+    def advance(self, seconds):
+        """Avança o relógio e roda, em ordem, os temporizadores que venceram no caminho."""
+        until = self.now + seconds
+        ran = []
+        while self._heap and self._heap[0][0] <= until:
+            due, _, callback, args = heapq.heappop(self._heap)
+            self.now = max(self.now, due)
+            start = time.perf_counter()
+            callback(*args)
+            ran.append((callback.__name__, time.perf_counter() - start))
+        self.now = until
+        return ran
+
+    def __len__(self):
+        return len(self._heap)
+
+
+# --- Mensagens sintéticas (mesmo formato que as entidades trocam) ---
+
+def _random_lines(rng, specs):
+    lines = [spec.split(":")[1:] for spec in specs if spec.startswith("line:")]
+    return rng.choice(lines)
+
+
+def _order_vector(rng):
+    """Pedido com algumas peças: flags (lote padrão) ou quantidades, como as linhas enviam."""
+    vector = [0] * NUM_PARTS
+    for idx in rng.sample(range(NUM_PARTS), rng.randint(1, 10)):
+        vector[idx] = 1 if rng.random() < 0.5 else rng.randint(BATCH_SIZE, BATCH_SIZE * 10)
+    return vector
+
+
+def _line_message(command, rng, entity, specs, seq):
+    if command == "receive_order":
+        product = rng.randrange(NUM_PRODUCTS)
+        return encode_message(command, [entity.line_id, entity.factory_id, product, rng.randint(1, BATCH_SIZE)])
+    return encode_message(command, [entity.line_id, entity.factory_id],
+                          [PARTS_TO_SEND_AMOUNT_WAREHOUSE] * NUM_PARTS)
+
+
+def _warehouse_message(command, rng, entity, specs, seq):
+    if command == "send_parts":
+        line_id, factory_id = _random_lines(rng, specs)
+        return encode_message(command, [line_id, factory_id, rng.randint(0, 5), seq], _order_vector(rng))
+    return encode_message(command, [], [PARTS_TO_SEND_AMOUNT_SUPPLIER] * NUM_PARTS)
+
+
+def _supplier_message(command, rng, entity, specs, seq):
+    return encode_message(command, [seq], _order_vector(rng))
+
+
+def _factory_message(command, rng, entity, specs, seq):
+    demand = [rng.randint(utils.MIN_ORDERED_AMOUNT, utils.MAX_ORDERED_AMOUNT) for _ in range(NUM_PRODUCTS)]
+    stock = [rng.randint(0, init_redis.INITIAL_PRODUCT_STOCK) for _ in range(NUM_PRODUCTS)]
+    return encode_message(command, demand, stock)
+
+
+def _product_stock_message(command, rng, entity, specs, seq):
+    line_id, factory_id = _random_lines(rng, specs)
+    return encode_message(command, [rng.randrange(NUM_PRODUCTS), line_id, factory_id, rng.randint(1, BATCH_SIZE)])
+
+
+MESSAGE_BUILDERS = {
+    "line": _line_message,
+    "warehouse": _warehouse_message,
+    "supplier": _supplier_message,
+    "factory": _factory_message,
+    "product_stock": _product_stock_message,
+}
+
+
+def parse_mixes(overrides):
+    """Aplica '--mix tipo:comando=peso,...' sobre DEFAULT_MIXES."""
+    mixes = {kind: dict(mix) for kind, mix in DEFAULT_MIXES.items()}
+    for override in overrides:
+        kind, _, items = override.partition(":")
+        if kind not in mixes:
+            raise ValueError(f"Tipo de entidade desconhecido em --mix: '{kind}'")
+        mix = {}
+        for item in items.split(","):
+            command, _, weight = item.partition("=")
+            if command not in DEFAULT_MIXES[kind]:
+                raise ValueError(f"A entidade '{kind}' não trata o comando '{command}'")
+            mix[command] = float(weight)
+        mixes[kind] = mix
+    return mixes
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def _latency_stats(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+    }
+
+
+# --- Backends ---
+
+def spawn_redis_server(port):
+    """Sobe um redis-server descartável (sem persistência) e retorna (processo, cliente)."""
+    binary = shutil.which("redis-server")
+    if binary is None:
+        raise RuntimeError("redis-server não encontrado no PATH (use --backend memory)")
+    process = subprocess.Popen(
+        [binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    client = redis.Redis(host="127.0.0.1", port=port, decode_responses=True)
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            client.ping()
+            return process, client
+        except redis.exceptions.ConnectionError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError(f"redis-server não respondeu na porta {port}")
+            time.sleep(0.05)
+
+
+def _fresh_state(client):
+    """Limpa o banco e recria o estado inicial da simulação (init_redis)."""
+    if isinstance(client, MemoryRedis):
+        client.data.clear()
+    else:
+        client.flushdb()
+    product_inventory(client).set_all(init_redis.INITIAL_PRODUCT_STOCK)
+    warehouse_inventory(client).set_all(init_redis.INITIAL_WAREHOUSE_STOCK)
+
+
+def _bench_entity(spec, client, specs, mix, args):
+    _fresh_state(client)
+    if spec.startswith("line:"):
+        line_id, factory_id = spec.split(":")[1:]
+        line_inventory(client, factory_id, line_id).set_all(PARTS_TO_SEND_AMOUNT_WAREHOUSE)
+
+    counting = CountingRedis(client)
+    entity = build_entity(spec, counting, SYNC_ENTITY_CLASSES)
+    transport = CountingTransport()
+    timers = TimerQueue()
+    entity.transport = transport
+    entity.call_later = timers.call_later
+    entity.clock = timers.clock
+
+    kind = spec.split(":")[0]
+    rng = random.Random(args.seed)
+    commands, weights = zip(*mix.items())
+    build = MESSAGE_BUILDERS[kind]
+    messages = [
+        (command, build(command, rng, entity, specs, seq))
+        for seq, command in enumerate(rng.choices(commands, weights, k=args.warmup + args.messages), start=1)
+    ]
+
+    samples = {command: [] for command in commands}
+    timer_samples = {}
+    interval = 1 / args.rate if args.rate else 0
+    start = None
+    for i, (command, data) in enumerate(messages):
+        if i == args.warmup:
+            timers.advance(args.settle)
+            counting.commands = counting.round_trips = 0
+            transport.published.clear()
+            start = time.perf_counter()
+            next_at = time.monotonic()
+        if start is not None and interval:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+
+        t0 = time.perf_counter()
+        entity.handle_message(data)
+        elapsed = time.perf_counter() - t0
+        ran = timers.advance(args.tick)
+        if start is None:
+            continue
+        samples[command].append(elapsed)
+        for name, seconds in ran:
+            timer_samples.setdefault(name, []).append(seconds)
+
+    # Temporizadores ainda pendentes (ex.: a última janela de alocação) entram na conta.
+    for name, seconds in timers.advance(args.settle):
+        timer_samples.setdefault(name, []).append(seconds)
+    wall = time.perf_counter() - start
+
+    all_samples = [s for values in samples.values() for s in values]
+    n = len(all_samples)
+    result = {
+        'spec': spec,
+        'messages': n,
+        'elapsed_s': wall,
+        'msgs_per_sec': n / wall if wall else 0.0,
+        'handler_msgs_per_sec': n / sum(all_samples) if all_samples else 0.0,
+        **_latency_stats(all_samples),
+        'redis_commands_per_msg': counting.commands / n if n else 0.0,
+        'round_trips_per_msg': counting.round_trips / n if n else 0.0,
+        'published_per_msg': sum(transport.published.values()) / n if n else 0.0,
+        'by_command': {command: _latency_stats(values) for command, values in samples.items()},
+        'timers': {name: _latency_stats(values) for name, values in timer_samples.items()},
+        'pending_timers': len(timers),
+    }
+    return result
+
+
+def _pick_specs(specs, kinds):
+    """Uma entidade de cada tipo pedido (a primeira da topologia)."""
+    picked = {}
+    for spec in specs:
+        kind = spec.split(":")[0]
+        if kind in kinds and kind not in picked:
+            picked[kind] = spec
+    return [picked[kind] for kind in kinds if kind in picked]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    specs, _, _ = load_topology(args.topology)
+    mixes = parse_mixes(args.mix)
+    kinds = args.entities.split(",")
+    process = None
+    if args.backend == "redis":
+        process, client = spawn_redis_server(args.port)
+    else:
+        client = MemoryRedis()
+    try:
+        results = {}
+        for spec in _pick_specs(specs, kinds):
+            kind = spec.split(":")[0]
+            results[kind] = _bench_entity(spec, client, specs, mixes[kind], args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return {
+        'meta': {
+            'backend': args.backend,
+            'messages': args.messages,
+            'warmup': args.warmup,
+            'rate': args.rate,
+            'seed': args.seed,
+            'mixes': {kind: mixes[kind] for kind in results},
+            'overrides': args.set,
+            'inventory_backend': utils.INVENTORY_BACKEND,
+            'wire_version': utils.WIRE_VERSION,
+            'python': platform.python_version(),
+            'git_commit': _git_commit(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+
+def _delta(new, old):
+    return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+
+def format_report(report, baseline=None):
+    lines = [f"{'entidade':<14}{'msgs/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'cmds/msg':>10}{'idas/msg':>10}"]
+    for kind, result in report['results'].items():
+        line = (f"{kind:<14}{result['msgs_per_sec']:>10.0f}{result['p50_ms']:>9.3f}{result['p99_ms']:>9.3f}"
+                f"{result['redis_commands_per_msg']:>10.2f}{result['round_trips_per_msg']:>10.2f}")
+        old = (baseline or {}).get('results', {}).get(kind)
+        if old:
+            line += (f"   (msgs/s {_delta(result['msgs_per_sec'], old['msgs_per_sec'])}, "
+                     f"p99 {_delta(result['p99_ms'], old['p99_ms'])})")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos handlers de mensagens de cada entidade.")
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory",
+                        help="MemoryRedis em processo ou um redis-server descartável (padrão: memory)")
+    parser.add_argument("--port", type=int, default=BENCH_REDIS_PORT, help="porta do redis-server descartável")
+    parser.add_argument("--entities", default=",".join(DEFAULT_MIXES), help="tipos de entidade, separados por vírgula")
+    parser.add_argument("--messages", type=int, default=5000, help="mensagens medidas por entidade")
+    parser.add_argument("--warmup", type=int, default=200, help="mensagens iniciais não medidas")
+    parser.add_argument("--rate", type=float, default=0, help="mensagens por segundo (0 = o mais rápido possível)")
+    parser.add_argument("--tick", type=float, default=utils.TIME_SLEEP / 50,
+                        help="segundos do relógio virtual das entidades por mensagem (padrão: 1/50 de dia)")
+    parser.add_argument("--settle", type=float, default=utils.WAREHOUSE_BATCH_WINDOW,
+                        help="segundos virtuais de temporizadores rodados após o aquecimento e no fim")
+    parser.add_argument("--seed", type=int, default=0, help="semente das mensagens sintéticas")
+    parser.add_argument("--mix", action="append", default=[], metavar="TIPO:CMD=PESO[,CMD=PESO]",
+                        help="troca a mistura de mensagens de um tipo de entidade (pode repetir)")
+    parser.add_argument("--topology", default="topology.json", help="arquivo de topologia (padrão: topology.json)")
+    parser.add_argument("--set", action="append", default=[], metavar="NOME=VALOR",
+                        help="sobrescreve uma constante de utils.py (pode repetir)")
+    parser.add_argument("--json", help="salva o resultado neste arquivo")
+    parser.add_argument("--compare", help="resultado JSON anterior para comparar")
+    parser.add_argument("--log-level", default="WARNING", help="nível dos logs das entidades (padrão: WARNING)")
+    args = parser.parse_args()
+
+    set_log_level(args.log_level)
+    try:
+        apply_overrides(args.set)
+        report = run_benchmark(args)
+    except (ValueError, RuntimeError) as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# bom_model.py
+
+import numpy as np
+from utils import string_to_list, NUM_PARTS
+
+# As peças 1..43 formam o kit base, comum a todos os produtos; as demais são
+# as peças de variação listadas em products_and_parts.txt (ids 1-based).
+BASE_KIT_SIZE = 43
+PRODUCTS_FILE = "products_and_parts.txt"
+
+
+def read_variant_parts(path=PRODUCTS_FILE):
+    """Lê as peças de variação de cada produto (uma linha por produto, ids 1-based separados por ';')."""
+    with open(path, "r") as f:
+        return [string_to_list(line.strip()) for line in f if line.strip()]
+
+
+class BomMatrix:
+    """
+    Lista de materiais como matriz produtos x peças: requirements[p, i] é quantas
+    unidades da peça i (0-based) uma unidade do produto p consome, kit base
+    incluído. A conversão dos ids 1-based do arquivo acontece só aqui.
+    """
+
+    def __init__(self, requirements, base_kit_size=BASE_KIT_SIZE):
+        self.requirements = np.asarray(requirements, dtype=np.int64)
+        self.base_kit_size = base_kit_size
+        self.num_products, self.num_parts = self.requirements.shape
+        # Índices (int do Python, prontos para o Redis) das peças usadas por cada produto.
+        self.products_parts = [np.flatnonzero(row).tolist() for row in self.requirements]
+
+    @classmethod
+    def from_variant_parts(cls, variant_parts, num_parts=NUM_PARTS, base_kit_size=BASE_KIT_SIZE):
+        requirements = np.zeros((len(variant_parts), num_parts), dtype=np.int64)
+        requirements[:, :base_kit_size] = 1
+        for product, parts in enumerate(variant_parts):
+            requirements[product, np.asarray(parts, dtype=np.int64) - 1] = 1
+        return cls(requirements, base_kit_size)
+
+    @classmethod
+    def from_file(cls, path=PRODUCTS_FILE):
+        return cls.from_variant_parts(read_variant_parts(path))
+
+    def is_base_kit(self, part_idx):
+        return part_idx < self.base_kit_size
+
+    def parts_of(self, product):
+        return self.products_parts[product]
+
+    def need(self, product, qty):
+        """Vetor de peças consumido por 'qty' unidades do produto."""
+        return qty * self.requirements[product]
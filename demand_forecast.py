@@ -0,0 +1,83 @@
+# demand_forecast.py
+
+import math
+import numpy as np
+from utils import (
+    NUM_PRODUCTS,
+    FORECAST_ALPHA,
+    FORECAST_BETA,
+    FORECAST_MIN_OBSERVATIONS,
+    FORECAST_COVER_DAYS,
+    FORECAST_SAFETY_FACTOR,
+    MAD_TO_STD
+)
+
+
+class DemandForecaster:
+    """
+    Previsão da demanda diária de cada produto por suavização exponencial com
+    tendência (Holt), atualizada de forma incremental a cada 'update_factory'.
+    O erro absoluto médio também é suavizado e vira o estoque de segurança.
+    """
+
+    def __init__(self, num_products=NUM_PRODUCTS, alpha=FORECAST_ALPHA, beta=FORECAST_BETA):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = np.zeros(num_products)
+        self.trend = np.zeros(num_products)
+        self.mad = np.zeros(num_products)
+        self.observations = 0
+
+    @property
+    def ready(self):
+        return self.observations >= FORECAST_MIN_OBSERVATIONS
+
+    def observe(self, demand):
+        """Incorpora a demanda de um dia (pedidos de clientes, atendidos ou não)."""
+        demand = np.asarray(demand, dtype=float)
+        if self.observations == 0:
+            self.level = demand.copy()
+        else:
+            expected = self.level + self.trend
+            self.mad = self.alpha * np.abs(demand - expected) + (1 - self.alpha) * self.mad
+            level = self.alpha * demand + (1 - self.alpha) * expected
+            self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+            self.level = level
+        self.observations += 1
+
+    def forecast(self, horizon=None):
+        """Demanda total prevista para os próximos 'horizon' dias (padrão: FORECAST_COVER_DAYS), por produto."""
+        horizon = FORECAST_COVER_DAYS if horizon is None else horizon
+        total = horizon * self.level + self.trend * horizon * (horizon + 1) / 2
+        return np.maximum(total, 0)
+
+    def safety_stock(self, horizon=None):
+        horizon = FORECAST_COVER_DAYS if horizon is None else horizon
+        # Desvio padrão ~ 1,25 * erro absoluto médio, crescendo com a raiz do horizonte.
+        return FORECAST_SAFETY_FACTOR * MAD_TO_STD * self.mad * math.sqrt(horizon)
+
+    def production_need(self, stock, horizon=None):
+        """Quanto produzir de cada produto para cobrir a demanda prevista mais a segurança."""
+        target = self.forecast(horizon) + self.safety_stock(horizon)
+        return np.maximum(np.ceil(target - np.asarray(stock, dtype=float)), 0).astype(int)
+
+
+def plan_lots(need, lines_number, max_lot):
+    """
+    Distribui a necessidade de produção entre as linhas: cada uma das primeiras
+    len(need) linhas fica com o seu produto; as linhas excedentes vão, uma a uma,
+    para o produto com maior necessidade por linha (método de D'Hondt). O lote de
+    cada linha é a necessidade do produto dividida pelas suas linhas, até max_lot.
+    Retorna a lista de (line_idx, lote, produto), só com lotes positivos.
+    """
+    need = np.asarray(need, dtype=float)
+    lines_for = np.zeros(len(need), dtype=int)
+    products = []
+    for line_idx in range(lines_number):
+        product = line_idx if line_idx < len(need) else int(np.argmax(need / (lines_for + 1)))
+        lines_for[product] += 1
+        products.append(product)
+
+    lots = np.minimum(np.ceil(need / np.maximum(lines_for, 1)), max_lot).astype(int)
+    return [(line_idx, int(lots[product]), product)
+            for line_idx, product in enumerate(products) if lots[product] > 0]
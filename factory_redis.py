@@ -1,19 +1,28 @@
 # factory_redis.py
 
+import asyncio
 import redis
 import threading
 import sys
 import time
+from demand_forecast import DemandForecaster, plan_lots
+from metrics import EntityMetrics
+from transport_redis import make_transport
 from utils import (
-    string_to_list,
+    make_redis_client,
+    format_pool_stats,
+    encode_message,
+    decode_message,
+    line_channel,
+    new_trace_id,
     print_update,
     BATCH_SIZE,
+    PULL_LOT_POLICY,
+    FORECAST_MAX_LOT,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_PRODUCT_STOCK,
-    NUM_PRODUCTS,
-    REDIS_HOST,
-    REDIS_PORT
+    NUM_PRODUCTS
 )
 
 class FactoryRedis:
@@ -24,6 +33,8 @@ class FactoryRedis:
         self.factory_id = str(factory_id)
         self.lines_number = lines_number
         self.entity_name = f'factory-{self.factory_id}-{self.fabric_type}'
+        self.transport = make_transport(self.r, self.entity_name)
+        self.metrics = EntityMetrics(self.entity_name, self.r)
         
         # <<< CORREÇÃO: Inicializa o status para evitar erro na primeira execução.
         self.last_stock_status = 'green'
@@ -31,9 +42,17 @@ class FactoryRedis:
         # Lista que guarda os produtos mais necessários (usado pela fábrica 'puxada').
         self.products_most_needed = []
 
-    def update_finished_goods_stock(self, stock_buffer):
+        # Previsão de demanda e último estoque recebido (lotes da fábrica 'puxada').
+        self.forecaster = DemandForecaster()
+        self.last_stock_buffer = None
+
+    def update_finished_goods_stock(self, stock_buffer, demand=None):
         """Atualiza o status do estoque com base nos dados recebidos do depósito de produtos."""
         print_update(f"Recebeu atualização do estoque de produtos: {stock_buffer}", self.entity_name)
+        self.last_stock_buffer = list(stock_buffer)
+        # Mensagens antigas não trazem a demanda do dia; nesse caso a previsão não avança.
+        if demand:
+            self.forecaster.observe(demand)
         
         total_stock = sum(stock_buffer)
         # Define o status geral do estoque (Kanban de produtos acabados)
@@ -56,8 +75,19 @@ class FactoryRedis:
             self.products_most_needed = [item[0] for item in indexed_stock]
             print_update(f"Ordem de prioridade de produção (do mais necessário para o menos): {self.products_most_needed}", self.entity_name)
 
-    def order_daily_batch(self):
-        """Calcula o tamanho do lote para o dia e envia as ordens de produção para as linhas."""
+    def _plan_forecast_batch(self):
+        """Lotes por produto a partir da previsão de demanda: lista de (line_idx, lote, produto)."""
+        need = self.forecaster.production_need(self.last_stock_buffer)
+        print_update(f"Previsão de demanda: {self.forecaster.forecast().round().astype(int).tolist()}, "
+                     f"necessidade de produção: {need.tolist()}", self.entity_name)
+        return plan_lots(need, self.lines_number, FORECAST_MAX_LOT)
+
+    def _plan_daily_batch(self):
+        """Calcula o tamanho do lote do dia e o produto de cada linha: lista de (line_idx, lote, produto)."""
+        if (self.fabric_type == 'puxada' and PULL_LOT_POLICY == 'forecast'
+                and self.forecaster.ready and self.last_stock_buffer is not None):
+            return self._plan_forecast_batch()
+
         # Se for fabricação 'empurrada', o lote é sempre o mesmo (60, no seu caso).
         if self.fabric_type == 'empurrada':
             lot_size = BATCH_SIZE
@@ -72,7 +102,8 @@ class FactoryRedis:
         
         print_update(f"Iniciando ordens de produção do dia com tamanho de lote = {lot_size}", self.entity_name)
 
-        # Envia ordens para todas as suas linhas
+        # Monta as ordens para todas as suas linhas
+        orders = []
         for line_idx in range(self.lines_number):
             # As primeiras linhas (0 a 4) produzem os produtos base (P1 a P5)
             if line_idx < NUM_PRODUCTS:
@@ -86,32 +117,75 @@ class FactoryRedis:
                     # Caso fallback, se a lista estiver vazia, apenas produz P1
                     product_to_produce = 0
             
+            orders.append((line_idx, lot_size, product_to_produce))
+        return orders
+
+    def order_daily_batch(self):
+        """Calcula o tamanho do lote para o dia e envia as ordens de produção para as linhas."""
+        for line_idx, lot_size, product_to_produce in self._plan_daily_batch():
             self.order_to_line(line_idx, lot_size, product_to_produce)
     
-    def order_to_line(self, line_index, size, product_index):
-        """Formata e publica a mensagem de ordem de produção para uma linha específica."""
+    def _production_order(self, line_index, size, product_index):
+        """Formata a mensagem de ordem de produção e retorna (canal da linha, mensagem)."""
         # <<< NOTA: O ID da linha no sistema vai de 1 em diante, mas nosso loop é 0-indexed.
         # A linha que recebe a mensagem usa o ID que foi passado na sua inicialização.
         line_id_for_msg = line_index + 1
         
-        # Formato que a linha espera: "comando/id_linha/id_fabrica/id_produto/quantidade"
-        msg = f"receive_order/{line_id_for_msg}/{self.factory_id}/{product_index}/{size}"
+        # Campos que a linha espera: id_linha, id_fabrica, id_produto, quantidade.
+        # Cada ordem abre um trace, seguido até a entrada dos produtos no estoque.
+        fields = [line_id_for_msg, self.factory_id, product_index, size]
+        msg = encode_message("receive_order", fields, trace_id=new_trace_id())
         
         print_update(f"Enviando Ordem -> Linha: {line_id_for_msg}, Produto: {product_index + 1}, Qtd: {size}", self.entity_name)
-        self.r.publish("channel:line", msg)
+        return line_channel(self.factory_id, line_id_for_msg), msg
+
+    def order_to_line(self, line_index, size, product_index):
+        """Publica a ordem de produção para uma linha específica."""
+        self.transport.publish(*self._production_order(line_index, size, product_index))
 
     def listen(self):
         """Ouve o canal 'channel:factory' por atualizações do estoque de produtos."""
-        pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:factory")
         print_update("Ouvindo o canal 'channel:factory' por atualizações de estoque...", self.entity_name)
         
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                parts = message['data'].split("/")
-                if parts[0] == "update_factory":
-                    buffer = string_to_list(parts[1])
-                    self.update_finished_goods_stock(buffer)
+        for data in self.transport.listen("channel:factory"):
+            self.metrics.dispatch(self.handle_message, data, self.transport)
+
+    def handle_message(self, data):
+        msg = decode_message(data)
+        if msg.command == "update_factory":
+            self.update_finished_goods_stock(msg.vector, msg.fields)
+
+class AsyncFactoryRedis(FactoryRedis):
+    """Variante asyncio da fábrica (redis.asyncio), para várias entidades em um só processo."""
+
+    # Último dia começado pelo run(): reiniciada pelo async_runtime, a tarefa continua dele.
+    day = 0
+
+    async def order_daily_batch(self):
+        for line_idx, lot_size, product_to_produce in self._plan_daily_batch():
+            await self.order_to_line(line_idx, lot_size, product_to_produce)
+
+    async def order_to_line(self, line_index, size, product_index):
+        await self.transport.publish(*self._production_order(line_index, size, product_index))
+
+    async def listen(self):
+        print_update("Ouvindo o canal 'channel:factory' por atualizações de estoque...", self.entity_name)
+        async for data in self.transport.listen("channel:factory"):
+            await self.metrics.dispatch_async(self.handle_message, data, self.transport)
+
+    async def handle_message(self, data):
+        msg = decode_message(data)
+        if msg.command == "update_factory":
+            self.update_finished_goods_stock(msg.vector, msg.fields)
+
+    async def run(self):
+        """Loop de dias, equivalente ao de main()."""
+        while self.day < DAYS_MAX:
+            self.day += 1
+            print_update(f"--- Dia {self.day} ---", self.entity_name)
+            await self.metrics.step_async(self.order_daily_batch)
+            await asyncio.sleep(TIME_SLEEP)
+        print_update("Simulação terminada.", self.entity_name)
 
 def main():
     if len(sys.argv) != 4:
@@ -122,7 +196,7 @@ def main():
     fabric_type, factory_id, lines_n = sys.argv[1], sys.argv[2], int(sys.argv[3])
     
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         r.ping()
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO (Fábrica {factory_id}): Não foi possível conectar ao Redis. Detalhes: {e}")
@@ -140,9 +214,10 @@ def main():
         print_update(f"--- Dia {days} ---", fac.entity_name)
         # A fábrica só envia ordens depois de receber a primeira atualização de estoque
         if fac.last_stock_status:
-             fac.order_daily_batch()
+             fac.metrics.step(fac.order_daily_batch)
         else:
              print_update("Aguardando primeira atualização de estoque para iniciar produção.", fac.entity_name)
+        print_update(format_pool_stats(r), fac.entity_name)
         
         time.sleep(TIME_SLEEP)
         
@@ -1,7 +1,13 @@
 # init_redis.py
 
 import redis
-from utils import BATCH_SIZE, NUM_PRODUCTS, REDIS_HOST, REDIS_PORT
+from inventory_redis import product_inventory, warehouse_inventory
+from utils import BATCH_SIZE, NUM_PRODUCTS, REDIS_HOST, REDIS_PORT, make_redis_client
+
+# Estado inicial: estoque saudável de produtos e um almoxarifado robusto o
+# suficiente para abastecer as 13 linhas (também usado pelo simulation_engine.py).
+INITIAL_PRODUCT_STOCK = 1000
+INITIAL_WAREHOUSE_STOCK = BATCH_SIZE * 1000
 
 def initialize_simulation():
     """
@@ -10,7 +16,7 @@ def initialize_simulation():
     """
     try:
         # Conecta ao servidor Redis local
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         # Verifica a conexão
         r.ping()
     except redis.exceptions.ConnectionError as e:
@@ -27,20 +33,18 @@ def initialize_simulation():
     # 1. Inicializar estoque de produtos acabados
     # Começa com um estoque saudável para que os primeiros pedidos dos clientes possam ser atendidos.
     print(f">>> Inicializando estoque de {NUM_PRODUCTS} produtos acabados...")
-    initial_product_stock = 1000
-    for i in range(NUM_PRODUCTS):
-        key = f"product:{i}"
-        r.set(key, initial_product_stock)
-        print(f"    - Chave '{key}' criada com valor {initial_product_stock}")
+    initial_product_stock = INITIAL_PRODUCT_STOCK
+    products = product_inventory(r)
+    products.set_all(initial_product_stock)
+    print(f"    - {NUM_PRODUCTS} produtos criados com valor {initial_product_stock}")
 
     # 2. Inicializar estoque do almoxarifado (warehouse)
     # O almoxarifado precisa de um estoque robusto para poder abastecer as 13 linhas de produção.
     print(">>> Inicializando estoque de peças no Almoxarifado...")
-    initial_warehouse_stock = BATCH_SIZE * 1000  # Um valor alto para garantir o início
-    for i in range(100): # Total de 100 peças diferentes
-        key = f"warehouse:part:{i}"
-        r.set(key, initial_warehouse_stock)
-    print(f"    - 100 chaves 'warehouse:part:x' criadas com valor {initial_warehouse_stock}")
+    initial_warehouse_stock = INITIAL_WAREHOUSE_STOCK  # Um valor alto para garantir o início
+    warehouse = warehouse_inventory(r)
+    warehouse.set_all(initial_warehouse_stock)
+    print(f"    - {warehouse.size} peças do almoxarifado criadas com valor {initial_warehouse_stock}")
     
     # NOTA: As linhas de produção podem começar com estoque zero. A lógica delas
     # fará com que peçam peças ao almoxarifado assim que iniciarem.
@@ -0,0 +1,313 @@
+# inventory_redis.py
+
+from collections import namedtuple
+import redis.asyncio
+from utils import INVENTORY_BACKEND, NUM_PARTS, NUM_PRODUCTS
+
+# Scripts Lua que validam e consomem uma lista de itens de forma atômica no
+# servidor. Retornam uma lista vazia em caso de sucesso ou, sem decrementar nada,
+# {máximo disponível de todos os itens, posições (1-based) dos itens sem saldo...},
+# lidos no mesmo instante da verificação.
+
+# KEYS: uma chave string por item; ARGV[1]: quantidade.
+CONSUME_KEYS_LUA = """
+local qty = tonumber(ARGV[1])
+local available = qty
+local short = {}
+for i, key in ipairs(KEYS) do
+    local stock = math.max(tonumber(redis.call('GET', key) or '0'), 0)
+    if stock < qty then
+        table.insert(short, i)
+        available = math.min(available, stock)
+    end
+end
+if #short > 0 then
+    table.insert(short, 1, available)
+    return short
+end
+for _, key in ipairs(KEYS) do
+    redis.call('DECRBY', key, qty)
+end
+return {}
+"""
+
+# KEYS[1]: hash da entidade; ARGV[1]: quantidade; ARGV[2..n]: campos (índices).
+CONSUME_HASH_LUA = """
+local key = KEYS[1]
+local qty = tonumber(ARGV[1])
+local fields = {unpack(ARGV, 2)}
+local values = redis.call('HMGET', key, unpack(fields))
+local available = qty
+local short = {}
+for i, value in ipairs(values) do
+    local stock = math.max(tonumber(value or '0'), 0)
+    if stock < qty then
+        table.insert(short, i)
+        available = math.min(available, stock)
+    end
+end
+if #short > 0 then
+    table.insert(short, 1, available)
+    return short
+end
+for _, field in ipairs(fields) do
+    redis.call('HINCRBY', key, field, -qty)
+end
+return {}
+"""
+
+# Variantes "até qty": produzem o máximo possível (no máximo qty) com o saldo
+# atual. Retornam {produzido, posições (1-based) dos itens com saldo < qty...};
+# os itens listados são os que limitaram a produção.
+
+CONSUME_UP_TO_KEYS_LUA = """
+local qty = tonumber(ARGV[1])
+local produced = qty
+local short = {}
+for i, key in ipairs(KEYS) do
+    local stock = math.max(tonumber(redis.call('GET', key) or '0'), 0)
+    if stock < qty then
+        table.insert(short, i)
+        produced = math.min(produced, stock)
+    end
+end
+if produced > 0 then
+    for _, key in ipairs(KEYS) do
+        redis.call('DECRBY', key, produced)
+    end
+end
+table.insert(short, 1, produced)
+return short
+"""
+
+CONSUME_UP_TO_HASH_LUA = """
+local key = KEYS[1]
+local qty = tonumber(ARGV[1])
+local fields = {unpack(ARGV, 2)}
+local values = redis.call('HMGET', key, unpack(fields))
+local produced = qty
+local short = {}
+for i, value in ipairs(values) do
+    local stock = math.max(tonumber(value or '0'), 0)
+    if stock < qty then
+        table.insert(short, i)
+        produced = math.min(produced, stock)
+    end
+end
+if produced > 0 then
+    for _, field in ipairs(fields) do
+        redis.call('HINCRBY', key, field, -produced)
+    end
+end
+table.insert(short, 1, produced)
+return short
+"""
+
+
+# Falta de saldo apontada pelos scripts de consumo: quanto de cada item havia
+# disponível (o mínimo entre eles) e os índices dos itens sem saldo.
+Shortage = namedtuple('Shortage', ['available', 'short'])
+
+
+def _consume_result(indices, result):
+    """None se o consumo aconteceu; senão a Shortage lida pelo próprio script."""
+    if not result:
+        return None
+    available, *positions = result
+    return Shortage(int(available), [indices[position - 1] for position in positions])
+
+
+def _up_to_result(indices, result):
+    """Converte a resposta dos scripts 'até qty' em (quantidade produzida, índices limitantes)."""
+    produced, *positions = result
+    return int(produced), [indices[position - 1] for position in positions]
+
+
+class KeyInventory:
+    """Layout legado: cada item do estoque é uma chave string própria ('{prefix}:{i}')."""
+
+    def __init__(self, redis_client, prefix, size):
+        self.r = redis_client
+        self.prefix = prefix
+        self.size = size
+        self._consume = self.r.register_script(CONSUME_KEYS_LUA)
+        self._consume_up_to = self.r.register_script(CONSUME_UP_TO_KEYS_LUA)
+
+    def _key(self, idx):
+        return f"{self.prefix}:{idx}"
+
+    def get(self, idx):
+        return int(self.r.get(self._key(idx)) or 0)
+
+    def get_all(self):
+        """Lê o estoque de todos os itens em uma única ida ao Redis (MGET)."""
+        values = self.r.mget([self._key(i) for i in range(self.size)])
+        return [int(value or 0) for value in values]
+
+    def incr(self, idx, qty):
+        self.r.incrby(self._key(idx), qty)
+
+    def queue_add(self, pipe, amounts):
+        """Enfileira a soma de um vetor de quantidades em um pipeline do chamador."""
+        for i, amount in enumerate(amounts):
+            if amount:
+                pipe.incrby(self._key(i), amount)
+
+    def add(self, amounts):
+        """Soma um vetor de quantidades (positivas ou negativas) em um único pipeline."""
+        pipe = self.r.pipeline(transaction=False)
+        self.queue_add(pipe, amounts)
+        pipe.execute()
+
+    def set_all(self, value):
+        self.r.mset({self._key(i): value for i in range(self.size)})
+
+    def consume(self, indices, qty):
+        return _consume_result(indices, self._consume(keys=[self._key(i) for i in indices], args=[qty]))
+
+    def consume_up_to(self, indices, qty):
+        return _up_to_result(indices, self._consume_up_to(keys=[self._key(i) for i in indices], args=[qty]))
+
+
+class HashInventory:
+    """Layout em hash: todo o estoque da entidade fica em um único hash (campo = índice)."""
+
+    def __init__(self, redis_client, key, size):
+        self.r = redis_client
+        self.key = key
+        self.size = size
+        self._fields = [str(i) for i in range(size)]
+        self._consume = self.r.register_script(CONSUME_HASH_LUA)
+        self._consume_up_to = self.r.register_script(CONSUME_UP_TO_HASH_LUA)
+
+    def get(self, idx):
+        return int(self.r.hget(self.key, idx) or 0)
+
+    def get_all(self):
+        """Lê o estoque de todos os itens com um único HMGET."""
+        values = self.r.hmget(self.key, self._fields)
+        return [int(value or 0) for value in values]
+
+    def incr(self, idx, qty):
+        self.r.hincrby(self.key, idx, qty)
+
+    def queue_add(self, pipe, amounts):
+        """Enfileira a soma de um vetor de quantidades em um pipeline do chamador."""
+        for i, amount in enumerate(amounts):
+            if amount:
+                pipe.hincrby(self.key, i, amount)
+
+    def add(self, amounts):
+        """Soma um vetor de quantidades (positivas ou negativas) em um único pipeline."""
+        pipe = self.r.pipeline(transaction=False)
+        self.queue_add(pipe, amounts)
+        pipe.execute()
+
+    def set_all(self, value):
+        self.r.hset(self.key, mapping={field: value for field in self._fields})
+
+    def consume(self, indices, qty):
+        return _consume_result(indices, self._consume(keys=[self.key], args=[qty, *indices]))
+
+    def consume_up_to(self, indices, qty):
+        return _up_to_result(indices, self._consume_up_to(keys=[self.key], args=[qty, *indices]))
+
+
+class AsyncKeyInventory(KeyInventory):
+    """KeyInventory sobre redis.asyncio: mesmos comandos, métodos assíncronos."""
+
+    async def get(self, idx):
+        return int(await self.r.get(self._key(idx)) or 0)
+
+    async def get_all(self):
+        values = await self.r.mget([self._key(i) for i in range(self.size)])
+        return [int(value or 0) for value in values]
+
+    async def incr(self, idx, qty):
+        await self.r.incrby(self._key(idx), qty)
+
+    async def add(self, amounts):
+        pipe = self.r.pipeline(transaction=False)
+        self.queue_add(pipe, amounts)
+        await pipe.execute()
+
+    async def set_all(self, value):
+        await self.r.mset({self._key(i): value for i in range(self.size)})
+
+    async def consume(self, indices, qty):
+        return _consume_result(indices, await self._consume(keys=[self._key(i) for i in indices], args=[qty]))
+
+    async def consume_up_to(self, indices, qty):
+        result = await self._consume_up_to(keys=[self._key(i) for i in indices], args=[qty])
+        return _up_to_result(indices, result)
+
+
+class AsyncHashInventory(HashInventory):
+    """HashInventory sobre redis.asyncio: mesmos comandos, métodos assíncronos."""
+
+    async def get(self, idx):
+        return int(await self.r.hget(self.key, idx) or 0)
+
+    async def get_all(self):
+        values = await self.r.hmget(self.key, self._fields)
+        return [int(value or 0) for value in values]
+
+    async def incr(self, idx, qty):
+        await self.r.hincrby(self.key, idx, qty)
+
+    async def add(self, amounts):
+        pipe = self.r.pipeline(transaction=False)
+        self.queue_add(pipe, amounts)
+        await pipe.execute()
+
+    async def set_all(self, value):
+        await self.r.hset(self.key, mapping={field: value for field in self._fields})
+
+    async def consume(self, indices, qty):
+        return _consume_result(indices, await self._consume(keys=[self.key], args=[qty, *indices]))
+
+    async def consume_up_to(self, indices, qty):
+        return _up_to_result(indices, await self._consume_up_to(keys=[self.key], args=[qty, *indices]))
+
+
+def make_inventory(redis_client, prefix, hash_key, size):
+    """
+    Cria o backend de estoque configurado em utils.INVENTORY_BACKEND ('hash' ou 'keys').
+    Com um cliente redis.asyncio, retorna a variante assíncrona do mesmo backend.
+    """
+    is_async = isinstance(redis_client, redis.asyncio.Redis)
+    if INVENTORY_BACKEND == 'keys':
+        cls = AsyncKeyInventory if is_async else KeyInventory
+        return cls(redis_client, prefix, size)
+    cls = AsyncHashInventory if is_async else HashInventory
+    return cls(redis_client, hash_key, size)
+
+
+def warehouse_inventory(redis_client):
+    return make_inventory(redis_client, "warehouse:part", "warehouse:parts", NUM_PARTS)
+
+
+def line_inventory(redis_client, factory_id, line_id):
+    return make_inventory(
+        redis_client,
+        f"line:{factory_id}:{line_id}:part",
+        f"line:{factory_id}:{line_id}:parts",
+        NUM_PARTS
+    )
+
+
+def product_inventory(redis_client):
+    return make_inventory(redis_client, "product", "product:stock", NUM_PRODUCTS)
+
+
+def stock_keys(lines=()):
+    """
+    Chaves de estoque (no layout configurado) dos produtos, do almoxarifado e das
+    linhas [(factory_id, line_id)], para quem precisa ler tudo sem SCAN.
+    """
+    layouts = [("product", "product:stock", NUM_PRODUCTS), ("warehouse:part", "warehouse:parts", NUM_PARTS)]
+    layouts += [(f"line:{factory_id}:{line_id}:part", f"line:{factory_id}:{line_id}:parts", NUM_PARTS)
+                for factory_id, line_id in lines]
+    if INVENTORY_BACKEND == 'keys':
+        return [f"{prefix}:{i}" for prefix, _, size in layouts for i in range(size)]
+    return [hash_key for _, hash_key, _ in layouts]
@@ -0,0 +1,245 @@
+# kanban_state.py
+
+import re
+import threading
+import time
+import redis
+from inventory_redis import stock_keys
+from utils import (
+    print_update,
+    INVENTORY_BACKEND,
+    RED_ALERT_LINE,
+    YELLOW_ALERT_LINE,
+    RED_ALERT_WAREHOUSE,
+    YELLOW_ALERT_WAREHOUSE,
+    RED_ALERT_PRODUCT_STOCK
+)
+
+ENTITY_NAME = 'kanban-state'
+
+# Eventos de keyspace necessários: K = canal __keyspace@db__, g = comandos genéricos
+# (DEL etc.), h = comandos de hash, $ = comandos de string (layout legado 'keys').
+NOTIFY_EVENTS = 'Kgh$'
+# Janela para juntar várias notificações antes de reler as chaves tocadas
+NOTIFY_COALESCE = 0.2
+# Notificações de keyspace não são duráveis: de tempos em tempos tudo é relido
+FULL_RESYNC_INTERVAL = 60
+# Espera (segundos) antes de reconectar após uma falha do Redis; dobra a cada falha seguida
+RECONNECT_BACKOFF_MIN = 1
+RECONNECT_BACKOFF_MAX = 30
+
+# Chaves de estoque nos dois layouts (ver inventory_redis.py)
+HASH_KEY_PATTERNS = {
+    'product': re.compile(r"^product:stock$"),
+    'warehouse': re.compile(r"^warehouse:parts$"),
+    'line': re.compile(r"^line:([^:]+):([^:]+):parts$"),
+}
+LEGACY_KEY_PATTERNS = {
+    'product': re.compile(r"^product:(\d+)$"),
+    'warehouse': re.compile(r"^warehouse:part:(\d+)$"),
+    'line': re.compile(r"^line:([^:]+):([^:]+):part:(\d+)$"),
+}
+
+
+def product_color(count):
+    return ('green' if count >= RED_ALERT_PRODUCT_STOCK * 2 else
+            'yellow' if count >= RED_ALERT_PRODUCT_STOCK else
+            'red')
+
+
+def warehouse_color(count):
+    return ('green' if count >= YELLOW_ALERT_WAREHOUSE else
+            'yellow' if count >= RED_ALERT_WAREHOUSE else
+            'red')
+
+
+def line_color(count):
+    return ('green' if count >= YELLOW_ALERT_LINE else
+            'yellow' if count >= RED_ALERT_LINE else
+            'red')
+
+
+class KanbanStateCache:
+    """
+    Estado do Kanban mantido em memória e atualizado de forma incremental.
+
+    Depois de uma carga inicial, uma thread escuta as notificações de keyspace
+    do Redis para as chaves de estoque (produtos, almoxarifado e linhas) e relê
+    apenas as chaves tocadas, recalculando contagem e cor só dos itens que
+    mudaram. Com isso o dashboard pode mostrar também os buffers de cada linha
+    sem reler centenas de chaves a cada atualização.
+
+    As ressincronizações releem as chaves conhecidas (produtos, almoxarifado e
+    as linhas da topologia, mais as que aparecerem nas notificações), sem SCAN.
+    Se a conexão com o Redis cair, a thread reconecta com espera crescente.
+    """
+
+    def __init__(self, redis_client, on_change=None, lines=()):
+        self.r = redis_client
+        self.on_change = on_change
+        self.products = {}
+        self.parts = {}
+        self.lines = {}
+        self.known_keys = set(stock_keys(lines))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._backoff = RECONNECT_BACKOFF_MIN
+        self._db = self.r.connection_pool.connection_kwargs.get('db', 0)
+
+    # --- Leitura e aplicação de valores ---
+
+    def _patterns(self):
+        return LEGACY_KEY_PATTERNS if INVENTORY_BACKEND == 'keys' else HASH_KEY_PATTERNS
+
+    def _classify(self, key):
+        """Retorna (tipo, id da linha, índice do item) para uma chave de estoque, ou None."""
+        for kind, pattern in self._patterns().items():
+            match = pattern.match(key)
+            if not match:
+                continue
+            groups = match.groups()
+            line_id = f"{groups[0]}-{groups[1]}" if kind == 'line' else None
+            index = groups[-1] if INVENTORY_BACKEND == 'keys' else None
+            return kind, line_id, index
+        return None
+
+    def _target(self, kind, line_id):
+        if kind == 'product':
+            return self.products, product_color
+        if kind == 'warehouse':
+            return self.parts, warehouse_color
+        return self.lines.setdefault(line_id, {}), line_color
+
+    def _apply(self, kind, line_id, values):
+        """Aplica {índice: contagem} ao estado; retorna True se algum item mudou."""
+        if kind == 'line' and line_id not in self.lines and not any(values.values()):
+            # Linha conhecida (topologia) que ainda não tem estoque: fica fora do painel.
+            return False
+        items, color_of = self._target(kind, line_id)
+        if not values and INVENTORY_BACKEND != 'keys':
+            # Hash removido (ex.: FLUSHDB do init_redis.py): a entidade fica sem itens.
+            changed = bool(items)
+            items.clear()
+            return changed
+        changed = False
+        for index, value in values.items():
+            item = items.get(index)
+            if value is None and item is None:
+                # Chave (layout 'keys') que não existe: o item não aparece.
+                continue
+            count = int(value or 0)
+            if item is not None and item['count'] == count:
+                continue
+            items[index] = {'name': index, 'count': count, 'color': color_of(count)}
+            changed = True
+        return changed
+
+    def _reload(self, keys):
+        """Relê apenas as chaves indicadas (um pipeline) e atualiza os itens tocados."""
+        classified = [(key, self._classify(key)) for key in keys]
+        classified = [(key, info) for key, info in classified if info is not None]
+        if not classified:
+            return False
+        self.known_keys.update(key for key, _ in classified)
+
+        pipe = self.r.pipeline(transaction=False)
+        for key, _ in classified:
+            if INVENTORY_BACKEND == 'keys':
+                pipe.get(key)
+            else:
+                pipe.hgetall(key)
+        results = pipe.execute()
+
+        changed = False
+        with self._lock:
+            for (key, (kind, line_id, index)), value in zip(classified, results):
+                values = {index: value} if INVENTORY_BACKEND == 'keys' else value
+                changed |= self._apply(kind, line_id, values)
+        return changed
+
+    def full_reload(self):
+        """Carga completa das chaves conhecidas, usada só no início e nas ressincronizações."""
+        if self._reload(list(self.known_keys)) and self.on_change:
+            self.on_change()
+
+    # --- Notificações ---
+
+    def _enable_notifications(self):
+        try:
+            current = self.r.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+            missing = ''.join(flag for flag in NOTIFY_EVENTS if flag not in current)
+            if missing:
+                self.r.config_set('notify-keyspace-events', current + missing)
+            return True
+        except redis.exceptions.RedisError as e:
+            # Ex.: Redis gerenciado que bloqueia CONFIG SET (ou fora do ar: a thread
+            # reconecta); seguimos só com ressincronizações.
+            print_update(f"Não foi possível ativar notificações de keyspace: {e}", ENTITY_NAME)
+            return False
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except redis.exceptions.RedisError as e:
+                print_update(f"Conexão com o Redis perdida ({e}). Reconectando em {self._backoff}s.", ENTITY_NAME)
+                time.sleep(self._backoff)
+                self._backoff = min(self._backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def _listen(self):
+        prefix = f"__keyspace@{self._db}__:"
+        pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.psubscribe(f"{prefix}product:*", f"{prefix}warehouse:*", f"{prefix}line:*")
+            # As notificações perdidas enquanto a conexão estava fora são cobertas pela carga completa.
+            self.full_reload()
+            self._backoff = RECONNECT_BACKOFF_MIN
+            self._follow(pubsub, prefix)
+        finally:
+            pubsub.close()
+
+    def _follow(self, pubsub, prefix):
+        last_resync = time.monotonic()
+        dirty = set()
+        first_dirty = 0.0
+        while True:
+            message = pubsub.get_message(timeout=NOTIFY_COALESCE)
+            if message is not None:
+                if not dirty:
+                    first_dirty = time.monotonic()
+                dirty.add(message['channel'][len(prefix):])
+            # Relê o que foi tocado quando a rajada acaba ou a janela de coalescência estoura.
+            if dirty and (message is None or time.monotonic() - first_dirty >= NOTIFY_COALESCE):
+                keys, dirty = dirty, set()
+                if self._reload(keys) and self.on_change:
+                    self.on_change()
+            if time.monotonic() - last_resync >= FULL_RESYNC_INTERVAL:
+                last_resync = time.monotonic()
+                self.full_reload()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._enable_notifications()
+            self._thread = threading.Thread(target=self._run, name='kanban-state', daemon=True)
+            self._thread.start()
+
+    # --- Consulta ---
+
+    def snapshot(self):
+        """Cópia do estado atual no formato usado pelo template e pela API."""
+        def ordered(items):
+            return [dict(items[index]) for index in sorted(items, key=int)]
+
+        with self._lock:
+            lines = []
+            for line_id in sorted(self.lines, key=lambda name: tuple(int(x) for x in name.split('-'))):
+                parts = ordered(self.lines[line_id])
+                lines.append({
+                    'name': line_id,
+                    'parts': parts,
+                    'red': sum(1 for part in parts if part['color'] == 'red'),
+                    'yellow': sum(1 for part in parts if part['color'] == 'yellow'),
+                })
+            return ordered(self.products), ordered(self.parts), lines
@@ -1,20 +1,21 @@
-from flask import Flask, render_template
+from flask import Flask, Response, jsonify, render_template
+import json
 import redis
 import threading
 import time
+from kanban_state import KanbanStateCache
+from metrics import fetch_snapshots, render_prometheus
+from supervisor import load_topology
 from utils import (
-    REDIS_HOST,
-    REDIS_PORT,
-    RED_ALERT_WAREHOUSE,
-    YELLOW_ALERT_WAREHOUSE,
-    RED_ALERT_PRODUCT_STOCK,
+    make_redis_client,
+    pool_stats,
     LOG_RESTOCK_KEY,
     LOG_CONSUMPTION_KEY,
     MAX_LOG
 )
 
 app = Flask(__name__)
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+r = make_redis_client()
 
 # Intervalo de atualização (segundos)
 REFRESH_INTERVAL = 2
@@ -27,31 +28,10 @@ def fetch_simulation_day():
         day = 0
     return day
 
-# Função para ler os dados do Kanban (peças e produtos)
+# Função para ler os dados do Kanban (peças, produtos e buffers das linhas),
+# servidos pelo cache incremental em memória em vez de consultas ao Redis
 def fetch_kanban_data():
-    # Produtos acabados
-    product_keys = sorted(r.scan_iter("product:*"))
-    products = []
-    for key in product_keys:
-        name = key.split(':')[-1]
-        count = int(r.get(key) or 0)
-        color = ('green' if count >= RED_ALERT_PRODUCT_STOCK * 2 else
-                 'yellow' if count >= RED_ALERT_PRODUCT_STOCK else
-                 'red')
-        products.append({'name': name, 'count': count, 'color': color})
-
-    # Peças no almoxarifado
-    warehouse_keys = sorted(r.scan_iter("warehouse:part:*"))
-    parts = []
-    for key in warehouse_keys:
-        name = key.split(':')[-1]
-        count = int(r.get(key) or 0)
-        color = ('green' if count >= YELLOW_ALERT_WAREHOUSE else
-                 'yellow' if count >= RED_ALERT_WAREHOUSE else
-                 'red')
-        parts.append({'name': name, 'count': count, 'color': color})
-
-    return products, parts
+    return state_cache.snapshot()
 
 # Função para obter logs de requisições de reabastecimento
 def fetch_restock_logs():
@@ -62,21 +42,135 @@ def fetch_restock_logs():
 def fetch_consumption_logs():
     return r.lrange(LOG_CONSUMPTION_KEY, 0, MAX_LOG - 1) or []
 
+# Função para montar o estado completo exibido no dashboard
+def fetch_snapshot():
+    products, parts, lines = fetch_kanban_data()
+    return {
+        'sim_day': fetch_simulation_day(),
+        'products': products,
+        'parts': parts,
+        'lines': lines,
+        'restocks': fetch_restock_logs(),
+        'consumptions': fetch_consumption_logs(),
+    }
+
+EMPTY_SNAPSHOT = {'sim_day': 0, 'products': [], 'parts': [], 'lines': [], 'restocks': [], 'consumptions': []}
+
+class SnapshotCache:
+    """
+    Cache do snapshot do dashboard, compartilhado por todos os visitantes.
+    Uma única thread monta o snapshot a cada REFRESH_INTERVAL segundos, ou antes
+    disso quando o cache de estado avisa que o estoque mudou; páginas, a API
+    JSON e os streams SSE só leem a cópia em memória. Assim, o custo no Redis não
+    depende de quantas abas estão abertas.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.snapshot = None
+        self.version = 0
+        self._changed = threading.Condition()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def request_refresh(self):
+        """Antecipa a próxima atualização (chamado pelo cache de estado a cada mudança)."""
+        self._wake.set()
+
+    def _refresh(self):
+        try:
+            snapshot = fetch_snapshot()
+        except redis.exceptions.RedisError as e:
+            print(f"ERRO ao atualizar o snapshot do dashboard: {e}")
+            return
+        with self._changed:
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                self.version += 1
+                self._changed.notify_all()
+
+    def _run(self):
+        while True:
+            self._refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        with self._changed:
+            if self._thread is not None:
+                return
+            state_cache.start()
+            self._thread = threading.Thread(target=self._run, name='snapshot-cache', daemon=True)
+            self._thread.start()
+
+    def get(self):
+        """Retorna (versão, snapshot), lendo do Redis só se o cache ainda estiver vazio."""
+        self.start()
+        if self.snapshot is None:
+            self._refresh()
+        return self.version, self.snapshot or EMPTY_SNAPSHOT
+
+    def wait_for_change(self, version, timeout):
+        """Bloqueia até existir uma versão mais nova que 'version' (ou até o timeout)."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.snapshot or EMPTY_SNAPSHOT
+
+snapshot_cache = SnapshotCache(REFRESH_INTERVAL)
+
+def topology_lines(path="topology.json"):
+    """Linhas [(factory_id, line_id)] da topologia, cujos estoques o cache relê nas ressincronizações."""
+    try:
+        specs = load_topology(path)[0]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"AVISO: topologia indisponível ({e}); as linhas aparecem a partir das notificações.")
+        return []
+    return [tuple(reversed(spec.split(":")[1:])) for spec in specs if spec.startswith("line:")]
+
+state_cache = KanbanStateCache(r, on_change=snapshot_cache.request_refresh, lines=topology_lines())
+
+# Comentário SSE enviado periodicamente para manter a conexão viva em proxies
+SSE_KEEPALIVE = 15
+
 @app.route("/")
 def index():
-    sim_day = fetch_simulation_day()
-    products, parts = fetch_kanban_data()
-    restock_logs = fetch_restock_logs()
-    consumption_logs = fetch_consumption_logs()
-    return render_template(
-        'index.html',
-        sim_day=sim_day,
-        products=products,
-        parts=parts,
-        restocks=restock_logs,
-        consumptions=consumption_logs,
-        refresh=REFRESH_INTERVAL
-    )
+    _, snapshot = snapshot_cache.get()
+    return render_template('index.html', **snapshot)
+
+@app.route("/api/snapshot")
+def api_snapshot():
+    version, snapshot = snapshot_cache.get()
+    return jsonify(version=version, **snapshot)
+
+@app.route("/stream")
+def stream():
+    """Server-Sent Events: envia o snapshot sempre que ele muda."""
+    def events():
+        version, snapshot = snapshot_cache.get()
+        yield f"id: {version}\ndata: {json.dumps(snapshot)}\n\n"
+        while True:
+            new_version, snapshot = snapshot_cache.wait_for_change(version, SSE_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            yield f"id: {version}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route("/metrics")
+def metrics():
+    """Métricas de todas as entidades no formato do Prometheus (lidas do Redis a cada coleta)."""
+    try:
+        body = render_prometheus(fetch_snapshots(r))
+    except redis.exceptions.RedisError as e:
+        return Response(f"# ERRO ao ler as métricas do Redis: {e}\n", status=503, mimetype='text/plain')
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route("/api/pool")
+def pool():
+    """Utilização do pool de conexões Redis deste processo do dashboard."""
+    return jsonify(pool_stats(r))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
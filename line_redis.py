@@ -1,26 +1,46 @@
 # line_redis.py
 
+import asyncio
+import numpy as np
 import redis
 import threading
 import time
 import sys
+from bom_model import BomMatrix
+from inventory_redis import line_inventory
+from metrics import EntityMetrics
+from reorder_policy import AdaptiveReorder, RestockTrigger
+from restock_requests import RequestTracker, REPLY_COMPLETE
+from transport_redis import make_transport
+from warehouse_shards import ShardRouter
 from utils import (
-    string_to_list,
+    make_redis_client,
+    call_later,
+    async_call_later,
+    format_pool_stats,
     list_to_string,
+    encode_message,
+    decode_message,
+    line_channel,
+    warehouse_channel,
+    new_trace_id,
     print_update,
+    print_debug,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_LINE,
     YELLOW_ALERT_LINE,
-    REDIS_HOST,
-    REDIS_PORT,
     NUM_PARTS,
     NUM_PRODUCTS,
-    LOG_RESTOCK_KEY
+    LOG_RESTOCK_KEY,
+    PRODUCTION_MODE,
+    REORDER_POLICY,
+    REORDER_LEAD_TIME_LINE,
+    REORDER_COVER_DAYS_LINE,
+    RESTOCK_TRIGGER_DEBOUNCE,
+    RESTOCK_REQUEST_TIMEOUT
 )
 
-BASE_KIT_SIZE = 43
-
 class LineRedis:
     def __init__(self, line_id, factory_id, redis_client):
         self.r = redis_client
@@ -28,114 +48,374 @@ class LineRedis:
         self.factory_id = str(factory_id)
         self.entity_name = f'line-{self.factory_id}-{self.line_id}'
         self.is_waiting_for_parts = False
-        self.products_necessary_parts = self._read_products_necessary_parts()
+        # Matriz produtos x peças (kit base incluído), com índices 0-based.
+        self.bom = self._read_bom()
+        self.inventory = line_inventory(self.r, self.factory_id, self.line_id)
+        self.channel = line_channel(self.factory_id, self.line_id)
+        self.transport = make_transport(self.r, self.entity_name)
+        self.metrics = EntityMetrics(self.entity_name, self.r)
+        # Velocidade de consumo por peça e tempo de reposição medido (pontos de pedido adaptativos).
+        self.reorder = AdaptiveReorder(
+            NUM_PARTS, REORDER_LEAD_TIME_LINE, REORDER_COVER_DAYS_LINE, floor=YELLOW_ALERT_LINE
+        )
+        self.clock = time.monotonic
+        self._ordered_at = None
+        # Revisão do buffer disparada pela própria produção ao cruzar o ponto de pedido.
+        self.restock_trigger = RestockTrigger()
+        self.call_later = call_later
+        # Pedido ao almoxarifado aguardando resposta (id, prazo e falhas seguidas).
+        self.requests = RequestTracker(RESTOCK_REQUEST_TIMEOUT)
+        # Cada pedido é dividido entre os shards do almoxarifado donos das peças.
+        self.router = ShardRouter()
+        # As revisões rodam no loop de dias, no listener e nos temporizadores: a
+        # verificação de is_waiting_for_parts e o envio do pedido não podem se intercalar.
+        self._review_lock = threading.Lock()
 
-    def _read_products_necessary_parts(self):
+    def _read_bom(self):
         try:
-            with open("products_and_parts.txt", "r") as f:
-                return [string_to_list(line.strip()) for line in f.readlines()]
+            return BomMatrix.from_file()
         except FileNotFoundError:
             print_update(f"ERRO CRÍTICO: Arquivo 'products_and_parts.txt' não encontrado!", self.entity_name)
             sys.exit(1)
 
-    def _get_part_stock(self, part_id):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        return int(self.r.get(key) or 0)
+    def receive_parts_from_warehouse(self, parts_received, request_id=0, status=REPLY_COMPLETE, shard=0):
+        print_update("Recebendo lote de peças do Almoxarifado.", self.entity_name)
+        # Todos os incrementos vão em um único pipeline (uma ida ao Redis).
+        self.inventory.add(parts_received)
+        self._parts_received(parts_received, request_id, status, shard)
 
-    def _increment_part_stock(self, part_id, qty):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        self.r.incrby(key, qty)
+    def _parts_received(self, parts_received, request_id, status, shard):
+        """Atualiza o gatilho e o pedido em andamento depois que as peças entraram no buffer."""
+        self.restock_trigger.add(parts_received)
+        self._settle_request(request_id, status == REPLY_COMPLETE, "ENVIO PARCIAL", shard)
+        print_update("Estoque da linha reabastecido.", self.entity_name)
 
-    def _decrement_part_stock(self, part_id, qty):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        self.r.decrby(key, qty)
-    
-    def receive_parts_from_warehouse(self, parts_received):
-        print_update("Recebendo lote de peças do Almoxarifado.", self.entity_name)
-        for i, amount in enumerate(parts_received):
-            if amount > 0:
-                self._increment_part_stock(i, amount)
+    def reject_parts(self, request_id, shard=0):
+        self._settle_request(request_id, False, "PEDIDO RECUSADO pelo almoxarifado", shard)
+
+    def _request_deadline(self, request_id):
+        self._settle_request(request_id, False, "PRAZO ESGOTADO sem resposta")
+
+    def _settle_request(self, request_id, ok, failure, shard=None):
+        """
+        Registra a resposta de um shard (ou o prazo vencido) e, com o pedido
+        encerrado, libera as revisões. Se alguma resposta não atendeu a sua parte
+        do pedido, a linha continua fora das revisões até a nova tentativa, agendada
+        com espera crescente. Respostas de pedidos já substituídos são ignoradas.
+        """
+        request = self.requests.close(request_id, ok, shard)
+        if request is None:
+            return
+        if request.ok:
+            self._record_delivery()
+            return
+        delay = self.requests.backoff()
+        print_update(f"{failure} (pedido {request.request_id}). Nova tentativa em {delay:.1f}s.", self.entity_name)
+        self.call_later(delay, self.metrics.timer(self._retry_order))
+
+    def _retry_order(self):
+        with self._review_lock:
+            if self._reopen_reviews():
+                self._review_buffer()
+
+    def _reopen_reviews(self):
+        """Libera as revisões para a nova tentativa; retorna False se outro pedido saiu durante a espera (produção parcial)."""
+        if self.requests.outstanding:
+            return False
         self.is_waiting_for_parts = False
-        print_update("Estoque da linha reabastecido.", self.entity_name)
+        return True
+
+    def _record_delivery(self):
+        self.is_waiting_for_parts = False
+        if self._ordered_at is not None:
+            self.reorder.record_lead_time((self.clock() - self._ordered_at) / TIME_SLEEP)
+            self._ordered_at = None
+
+    def _parts_to_order(self, stocks):
+        """Calcula o vetor de flags de peças a pedir e o status do buffer a partir do estoque."""
+        stocks = np.asarray(stocks)
+        red = stocks < RED_ALERT_LINE
+        flags = stocks < YELLOW_ALERT_LINE
+        if red.any():
+            # Como sempre foi: depois da primeira peça em vermelho, as que estão só
+            # em amarelo não entram no pedido.
+            first_red = int(np.argmax(red))
+            flags[first_red:] = red[first_red:]
+            status = "RED"
+        else:
+            status = "YELLOW" if flags.any() else "GREEN"
+        return flags.astype(int).tolist(), status
+
+    @staticmethod
+    def _starvation(stocks):
+        """Quantas peças do buffer estão abaixo do alerta vermelho."""
+        return int(np.count_nonzero(np.asarray(stocks) < RED_ALERT_LINE))
+
+    @staticmethod
+    def _describe_parts(part_indices, limit=10):
+        parts = ", ".join(f"Peça {i + 1}" for i in part_indices[:limit])
+        return parts + (", ..." if len(part_indices) > limit else "")
+
+    def _line_break_message(self, qty, shortage):
+        """Descreve a quebra de linha com todas as peças em falta, lidas pelo próprio script de consumo."""
+        short = shortage.short
+        kits = " e ".join(sorted({"KIT BASE" if self.bom.is_base_kit(i) else "KIT VARIAÇÃO" for i in short}))
+        return (f"QUEBRA DE LINHA! Faltam {len(short)} peças do {kits} ({self._describe_parts(short)}) "
+                f"para produzir {qty} unids (máximo possível: {shortage.available}).")
+
+    def _order_vector(self, stocks, parts_to_order_flags):
+        """
+        Vetor do pedido: quantidades pelos pontos de pedido adaptativos ou, antes de
+        haver histórico (ou com REORDER_POLICY = 'static'), as flags dos alertas fixos.
+        """
+        if REORDER_POLICY == 'adaptive' and self.reorder.ready:
+            return self.reorder.order_quantities(stocks)
+        return parts_to_order_flags
+
+    def _restock_request(self, parts_to_order, starvation):
+        """
+        Abre o pedido e retorna ([(canal do shard, mensagem)], texto do log de
+        reabastecimento). parts_to_order traz 1 (lote padrão) ou a quantidade pedida
+        de cada peça e é dividido entre os shards do almoxarifado; starvation (peças
+        em vermelho) é usado pelo almoxarifado para priorizar a linha. Cada pedido
+        abre o seu próprio trace (ciclo de reposição), mesmo quando feito durante o
+        tratamento de uma ordem de produção; as partes compartilham id e trace.
+        """
+        pieces = self.router.split(parts_to_order)
+        request = self.requests.open(self.clock(), [shard for shard, _ in pieces])
+        fields = [self.line_id, self.factory_id, starvation, request.request_id]
+        trace_id = new_trace_id()
+        messages = [(warehouse_channel(shard), encode_message("send_parts", fields, piece, trace_id=trace_id))
+                    for shard, piece in pieces]
+        payload = list_to_string(parts_to_order)
+        # <<< PASSO DE DEBUG: Adicionamos este print para confirmar o envio >>>
+        print_debug(f"!!! ENVIANDO MENSAGEM para o almoxarifado ({len(messages)} shards): {payload}", self.entity_name)
+        return request, messages, f"Linha {self.line_id}-{self.factory_id} pediu peças: {payload}"
+
+    def _queue_order(self, pipe, parts_to_order, starvation):
+        """Abre o pedido, enfileira no pipeline as partes para os shards e o log, e arma o prazo."""
+        self.is_waiting_for_parts = True
+        if self._ordered_at is None:
+            self._ordered_at = self.clock()
+        request, messages, log = self._restock_request(parts_to_order, starvation)
+        for channel, msg in messages:
+            self.transport.queue_publish(pipe, channel, msg)
+        pipe.lpush(LOG_RESTOCK_KEY, log)
+        self.call_later(self.requests.timeout, self.metrics.timer(self._request_deadline), request.request_id)
+
+    def _order_parts(self, parts_to_order, starvation):
+        pipe = self.r.pipeline(transaction=False)
+        self._queue_order(pipe, parts_to_order, starvation)
+        pipe.execute()
 
     def check_and_order_parts(self):
+        # Chamado uma vez por dia: fecha o consumo do dia para a velocidade por peça.
+        self.reorder.close_day()
+        self.review_buffer()
+
+    def _after_consumption(self, consumed):
+        """Agenda uma revisão do buffer se a baixa fez alguma peça cruzar o ponto de pedido."""
+        if self.restock_trigger.consume(consumed, self.reorder.levels(YELLOW_ALERT_LINE)):
+            self.call_later(RESTOCK_TRIGGER_DEBOUNCE, self.metrics.timer(self._triggered_review))
+
+    def _triggered_review(self):
+        self.restock_trigger.release()
+        self.review_buffer()
+
+    def review_buffer(self):
+        """Lê o buffer e pede ao almoxarifado as peças abaixo do ponto de pedido."""
+        with self._review_lock:
+            self._review_buffer()
+
+    def _review_buffer(self):
         if self.is_waiting_for_parts:
             return
+        order = self._buffer_order(self.inventory.get_all())
+        if order:
+            self._order_parts(*order)
 
-        parts_to_order_flags = [0] * NUM_PARTS
-        status = "GREEN"
-        
-        for i in range(NUM_PARTS):
-            stock = self._get_part_stock(i)
-            if stock < RED_ALERT_LINE:
-                status = "RED"
-                parts_to_order_flags[i] = 1
-            elif stock < YELLOW_ALERT_LINE and status != "RED":
-                status = "YELLOW"
-                parts_to_order_flags[i] = 1
+    def _buffer_order(self, stocks):
+        """Decide a revisão a partir do buffer lido: (vetor do pedido, peças em vermelho), ou None se nada falta."""
+        self.restock_trigger.sync(stocks)
+        parts_to_order_flags, status = self._parts_to_order(stocks)
         
         print_update(f"Status do buffer de peças: {status}", self.entity_name)
 
-        if any(parts_to_order_flags):
-            self.is_waiting_for_parts = True
-            payload = list_to_string(parts_to_order_flags)
-            msg = f"{self.line_id}/{self.factory_id}/send_parts/{payload}"
-            
-            # <<< PASSO DE DEBUG: Adicionamos este print para confirmar o envio >>>
-            print_update(f"!!! ENVIANDO MENSAGEM para 'channel:warehouse': {msg}", self.entity_name)
-            self.r.publish("channel:warehouse", msg)
-            self.r.lpush(LOG_RESTOCK_KEY, f"Linha {self.line_id}-{self.factory_id} pediu peças: {payload}")
+        parts_to_order = self._order_vector(stocks, parts_to_order_flags)
+        if any(parts_to_order):
+            return parts_to_order, self._starvation(stocks)
+        return None
 
-    def execute_production_order(self, product_idx_str, qty_str):
+    def _partial_production(self, product_idx, qty, produced, limiting):
+        """
+        Registra uma produção parcial (modo 'partial') e retorna o vetor de flags do
+        pedido de reabastecimento só com as peças que limitaram a produção.
+        """
+        parts = self._describe_parts(limiting)
+        if produced:
+            print_update(f"PRODUÇÃO PARCIAL: {produced} de {qty} unids do produto {product_idx + 1}. "
+                         f"Peças limitantes: {parts}.", self.entity_name)
+        else:
+            print_update(f"QUEBRA DE LINHA! Nenhuma unid do produto {product_idx + 1} produzida. "
+                         f"Peças limitantes: {parts}.", self.entity_name)
+        flags = [0] * NUM_PARTS
+        for part_idx in limiting:
+            flags[part_idx] = 1
+        return flags
+
+    def _full_production(self, qty, shortage):
+        """Resultado da baixa do BOM inteiro (modo 'all_or_nothing'): a quantidade produzida, 0 na quebra de linha."""
+        if shortage:
+            print_update(self._line_break_message(qty, shortage), self.entity_name)
+            return 0
+        return qty
+
+    def _finish_production(self, product_idx, produced):
+        """Registra a baixa da produção e monta a mensagem para o estoque de produtos."""
+        self._after_consumption(self.bom.need(product_idx, produced))
+        print_update(f"SUCESSO: Produziu {produced} unids do produto {product_idx + 1}. Notificando estoque.", self.entity_name)
+        return encode_message("receive_products", [product_idx, self.line_id, self.factory_id, produced])
+
+    def _read_production_order(self, product_idx_str, qty_str):
+        """Interpreta a ordem de produção e registra o consumo pedido; retorna (produto, quantidade, peças do BOM)."""
         product_idx = int(product_idx_str)
         qty = int(qty_str)
         print_update(f"Recebida ordem de produção para {qty} unids do produto {product_idx + 1}.", self.entity_name)
+        # A velocidade usa a baixa pedida pela ordem, e não só a produzida: com a
+        # linha desabastecida, medir só o produzido subestimaria o consumo.
+        self.reorder.record_consumption(self.bom.need(product_idx, qty))
+        return product_idx, qty, self.bom.parts_of(product_idx)
 
-        parts_for_this_product = self.products_necessary_parts[product_idx]
-        
-        for i in range(BASE_KIT_SIZE):
-            if self._get_part_stock(i) < qty:
-                print_update(f"QUEBRA DE LINHA! Faltam peças do KIT BASE (Peça {i}) para produzir {qty} unids.", self.entity_name)
-                return
-        for part_id in parts_for_this_product:
-            if self._get_part_stock(part_id - 1) < qty:
-                print_update(f"QUEBRA DE LINHA! Faltam peças do KIT VARIAÇÃO (Peça {part_id}) para produzir {qty} unids.", self.entity_name)
-                return
-
-        for i in range(BASE_KIT_SIZE):
-            self._decrement_part_stock(i, qty)
-        for part_id in parts_for_this_product:
-            self._decrement_part_stock(part_id - 1, qty)
-
-        msg = f"receive_products/{product_idx}/{self.line_id}/{self.factory_id}/{qty}"
-        self.r.publish("channel:product_stock", msg)
-        print_update(f"SUCESSO: Produziu {qty} unids do produto {product_idx + 1}. Notificando estoque.", self.entity_name)
+    def execute_production_order(self, product_idx_str, qty_str):
+        product_idx, qty, parts = self._read_production_order(product_idx_str, qty_str)
+
+        if PRODUCTION_MODE == 'partial':
+            # Produz o máximo possível em uma única chamada atômica e pede na hora
+            # só as peças limitantes, mesmo com outro pedido em andamento.
+            produced, limiting = self.inventory.consume_up_to(parts, qty)
+            if produced < qty:
+                with self._review_lock:
+                    self._order_parts(self._partial_production(product_idx, qty, produced, limiting), len(limiting))
+        else:
+            # Verificação e baixa de todo o BOM em uma única chamada atômica (script Lua).
+            produced = self._full_production(qty, self.inventory.consume(parts, qty))
+
+        if produced:
+            self.transport.publish("channel:product_stock", self._finish_production(product_idx, produced))
 
     def listen(self):
-        pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:line")
-        print_update(f"Ouvindo o canal 'channel:line'...", self.entity_name)
-
-        for message in pubsub.listen():
-            if message["type"] != "message":
-                continue
-
-            data = message["data"]
-            parts = data.split("/")
-            command = parts[0]
-            
-            if command == "receive_parts":
-                msg_line_id, msg_factory_id = parts[1], parts[2]
-                if msg_line_id == self.line_id and msg_factory_id == self.factory_id:
-                    payload = parts[3]
-                    parts_to_receive = string_to_list(payload)
-                    self.receive_parts_from_warehouse(parts_to_receive)
-            
-            elif command == "receive_order":
-                msg_line_id, msg_factory_id = parts[1], parts[2]
-                if msg_line_id == self.line_id and msg_factory_id == self.factory_id:
-                    prod_idx, qty = parts[3], parts[4]
-                    self.execute_production_order(prod_idx, qty)
+        print_update(f"Ouvindo o canal '{self.channel}'...", self.entity_name)
+
+        for data in self.transport.listen(self.channel):
+            self.metrics.dispatch(self.handle_message, data, self.transport)
+
+    def _route(self, msg):
+        """Retorna o handler e os argumentos de uma mensagem, ou None se ela não é para a linha."""
+        # O canal já é exclusivo desta linha, então não é preciso filtrar por id.
+        if msg.command == "receive_parts":
+            # Campos: line_id, factory_id e, a partir dos pedidos com id, request_id,
+            # status e o shard do almoxarifado que respondeu.
+            return self.receive_parts_from_warehouse, (msg.vector, *msg.fields[2:5])
+        if msg.command == "reject_parts":
+            return self.reject_parts, msg.fields[2:4]
+        if msg.command == "receive_order":
+            # Campos: line_id, factory_id, produto e quantidade.
+            return self.execute_production_order, msg.fields[2:4]
+        return None
+
+    def handle_message(self, data):
+        route = self._route(decode_message(data))
+        if route:
+            handler, args = route
+            handler(*args)
+
+class AsyncLineRedis(LineRedis):
+    """
+    Variante asyncio da linha (redis.asyncio), para várias entidades em um só
+    processo. As decisões ficam nos helpers da LineRedis; aqui só as idas ao
+    Redis e ao transporte são aguardadas.
+    """
+
+    # Último dia começado pelo run(): reiniciada pelo async_runtime, a tarefa continua dele.
+    day = 0
+
+    def __init__(self, line_id, factory_id, redis_client):
+        super().__init__(line_id, factory_id, redis_client)
+        self.call_later = async_call_later
+        # A leitura do buffer cede o loop: duas revisões ainda podem se intercalar.
+        self._review_lock = asyncio.Lock()
+
+    async def receive_parts_from_warehouse(self, parts_received, request_id=0, status=REPLY_COMPLETE, shard=0):
+        print_update("Recebendo lote de peças do Almoxarifado.", self.entity_name)
+        await self.inventory.add(parts_received)
+        self._parts_received(parts_received, request_id, status, shard)
+
+    async def reject_parts(self, request_id, shard=0):
+        super().reject_parts(request_id, shard)
+
+    async def _request_deadline(self, request_id):
+        super()._request_deadline(request_id)
+
+    async def _retry_order(self):
+        async with self._review_lock:
+            if self._reopen_reviews():
+                await self._review_buffer()
+
+    async def _order_parts(self, parts_to_order, starvation):
+        pipe = self.r.pipeline(transaction=False)
+        self._queue_order(pipe, parts_to_order, starvation)
+        await pipe.execute()
+
+    async def check_and_order_parts(self):
+        self.reorder.close_day()
+        await self.review_buffer()
+
+    async def _triggered_review(self):
+        self.restock_trigger.release()
+        await self.review_buffer()
+
+    async def review_buffer(self):
+        async with self._review_lock:
+            await self._review_buffer()
+
+    async def _review_buffer(self):
+        if self.is_waiting_for_parts:
+            return
+        order = self._buffer_order(await self.inventory.get_all())
+        if order:
+            await self._order_parts(*order)
+
+    async def execute_production_order(self, product_idx_str, qty_str):
+        product_idx, qty, parts = self._read_production_order(product_idx_str, qty_str)
+        if PRODUCTION_MODE == 'partial':
+            produced, limiting = await self.inventory.consume_up_to(parts, qty)
+            if produced < qty:
+                async with self._review_lock:
+                    await self._order_parts(self._partial_production(product_idx, qty, produced, limiting), len(limiting))
+        else:
+            produced = self._full_production(qty, await self.inventory.consume(parts, qty))
+        if produced:
+            await self.transport.publish("channel:product_stock", self._finish_production(product_idx, produced))
+
+    async def listen(self):
+        print_update(f"Ouvindo o canal '{self.channel}'...", self.entity_name)
+        async for data in self.transport.listen(self.channel):
+            await self.metrics.dispatch_async(self.handle_message, data, self.transport)
+
+    async def handle_message(self, data):
+        route = self._route(decode_message(data))
+        if route:
+            handler, args = route
+            await handler(*args)
+
+    async def run(self):
+        """Loop de dias, equivalente ao de main()."""
+        while self.day < DAYS_MAX:
+            self.day += 1
+            print_update(f"--- Dia {self.day} ---", self.entity_name)
+            await self.metrics.step_async(self.check_and_order_parts)
+            await asyncio.sleep(TIME_SLEEP)
+        print_update("Simulação terminada.", self.entity_name)
 
 def main():
     if len(sys.argv) != 3:
@@ -145,7 +425,7 @@ def main():
     line_id, factory_id = sys.argv[1], sys.argv[2]
     
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         r.ping()
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO (Linha {factory_id}-{line_id}): Não foi possível conectar ao Redis. Detalhes: {e}")
@@ -160,7 +440,8 @@ def main():
     while days < DAYS_MAX:
         days += 1
         print_update(f"--- Dia {days} ---", line.entity_name)
-        line.check_and_order_parts()
+        line.metrics.step(line.check_and_order_parts)
+        print_update(format_pool_stats(r), line.entity_name)
         time.sleep(TIME_SLEEP)
         
     print_update("Simulação terminada.", line.entity_name)
@@ -0,0 +1,292 @@
+# metrics.py
+
+import bisect
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+import redis
+from tracing import continue_trace, SpanRecorder
+from utils import (
+    peek_header,
+    print_update,
+    REDIS_ROUND_TRIPS,
+    METRICS_ENABLED,
+    METRICS_PUSH_INTERVAL,
+    METRICS_TTL,
+    METRICS_KEY_PREFIX,
+    METRICS_ENTITIES_KEY,
+    METRICS_BUCKETS
+)
+
+
+class Histogram:
+    """Histograma de buckets fixos (METRICS_BUCKETS), com soma e contagem."""
+
+    def __init__(self):
+        # Um contador por bucket mais o último (+Inf); não cumulativos.
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': self.counts, 'sum': self.sum, 'count': self.count}
+
+
+class EntityMetrics:
+    """
+    Métricas de uma entidade: para cada handler de mensagem ('handler', por
+    comando), cada rotina diária ('step', por nome do método) e cada
+    temporizador ('timer', por nome do callback), contagem,
+    histograma de latência e idas ao Redis; e o atraso das mensagens na fila
+    (tempo entre a publicação no stream e o início do tratamento).
+
+    O snapshot vai para o Redis (METRICS_KEY_PREFIX + entidade, com TTL) no máximo
+    a cada METRICS_PUSH_INTERVAL segundos, aproveitando a própria atividade da
+    entidade: não há thread nem tarefa extra. Os spans de rastreamento das
+    mensagens tratadas (tracing.py) saem pelo mesmo caminho.
+    """
+
+    def __init__(self, entity_name, redis_client):
+        self.entity_name = entity_name
+        self.r = redis_client
+        self.series = {}
+        self.queue_lag = Histogram()
+        self._last_push = 0.0
+        self._lock = threading.Lock()
+        self.spans = SpanRecorder(entity_name, redis_client)
+
+    def observe(self, kind, name, seconds, round_trips=0):
+        with self._lock:
+            series = self.series.get((kind, name))
+            if series is None:
+                series = self.series[(kind, name)] = {'latency': Histogram(), 'round_trips': 0, 'errors': 0}
+            series['latency'].observe(seconds)
+            series['round_trips'] += round_trips
+
+    def observe_error(self, kind, name):
+        with self._lock:
+            if (kind, name) in self.series:
+                self.series[(kind, name)]['errors'] += 1
+
+    def observe_lag(self, seconds):
+        if seconds is None:
+            return
+        with self._lock:
+            self.queue_lag.observe(max(seconds, 0.0))
+
+    @contextmanager
+    def measure(self, kind, name):
+        """Mede o bloco: latência e idas ao Redis feitas nesta thread/tarefa."""
+        if not METRICS_ENABLED:
+            yield
+            return
+        counter = [0]
+        token = REDIS_ROUND_TRIPS.set(counter)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.observe(kind, name, time.perf_counter() - start, counter[0])
+            self.observe_error(kind, name)
+            raise
+        else:
+            self.observe(kind, name, time.perf_counter() - start, counter[0])
+        finally:
+            REDIS_ROUND_TRIPS.reset(token)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'entity': self.entity_name,
+                'updated_at': time.time(),
+                'series': [
+                    {'kind': kind, 'name': name, 'latency': series['latency'].to_dict(),
+                     'round_trips': series['round_trips'], 'errors': series['errors']}
+                    for (kind, name), series in sorted(self.series.items())
+                ],
+                'queue_lag': self.queue_lag.to_dict(),
+            }
+
+    def _due_payload(self):
+        if not METRICS_ENABLED:
+            return None
+        now = time.monotonic()
+        if now - self._last_push < METRICS_PUSH_INTERVAL:
+            return None
+        self._last_push = now
+        return json.dumps(self.snapshot())
+
+    def _queue_push(self, pipe, payload):
+        pipe.set(METRICS_KEY_PREFIX + self.entity_name, payload, ex=METRICS_TTL)
+        pipe.sadd(METRICS_ENTITIES_KEY, self.entity_name)
+
+    def push_if_due(self):
+        payload = self._due_payload()
+        if payload is not None:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_push(pipe, payload)
+            pipe.execute()
+
+    async def push_if_due_async(self):
+        payload = self._due_payload()
+        if payload is not None:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_push(pipe, payload)
+            await pipe.execute()
+
+    # --- Pontos de instrumentação usados pelas entidades ---
+
+    # Falhas de conexão com o Redis sobem (o processo cai e a mensagem, sem XACK,
+    # é tratada de novo ao reiniciar); qualquer outro erro descarta só a mensagem.
+    INFRASTRUCTURE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+    def _discard(self, command, error):
+        print_update(f"ERRO ao tratar '{command}': {error!r}. Mensagem descartada.", self.entity_name)
+
+    def dispatch(self, handler, data, transport=None):
+        """
+        Trata uma mensagem do listen() medindo o handler do comando; as mensagens
+        enviadas pelo handler continuam o trace da recebida. Um erro no handler é
+        registrado e a mensagem descartada, sem derrubar o listener.
+        """
+        if transport is not None:
+            self.observe_lag(transport.last_lag)
+        command, trace_id, sent_at = peek_header(data)
+        received_at = time.time()
+        try:
+            with continue_trace(trace_id), self.measure('handler', command):
+                handler(data)
+        except self.INFRASTRUCTURE_ERRORS:
+            raise
+        except Exception as e:
+            self._discard(command, e)
+        self.spans.record(trace_id, command, sent_at, received_at, time.time())
+        self.push_if_due()
+        self.spans.flush_if_due()
+
+    async def dispatch_async(self, handler, data, transport=None):
+        if transport is not None:
+            self.observe_lag(transport.last_lag)
+        command, trace_id, sent_at = peek_header(data)
+        received_at = time.time()
+        try:
+            with continue_trace(trace_id), self.measure('handler', command):
+                await handler(data)
+        except self.INFRASTRUCTURE_ERRORS:
+            raise
+        except Exception as e:
+            self._discard(command, e)
+        self.spans.record(trace_id, command, sent_at, received_at, time.time())
+        await self.push_if_due_async()
+        await self.spans.flush_if_due_async()
+
+    def step(self, routine):
+        """Roda uma rotina do loop de dias (ex.: check_and_order_parts) medindo-a."""
+        with self.measure('step', routine.__name__):
+            routine()
+        self.push_if_due()
+
+    async def step_async(self, routine):
+        with self.measure('step', routine.__name__):
+            await routine()
+        await self.push_if_due_async()
+
+    def timer(self, callback):
+        """
+        Envolve um callback de call_later (alocação em lote, entregas, novas
+        tentativas, prazos) para medi-lo como 'timer'; aceita funções e corrotinas.
+        O snapshot sai no próximo handler ou rotina diária: o temporizador não faz
+        idas extras ao Redis.
+        """
+        name = callback.__name__
+        if inspect.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def run_async(*args):
+                with self.measure('timer', name):
+                    await callback(*args)
+            return run_async
+
+        @functools.wraps(callback)
+        def run(*args):
+            with self.measure('timer', name):
+                callback(*args)
+        return run
+
+
+def fetch_snapshots(redis_client):
+    """Snapshots de todas as entidades ativas (as que expiraram saem do registro)."""
+    entities = sorted(redis_client.smembers(METRICS_ENTITIES_KEY))
+    if not entities:
+        return []
+    payloads = redis_client.mget([METRICS_KEY_PREFIX + entity for entity in entities])
+    expired = [entity for entity, payload in zip(entities, payloads) if payload is None]
+    if expired:
+        redis_client.srem(METRICS_ENTITIES_KEY, *expired)
+    return [json.loads(payload) for payload in payloads if payload is not None]
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _histogram_lines(metric, labels, histogram):
+    lines = []
+    cumulative = 0
+    bounds = [str(bound) for bound in METRICS_BUCKETS] + ["+Inf"]
+    for bound, count in zip(bounds, histogram['buckets']):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{_labels(**labels, le=bound)}}} {cumulative}')
+    lines.append(f'{metric}_sum{{{_labels(**labels)}}} {histogram["sum"]:.6f}')
+    lines.append(f'{metric}_count{{{_labels(**labels)}}} {histogram["count"]}')
+    return lines
+
+
+def render_prometheus(snapshots):
+    """Formato texto do Prometheus (0.0.4) com as métricas de todas as entidades."""
+    lines = []
+    kinds = (
+        ('handler', 'kanban_handler_seconds', "Latência dos handlers de mensagens, por comando."),
+        ('step', 'kanban_step_seconds', "Latência das rotinas do loop de dias."),
+        ('timer', 'kanban_timer_seconds', "Latência dos temporizadores (alocação, entregas, novas tentativas, prazos)."),
+    )
+    for kind, metric, help_text in kinds:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for snapshot in snapshots:
+            for series in snapshot['series']:
+                if series['kind'] == kind:
+                    labels = {'entity': snapshot['entity'], kind: series['name']}
+                    lines += _histogram_lines(metric, labels, series['latency'])
+
+    counters = (
+        ('round_trips', 'kanban_redis_round_trips_total', "Idas ao Redis feitas pelos handlers, rotinas e temporizadores."),
+        ('errors', 'kanban_errors_total', "Exceções nos handlers, rotinas e temporizadores."),
+    )
+    for field, metric, help_text in counters:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for snapshot in snapshots:
+            for series in snapshot['series']:
+                labels = _labels(entity=snapshot['entity'], kind=series['kind'], name=series['name'])
+                lines.append(f"{metric}{{{labels}}} {series[field]}")
+
+    metric = 'kanban_queue_lag_seconds'
+    lines += [f"# HELP {metric} Atraso entre a publicação da mensagem e o início do tratamento.",
+              f"# TYPE {metric} histogram"]
+    for snapshot in snapshots:
+        if snapshot['queue_lag']['count']:
+            lines += _histogram_lines(metric, {'entity': snapshot['entity']}, snapshot['queue_lag'])
+
+    metric = 'kanban_metrics_age_seconds'
+    lines += [f"# HELP {metric} Segundos desde o último envio de métricas da entidade.",
+              f"# TYPE {metric} gauge"]
+    now = time.time()
+    for snapshot in snapshots:
+        lines.append(f'{metric}{{{_labels(entity=snapshot["entity"])}}} {now - snapshot["updated_at"]:.3f}')
+    return "\n".join(lines) + "\n"
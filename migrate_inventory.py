@@ -0,0 +1,75 @@
+# migrate_inventory.py
+
+import re
+import sys
+import redis
+from inventory_redis import HashInventory, line_inventory, product_inventory, warehouse_inventory
+from utils import make_redis_client
+
+# Chaves do layout legado: uma chave string por item.
+LINE_KEY_PATTERN = re.compile(r"^line:([^:]+):([^:]+):part:(\d+)$")
+
+
+def find_lines(r):
+    """Descobre as linhas existentes a partir das chaves legadas 'line:{f}:{l}:part:{i}'."""
+    lines = set()
+    for key in r.scan_iter("line:*:*:part:*", count=1000):
+        match = LINE_KEY_PATTERN.match(key)
+        if match:
+            lines.add((match.group(1), match.group(2)))
+    return sorted(lines)
+
+
+def migrate_entity(r, prefix, inventory, dry_run=False):
+    """
+    Move os contadores '{prefix}:{i}' para o hash da entidade e apaga as chaves antigas.
+    Usa HINCRBY dentro de MULTI/EXEC, então rodar a migração duas vezes não perde estoque.
+    Retorna o número de chaves migradas.
+    """
+    keys = [f"{prefix}:{i}" for i in range(inventory.size)]
+    values = r.mget(keys)
+    present = [(i, key, int(value)) for i, (key, value) in enumerate(zip(keys, values)) if value is not None]
+    if not present or dry_run:
+        return len(present)
+
+    pipe = r.pipeline(transaction=True)
+    for i, _, value in present:
+        pipe.hincrby(inventory.key, i, value)
+    pipe.delete(*[key for _, key, _ in present])
+    pipe.execute()
+    return len(present)
+
+
+def migrate(r, dry_run=False):
+    entities = [
+        ("product", product_inventory(r)),
+        ("warehouse:part", warehouse_inventory(r)),
+    ]
+    for factory_id, line_id in find_lines(r):
+        entities.append((f"line:{factory_id}:{line_id}:part", line_inventory(r, factory_id, line_id)))
+
+    for prefix, inventory in entities:
+        if not isinstance(inventory, HashInventory):
+            print("ERRO: utils.INVENTORY_BACKEND precisa ser 'hash' para migrar.")
+            return
+        moved = migrate_entity(r, prefix, inventory, dry_run)
+        action = "seriam migradas" if dry_run else "migradas"
+        print(f"    - '{prefix}:*' -> '{inventory.key}': {moved} chaves {action}")
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    try:
+        r = make_redis_client()
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    print(">>> Migrando estoques do layout de chaves para hashes...")
+    migrate(r, dry_run)
+    print(">>> Migração concluída.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 # product_stock_redis.py
 
+import asyncio
 import redis
 import threading
 import time
 import random
+from inventory_redis import product_inventory
+from metrics import EntityMetrics
+from transport_redis import make_transport
 from utils import (
-    list_to_string,
+    make_redis_client,
+    format_pool_stats,
+    encode_message,
+    decode_message,
     print_update,
     TIME_SLEEP,
     DAYS_MAX,
@@ -13,8 +20,6 @@ from utils import (
     MIN_ORDERED_AMOUNT,
     MAX_ORDERED_AMOUNT,
     NUM_PRODUCTS,
-    REDIS_HOST,
-    REDIS_PORT,
     LOG_CONSUMPTION_KEY
 )
 
@@ -23,78 +28,123 @@ class ProductStockRedis:
     def __init__(self, redis_client):
         self.r = redis_client
         self.entity_name = 'product-stock'
+        self.inventory = product_inventory(self.r)
+        self.transport = make_transport(self.r, self.entity_name)
+        self.metrics = EntityMetrics(self.entity_name, self.r)
 
     def receive_products(self, product_index_str, line_id, factory_id, qty_str):
         """Recebe um lote de produtos acabados de uma linha de produção e o adiciona ao estoque."""
         product_index = int(product_index_str)
         qty = int(qty_str)
         
-        key = f"product:{product_index}"
-        self.r.incrby(key, qty)
+        self.inventory.incr(product_index, qty)
         
         print_update(f"Recebeu {qty} unids do produto {product_index + 1} da linha {factory_id}-{line_id}.", self.entity_name)
 
+    def _daily_demand(self):
+        """Sorteia a quantidade pedida pelos clientes de cada produto no dia."""
+        print_update("Simulando pedidos de clientes para o dia...", self.entity_name)
+        return [random.randint(MIN_ORDERED_AMOUNT, MAX_ORDERED_AMOUNT) for _ in range(NUM_PRODUCTS)]
+
+    def _sale(self, i, order_amount, shortage):
+        """Registra o resultado da baixa de um pedido; retorna a entrada do log de consumo, ou None se a venda falhou."""
+        if shortage:
+            print_update(f"FALHA DE VENDA: Pedido de {order_amount} unids para o produto {i + 1} falhou. Estoque: {shortage.available}", self.entity_name)
+            return None
+        print_update(f"VENDA: Pedido de {order_amount} unids para o produto {i + 1} atendido com sucesso.", self.entity_name)
+        return f"Cliente consumiu {order_amount} unids de Pv{i+1}"
+
+    def _stock_status_message(self, demand, current_stock_buffer):
+        """Mensagem do estoque atual para as fábricas; a demanda do dia vai nos campos."""
+        print_update(f"Enviando atualização de estoque para fábricas: {current_stock_buffer}", self.entity_name)
+        return encode_message("update_factory", demand, current_stock_buffer)
+
     def simulate_daily_customer_orders(self):
         """
         Simula a demanda do mercado gerando pedidos aleatórios para cada produto
         e os decrementando do estoque. Em seguida, publica o novo status para as fábricas.
         """
-        print_update("Simulando pedidos de clientes para o dia...", self.entity_name)
-        
-        sent_orders = [0] * NUM_PRODUCTS
-        for i in range(NUM_PRODUCTS):
-            # Gera uma quantidade de pedido aleatória
-            order_amount = random.randint(MIN_ORDERED_AMOUNT, MAX_ORDERED_AMOUNT)
-            key = f"product:{i}"
-            
-            # Pega o estoque atual do Redis
-            current_stock = int(self.r.get(key) or 0)
-            
-            # Verifica se há estoque suficiente para atender ao pedido
-            if current_stock < order_amount:
-                print_update(f"FALHA DE VENDA: Pedido de {order_amount} unids para o produto {i + 1} falhou. Estoque: {current_stock}", self.entity_name)
-            else:
-                self.r.decrby(key, order_amount)
-                self.r.lpush(
-                    LOG_CONSUMPTION_KEY,
-                    f"Cliente consumiu {order_amount} unids de Pv{i+1}"
-                )
-                sent_orders[i] = order_amount
-                print_update(f"VENDA: Pedido de {order_amount} unids para o produto {i + 1} atendido com sucesso.", self.entity_name)
+        # Demanda do dia (pedidos atendidos ou não), usada na previsão das fábricas
+        demand = self._daily_demand()
+        for i, order_amount in enumerate(demand):
+            # Verifica e baixa o estoque atomicamente (falha se não houver o suficiente)
+            log = self._sale(i, order_amount, self.inventory.consume([i], order_amount))
+            if log:
+                self.r.lpush(LOG_CONSUMPTION_KEY, log)
 
         # Após simular todas as vendas, informa às fábricas o novo status do estoque.
-        self.publish_stock_status_to_factories()
+        self.publish_stock_status_to_factories(demand)
         
-    def publish_stock_status_to_factories(self):
+    def publish_stock_status_to_factories(self, demand=()):
         """Lê o estado atual do estoque de todos os produtos e publica para as fábricas."""
-        # Monta uma lista com o estoque atual de cada produto.
-        current_stock_buffer = [int(self.r.get(f"product:{i}") or 0) for i in range(NUM_PRODUCTS)]
-        
-        # Formata a mensagem e publica no canal da fábrica.
-        payload = list_to_string(current_stock_buffer)
-        msg = f"update_factory/{payload}"
-        
-        self.r.publish("channel:factory", msg)
-        print_update(f"Enviando atualização de estoque para fábricas: {current_stock_buffer}", self.entity_name)
+        msg = self._stock_status_message(demand, self.inventory.get_all())
+        self.transport.publish("channel:factory", msg)
 
 
     def listen(self):
         """Ouve o canal 'channel:product_stock' por notificações de novas produções."""
-        pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:product_stock")
         print_update("Ouvindo o canal 'channel:product_stock' por novos produtos...", self.entity_name)
         
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                parts = message['data'].split("/")
-                # Formato esperado: "receive_products/{product_idx}/{line_id}/{factory_id}/{qty}"
-                if parts[0] == "receive_products":
-                    self.receive_products(parts[1], parts[2], parts[3], parts[4])
+        for data in self.transport.listen("channel:product_stock"):
+            self.metrics.dispatch(self.handle_message, data, self.transport)
+
+    def handle_message(self, data):
+        msg = decode_message(data)
+        # Campos esperados: product_idx, line_id, factory_id, qty
+        if msg.command == "receive_products":
+            self.receive_products(*msg.fields)
+
+class AsyncProductStockRedis(ProductStockRedis):
+    """
+    Variante asyncio do estoque de produtos (redis.asyncio), para várias
+    entidades em um só processo: só as idas ao Redis e ao transporte são
+    aguardadas, as decisões ficam nos helpers do ProductStockRedis.
+    """
+
+    # Último dia começado pelo run(): reiniciada pelo async_runtime, a tarefa continua dele.
+    day = 0
+
+    async def receive_products(self, product_index_str, line_id, factory_id, qty_str):
+        product_index = int(product_index_str)
+        qty = int(qty_str)
+        await self.inventory.incr(product_index, qty)
+        print_update(f"Recebeu {qty} unids do produto {product_index + 1} da linha {factory_id}-{line_id}.", self.entity_name)
+
+    async def simulate_daily_customer_orders(self):
+        demand = self._daily_demand()
+        for i, order_amount in enumerate(demand):
+            log = self._sale(i, order_amount, await self.inventory.consume([i], order_amount))
+            if log:
+                await self.r.lpush(LOG_CONSUMPTION_KEY, log)
+        await self.publish_stock_status_to_factories(demand)
+
+    async def publish_stock_status_to_factories(self, demand=()):
+        msg = self._stock_status_message(demand, await self.inventory.get_all())
+        await self.transport.publish("channel:factory", msg)
+
+    async def listen(self):
+        print_update("Ouvindo o canal 'channel:product_stock' por novos produtos...", self.entity_name)
+        async for data in self.transport.listen("channel:product_stock"):
+            await self.metrics.dispatch_async(self.handle_message, data, self.transport)
+
+    async def handle_message(self, data):
+        msg = decode_message(data)
+        if msg.command == "receive_products":
+            await self.receive_products(*msg.fields)
+
+    async def run(self):
+        """Loop de dias, equivalente ao de main()."""
+        while self.day < DAYS_MAX:
+            self.day += 1
+            print_update(f"--- Dia {self.day} ---", self.entity_name)
+            await self.metrics.step_async(self.simulate_daily_customer_orders)
+            await asyncio.sleep(TIME_SLEEP)
+        print_update("Simulação terminada.", self.entity_name)
 
 def main():
     """Função principal para iniciar o processo de estoque de produtos."""
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'product-stock-main')
     except redis.exceptions.ConnectionError as e:
@@ -113,7 +163,8 @@ def main():
         print_update(f"--- Dia {days} ---", ps.entity_name)
         
         # A cada "dia", o sistema simula as vendas e atualiza as fábricas.
-        ps.simulate_daily_customer_orders()
+        ps.metrics.step(ps.simulate_daily_customer_orders)
+        print_update(format_pool_stats(r), ps.entity_name)
         
         time.sleep(TIME_SLEEP)
 
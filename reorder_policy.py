@@ -0,0 +1,141 @@
+# reorder_policy.py
+
+import math
+import threading
+import numpy as np
+from utils import (
+    REORDER_POLICY,
+    REORDER_SMOOTHING,
+    REORDER_MIN_DAYS,
+    REORDER_REVIEW_DAYS,
+    REORDER_SAFETY_FACTOR,
+    MAD_TO_STD,
+    REORDER_MIN_QTY,
+    RESTOCK_TRIGGERS
+)
+
+
+class AdaptiveReorder:
+    """
+    Ponto de pedido e quantidade a pedir por peça, a partir da velocidade de
+    consumo observada (média móvel exponencial do consumo diário) e do tempo de
+    reposição medido entre o pedido e a chegada das peças.
+
+      ponto de pedido = velocidade * (reposição + revisão) + segurança
+      quantidade      = ponto de pedido + velocidade * cobertura - estoque
+
+    Peças rápidas (kit base) passam a ser pedidas antes e em maior quantidade;
+    peças de variação lentas deixam de prender estoque.
+    """
+
+    def __init__(self, size, lead_time, cover_days, floor=0):
+        self.lead_time = lead_time
+        self.cover_days = cover_days
+        # Ponto de pedido mínimo, para peças ainda sem consumo observado.
+        self.floor = floor
+        self.velocity = np.zeros(size)
+        self.deviation = np.zeros(size)
+        self.days = 0
+        self._consumed = np.zeros(size)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.days >= REORDER_MIN_DAYS
+
+    def record_consumption(self, amounts):
+        """Soma uma demanda de peças (vetor por peça) ao consumo do dia corrente."""
+        with self._lock:
+            self._consumed += np.asarray(amounts)
+
+    def close_day(self):
+        """Fecha o dia: atualiza velocidade e desvio com o consumo acumulado."""
+        with self._lock:
+            consumed, self._consumed = self._consumed, np.zeros_like(self._consumed)
+        if self.days == 0:
+            self.velocity = consumed.astype(float)
+        else:
+            self.deviation = (REORDER_SMOOTHING * np.abs(consumed - self.velocity)
+                              + (1 - REORDER_SMOOTHING) * self.deviation)
+            self.velocity = REORDER_SMOOTHING * consumed + (1 - REORDER_SMOOTHING) * self.velocity
+        self.days += 1
+
+    def record_lead_time(self, days):
+        """Atualiza o tempo de reposição (em dias) com uma nova medição."""
+        self.lead_time = REORDER_SMOOTHING * days + (1 - REORDER_SMOOTHING) * self.lead_time
+
+    def protection_days(self):
+        """
+        Dias que o estoque precisa cobrir: a revisão atual e o tempo de reposição,
+        arredondado para revisões inteiras, pois uma entrega que chega no meio do
+        período só é aproveitada a partir da revisão seguinte.
+        """
+        return REORDER_REVIEW_DAYS * (math.ceil(self.lead_time / REORDER_REVIEW_DAYS) + 1)
+
+    def levels(self, static_level):
+        """Limite de cada peça para pedir: o ponto de pedido adaptativo ou o alerta fixo."""
+        if REORDER_POLICY == 'adaptive' and self.ready:
+            return self.reorder_points()
+        return np.full(len(self.velocity), static_level, dtype=float)
+
+    def reorder_points(self):
+        horizon = self.protection_days()
+        safety = REORDER_SAFETY_FACTOR * MAD_TO_STD * self.deviation * math.sqrt(horizon)
+        return np.maximum(self.velocity * horizon + safety, self.floor)
+
+    def order_quantities(self, stocks):
+        """Quantidade a pedir de cada peça (0 para as que estão acima do ponto de pedido)."""
+        stocks = np.asarray(stocks, dtype=float)
+        reorder_points = self.reorder_points()
+        below = stocks < reorder_points
+        target = reorder_points + self.velocity * self.cover_days
+        quantities = np.maximum(np.ceil(target - stocks), REORDER_MIN_QTY)
+        return np.where(below, quantities, 0).astype(int).tolist()
+
+
+class RestockTrigger:
+    """
+    Detecta, no momento da baixa, as peças que cruzaram o ponto de pedido, sem
+    ir ao Redis: mantém uma estimativa do estoque, sincronizada a cada revisão
+    (que lê o estoque real) e ajustada localmente pelas baixas e entregas.
+    Só uma revisão fica agendada por vez (debounce); as baixas seguintes até
+    ela rodar não agendam outra.
+    """
+
+    def __init__(self):
+        self.estimate = None
+        self.scheduled = False
+        self._lock = threading.Lock()
+
+    def sync(self, stocks):
+        """Recebe o estoque lido na revisão."""
+        with self._lock:
+            self.estimate = np.asarray(stocks, dtype=float)
+
+    def release(self):
+        """Chamado quando a revisão agendada roda: a próxima baixa pode agendar outra."""
+        with self._lock:
+            self.scheduled = False
+
+    def add(self, amounts):
+        with self._lock:
+            if self.estimate is not None:
+                self.estimate += np.asarray(amounts)
+
+    def consume(self, amounts, thresholds):
+        """
+        Aplica uma baixa (vetor por peça) à estimativa; retorna True se alguma
+        peça cruzou o seu limite agora e a revisão ainda não estava agendada.
+        """
+        if not RESTOCK_TRIGGERS:
+            return False
+        with self._lock:
+            if self.estimate is None:
+                return False
+            before = self.estimate
+            self.estimate = before - np.asarray(amounts)
+            crossed = np.any((before >= thresholds) & (self.estimate < thresholds))
+            if not crossed or self.scheduled:
+                return False
+            self.scheduled = True
+            return True
@@ -0,0 +1,78 @@
+# restock_requests.py
+
+import threading
+from collections import namedtuple
+from utils import RESTOCK_RETRY_BASE, RESTOCK_RETRY_MAX
+
+# Situação do envio informada pelo almoxarifado no 'receive_parts' para a linha:
+# [line_id, factory_id, request_id, status, shard]. Pedidos sem nenhuma peça
+# disponível recebem 'reject_parts' [line_id, factory_id, request_id, shard].
+REPLY_COMPLETE = 0
+REPLY_PARTIAL = 1
+
+# Pedido aguardando resposta; deadline usa o relógio da entidade (segundos).
+# responders: quem recebeu uma parte do pedido (shards do almoxarifado, para as
+# linhas; fornecedores, para o almoxarifado); ok: se todas as respostas
+# atenderam o pedido (preenchido ao encerrá-lo).
+OutstandingRequest = namedtuple('OutstandingRequest', ['request_id', 'sent_at', 'deadline', 'responders', 'ok'],
+                                defaults=(frozenset({0}), None))
+
+
+class RequestTracker:
+    """
+    Pedido de reabastecimento em andamento de uma entidade. Há no máximo um: um
+    pedido novo substitui o anterior, e respostas ou prazos de pedidos já
+    substituídos são ignorados (as peças que chegarem entram no estoque mesmo
+    assim). As falhas seguidas (recusa, envio parcial, prazo vencido) definem a
+    espera até a próxima tentativa, que dobra a cada falha até RESTOCK_RETRY_MAX.
+    O id 0 é o de mensagens sem id (entidades antigas) e vale para o pedido atual.
+    Um pedido dividido entre vários atendentes (shards do almoxarifado ou
+    fornecedores) só se encerra com a resposta do último (ou com o prazo).
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.current = None
+        self.failures = 0
+        self._next_id = 1
+        self._waiting = set()
+        self._all_ok = True
+        self._lock = threading.Lock()
+
+    @property
+    def outstanding(self):
+        return self.current is not None
+
+    def open(self, now, responders=(0,)):
+        """Registra um pedido novo (substituindo o atual) e o retorna."""
+        with self._lock:
+            self.current = OutstandingRequest(self._next_id, now, now + self.timeout, frozenset(responders))
+            self._next_id += 1
+            self._waiting = set(responders)
+            self._all_ok = True
+            return self.current
+
+    def close(self, request_id, ok, responder=None):
+        """
+        Registra a resposta de 'responder' ao pedido 'request_id' (sem atendente: o
+        pedido inteiro, como no prazo vencido). Quando não falta mais ninguém,
+        encerra o pedido e o retorna com 'ok' de todas as respostas; retorna None
+        se ainda faltam respostas ou se o pedido já foi substituído ou encerrado.
+        ok=False conta uma falha.
+        """
+        with self._lock:
+            request = self.current
+            if request is None or (request_id and request.request_id != request_id):
+                return None
+            self._all_ok = self._all_ok and ok
+            if responder is not None:
+                self._waiting.discard(responder)
+                if self._waiting:
+                    return None
+            self.current = None
+            self.failures = 0 if self._all_ok else self.failures + 1
+            return request._replace(ok=self._all_ok)
+
+    def backoff(self):
+        """Espera (segundos) até a próxima tentativa, pelo número de falhas seguidas."""
+        return min(RESTOCK_RETRY_BASE * 2 ** max(self.failures - 1, 0), RESTOCK_RETRY_MAX)
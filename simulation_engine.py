@@ -0,0 +1,481 @@
+# simulation_engine.py
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+import init_redis
+import utils
+from async_runtime import build_entity
+from factory_redis import FactoryRedis
+from inventory_redis import (
+    CONSUME_HASH_LUA,
+    CONSUME_KEYS_LUA,
+    CONSUME_UP_TO_HASH_LUA,
+    CONSUME_UP_TO_KEYS_LUA,
+    product_inventory,
+    warehouse_inventory
+)
+from line_redis import LineRedis
+from product_stock_redis import ProductStockRedis
+from supervisor import load_topology
+from supplier_redis import SupplierRedis
+from utils import decode_message, set_log_level, LOG_CONSUMPTION_KEY, NUM_PRODUCTS
+from warehouse_redis import WarehouseRedis
+
+SYNC_ENTITY_CLASSES = {
+    "supplier": SupplierRedis,
+    "warehouse": WarehouseRedis,
+    "product_stock": ProductStockRedis,
+    "factory": FactoryRedis,
+    "line": LineRedis,
+}
+
+# Tempo virtual em dias. Mensagens levam MESSAGE_LATENCY dias para chegar, o que
+# preserva a ordem causal (pedido -> envio -> recebimento) dentro de um mesmo dia.
+MESSAGE_LATENCY = 0.001
+
+# Ordem das rotinas diárias no início de cada dia: vendas e status do estoque de
+# produtos, pedido ao fornecedor, pedidos de peças das linhas e ordens das fábricas.
+DAY_STEP_ORDER = (ProductStockRedis, WarehouseRedis, LineRedis, FactoryRedis)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class MemoryPipeline:
+    """Pipeline do MemoryRedis: enfileira os comandos e executa todos em execute()."""
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class MemoryRedis:
+    """
+    Substituto do Redis em memória com o subconjunto de comandos usado pelas
+    entidades (strings, hashes, listas, pipelines e os scripts Lua de
+    inventory_redis.py reimplementados em Python). Como o motor roda em uma única
+    thread, cada comando e cada script já é atômico.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self._scripts = {
+            CONSUME_KEYS_LUA: self._consume_keys,
+            CONSUME_HASH_LUA: self._consume_hash,
+            CONSUME_UP_TO_KEYS_LUA: self._consume_up_to_keys,
+            CONSUME_UP_TO_HASH_LUA: self._consume_up_to_hash,
+        }
+
+    # --- Strings ---
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def mset(self, mapping):
+        self.data.update(mapping)
+
+    def incrby(self, key, amount=1):
+        value = int(self.data.get(key) or 0) + amount
+        self.data[key] = value
+        return value
+
+    # --- Hashes (campos sempre como texto, como no Redis) ---
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(str(field))
+
+    def hmget(self, key, fields):
+        values = self.data.get(key, {})
+        return [values.get(str(field)) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hincrby(self, key, field, amount=1):
+        values = self.data.setdefault(key, {})
+        value = int(values.get(str(field)) or 0) + amount
+        values[str(field)] = value
+        return value
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        values = self.data.setdefault(key, {})
+        if field is not None:
+            values[str(field)] = value
+        for f, v in (mapping or {}).items():
+            values[str(f)] = v
+
+    def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        return sum(values.pop(str(field), None) is not None for field in fields)
+
+    # --- Listas ---
+
+    def lpush(self, key, *values):
+        items = self.data.setdefault(key, deque())
+        items.extendleft(values)
+        return len(items)
+
+    def llen(self, key):
+        return len(self.data.get(key, ()))
+
+    def lrange(self, key, start, end):
+        items = list(self.data.get(key, ()))
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        self.data[key] = deque(self.lrange(key, start, end))
+
+    # --- Pipelines e scripts ---
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def register_script(self, script):
+        run = self._scripts[script]
+        return lambda keys=(), args=(): run(list(keys), list(args))
+
+    @staticmethod
+    def _up_to(stocks, qty):
+        short = [i for i, stock in enumerate(stocks, start=1) if max(stock, 0) < qty]
+        produced = min([qty] + [max(stocks[i - 1], 0) for i in short])
+        return produced, short
+
+    def _consume_keys(self, keys, args):
+        qty = int(args[0])
+        available, short = self._up_to([int(value or 0) for value in self.mget(keys)], qty)
+        if short:
+            return [available, *short]
+        for key in keys:
+            self.incrby(key, -qty)
+        return []
+
+    def _consume_hash(self, keys, args):
+        key, qty, fields = keys[0], int(args[0]), args[1:]
+        available, short = self._up_to([int(value or 0) for value in self.hmget(key, fields)], qty)
+        if short:
+            return [available, *short]
+        for field in fields:
+            self.hincrby(key, field, -qty)
+        return []
+
+    def _consume_up_to_keys(self, keys, args):
+        produced, short = self._up_to([int(value or 0) for value in self.mget(keys)], int(args[0]))
+        if produced > 0:
+            for key in keys:
+                self.incrby(key, -produced)
+        return [produced, *short]
+
+    def _consume_up_to_hash(self, keys, args):
+        key, qty, fields = keys[0], int(args[0]), args[1:]
+        produced, short = self._up_to([int(value or 0) for value in self.hmget(key, fields)], qty)
+        if produced > 0:
+            for field in fields:
+                self.hincrby(key, field, -produced)
+        return [produced, *short]
+
+
+class EventQueue:
+    """Relógio virtual e fila de eventos ordenada por (instante, ordem de agendamento)."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def schedule(self, delay, callback, *args):
+        heapq.heappush(self._queue, (self.now + delay, next(self._seq), callback, args))
+
+    def run_until(self, end):
+        """Processa, em ordem, todos os eventos com instante <= end."""
+        while self._queue and self._queue[0][0] <= end:
+            self.now, _, callback, args = heapq.heappop(self._queue)
+            callback(*args)
+        self.now = max(self.now, end)
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class BusTransport:
+    """Transporte das entidades sobre o barramento em memória: só publica (as entregas são eventos do barramento)."""
+
+    def __init__(self, bus, group):
+        self.bus = bus
+        self.group = group
+
+    def publish(self, channel, data):
+        self.bus.publish(channel, data)
+
+    def queue_publish(self, pipe, channel, data):
+        # A entrega já acontece depois da latência do barramento; não há o que adiar.
+        self.bus.publish(channel, data)
+
+
+class SimBus:
+    """
+    Barramento de mensagens em memória. Cada publicação vira um evento de entrega
+    por assinante (broadcast, como um consumer group por entidade nos streams),
+    MESSAGE_LATENCY dias depois, e é contabilizada nas estatísticas.
+    """
+
+    def __init__(self, events, latency=MESSAGE_LATENCY):
+        self.events = events
+        self.latency = latency
+        self.subscribers = {}
+        self.stats = Counter()
+
+    def subscribe(self, channel, handler):
+        self.subscribers.setdefault(channel, []).append(handler)
+
+    def transport(self, group):
+        return BusTransport(self, group)
+
+    def publish(self, channel, data):
+        msg = decode_message(data)
+        self.stats[f"msg:{msg.command}"] += 1
+        if msg.command == "receive_order":
+            self.stats["units_ordered"] += int(msg.fields[3])
+        elif msg.command == "receive_products":
+            self.stats["units_produced"] += int(msg.fields[3])
+        elif msg.command == "send_parts" and not channel.startswith("channel:supplier"):
+            # Com o almoxarifado particionado, cada parte do pedido conta como um pedido.
+            self.stats["line_restock_requests"] += 1
+        elif msg.command == "receive_parts" and channel.startswith("channel:warehouse"):
+            self.stats["supplier_deliveries"] += 1
+        elif msg.command == "receive_parts":
+            self.stats["line_restock_shipments"] += 1
+        for handler in self.subscribers.get(channel, ()):
+            self.events.schedule(self.latency, handler, data)
+
+
+def _channel_of(entity):
+    """Canal que cada entidade ouve no listen()."""
+    if isinstance(entity, (LineRedis, WarehouseRedis, SupplierRedis)):
+        return entity.channel
+    if isinstance(entity, FactoryRedis):
+        return "channel:factory"
+    return "channel:product_stock"
+
+
+class SimulationEngine:
+    """
+    Roda a lógica das entidades (as mesmas classes de *_redis.py) com relógio
+    virtual, barramento e Redis em memória: os dias passam assim que a fila de
+    eventos do dia se esvazia, sem TIME_SLEEP. Com a mesma semente, duas execuções
+    produzem exatamente o mesmo resultado.
+    """
+
+    def __init__(self, specs, seed=0, latency=MESSAGE_LATENCY):
+        random.seed(seed)
+        self.seed = seed
+        self.r = MemoryRedis()
+        self.events = EventQueue()
+        self.bus = SimBus(self.events, latency)
+        self.entities = [build_entity(spec, self.r, SYNC_ENTITY_CLASSES) for spec in specs]
+        for entity in self.entities:
+            entity.transport = self.bus.transport(entity.entity_name)
+            entity.call_later = self.call_later
+            entity.clock = self.clock
+            self.bus.subscribe(_channel_of(entity), entity.handle_message)
+
+        self.products = product_inventory(self.r)
+        self.warehouse = warehouse_inventory(self.r)
+        self.products.set_all(init_redis.INITIAL_PRODUCT_STOCK)
+        self.warehouse.set_all(init_redis.INITIAL_WAREHOUSE_STOCK)
+        self.day = 0
+        self.history = []
+
+    def clock(self):
+        """Relógio das entidades em segundos, derivado do tempo virtual (um dia = TIME_SLEEP s)."""
+        return self.events.now * utils.TIME_SLEEP
+
+    def call_later(self, delay, callback, *args):
+        """Temporizadores das entidades em tempo virtual ('delay' em segundos; um dia = TIME_SLEEP s)."""
+        self.events.schedule(delay / utils.TIME_SLEEP, callback, *args)
+
+    def _run_day_steps(self):
+        for kind in DAY_STEP_ORDER:
+            for entity in self.entities:
+                if not isinstance(entity, kind):
+                    continue
+                if kind is ProductStockRedis:
+                    sold_before = self.r.llen(LOG_CONSUMPTION_KEY)
+                    entity.simulate_daily_customer_orders()
+                    sold = self.r.llen(LOG_CONSUMPTION_KEY) - sold_before
+                    self.bus.stats["sales_attempted"] += NUM_PRODUCTS
+                    self.bus.stats["sales_fulfilled"] += sold
+                elif kind is WarehouseRedis:
+                    entity.check_and_order_parts_from_supplier()
+                elif kind is LineRedis:
+                    entity.check_and_order_parts()
+                else:
+                    entity.order_daily_batch()
+
+    def _record_day(self):
+        self.history.append({
+            'day': self.day,
+            'product_stock': self.products.get_all(),
+            'warehouse_min': min(self.warehouse.get_all()),
+            'warehouse_stock': sum(self.warehouse.get_all()),
+            'line_stock': sum(
+                sum(e.inventory.get_all()) for e in self.entities if isinstance(e, LineRedis)
+            ),
+            'lines_waiting': sum(
+                1 for e in self.entities if isinstance(e, LineRedis) and e.is_waiting_for_parts
+            ),
+        })
+
+    def run(self, days):
+        """Simula 'days' dias a partir do dia atual e retorna o resumo."""
+        for _ in range(days):
+            self.day += 1
+            self.r.set("simulation:day", self.day)
+            self.events.schedule(self.day - self.events.now, self._run_day_steps)
+            self.events.run_until(self.day + 1)
+            self._record_day()
+        return self.summary()
+
+    def summary(self):
+        stats = self.bus.stats
+        attempted = stats["sales_attempted"]
+        return {
+            'seed': self.seed,
+            'days': self.day,
+            'sales_attempted': attempted,
+            'sales_fulfilled': stats["sales_fulfilled"],
+            'fill_rate': stats["sales_fulfilled"] / attempted if attempted else 0.0,
+            'production_orders': stats["msg:receive_order"],
+            'line_breaks': stats["msg:receive_order"] - stats["msg:receive_products"],
+            'units_ordered': stats["units_ordered"],
+            'units_produced': stats["units_produced"],
+            'line_restock_requests': stats["line_restock_requests"],
+            'line_restock_shipments': stats["line_restock_shipments"],
+            'line_restock_rejections': stats["msg:reject_parts"],
+            'supplier_orders': stats["msg:send_parts"] - stats["line_restock_requests"],
+            'supplier_deliveries': stats["supplier_deliveries"],
+            'avg_line_stock': _mean(h['line_stock'] for h in self.history),
+            'avg_warehouse_stock': _mean(h['warehouse_stock'] for h in self.history),
+            'pending_events': len(self.events),
+        }
+
+
+def _mean(values):
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
+
+
+def _project_modules():
+    """Módulos do projeto já importados: os que podem ter copiado constantes de utils.py por nome."""
+    modules = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR:
+            modules.append(module)
+    return modules
+
+
+def _parse_override(current, raw):
+    """
+    Converte o texto do --set para o tipo da constante atual (bool('False') seria
+    True). Constantes numéricas aceitam inteiro ou decimal (TIME_SLEEP=0.3).
+    """
+    if isinstance(current, bool):
+        if raw.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f"Valor booleano inválido: '{raw}'")
+        return raw.lower() in ('true', '1')
+    if isinstance(current, (int, float)):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    return type(current)(raw)
+
+
+def apply_overrides(overrides):
+    """
+    Aplica 'NOME=valor' às constantes de utils.py em todos os módulos que as importaram.
+    Constantes derivadas (ex.: YELLOW_ALERT_LINE = BATCH_SIZE * 6) não são recalculadas.
+    """
+    for override in overrides:
+        name, _, raw = override.partition("=")
+        if not hasattr(utils, name):
+            raise ValueError(f"Constante desconhecida em utils.py: '{name}'")
+        value = _parse_override(getattr(utils, name), raw)
+        for module in _project_modules():
+            if hasattr(module, name):
+                setattr(module, name, value)
+
+
+def format_summary(summary, elapsed):
+    return "\n".join([
+        f"Dias simulados: {summary['days']} em {elapsed:.2f}s "
+        f"({summary['days'] / elapsed if elapsed else 0:.0f} dias/s, semente {summary['seed']})",
+        f"Vendas atendidas: {summary['sales_fulfilled']}/{summary['sales_attempted']} "
+        f"({summary['fill_rate']:.1%})",
+        f"Ordens de produção: {summary['production_orders']} "
+        f"(quebras de linha: {summary['line_breaks']})",
+        f"Unidades pedidas/produzidas: {summary['units_ordered']}/{summary['units_produced']}",
+        f"Pedidos de peças das linhas: {summary['line_restock_requests']} "
+        f"(atendidos: {summary['line_restock_shipments']}, recusados: {summary['line_restock_rejections']})",
+        f"Pedidos ao fornecedor: {summary['supplier_orders']} (remessas entregues: {summary['supplier_deliveries']})",
+        f"Estoque médio de peças: linhas {summary['avg_line_stock']:.0f}, "
+        f"almoxarifado {summary['avg_warehouse_stock']:.0f}",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulação acelerada (eventos discretos, sem Redis).")
+    parser.add_argument("--days", type=int, default=365, help="dias simulados (padrão: 365)")
+    parser.add_argument("--seed", type=int, default=0, help="semente dos pedidos de clientes")
+    parser.add_argument("--topology", default="topology.json", help="arquivo de topologia (padrão: topology.json)")
+    parser.add_argument("--set", action="append", default=[], metavar="NOME=VALOR",
+                        help="sobrescreve uma constante de utils.py (pode repetir)")
+    parser.add_argument("--json", help="salva resumo e histórico diário neste arquivo")
+    parser.add_argument("--log-level", default="WARNING", help="nível dos logs das entidades (padrão: WARNING)")
+    args = parser.parse_args()
+
+    set_log_level(args.log_level)
+    try:
+        apply_overrides(args.set)
+        specs, _, _ = load_topology(args.topology)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+
+    engine = SimulationEngine(specs, seed=args.seed)
+    started = time.perf_counter()
+    summary = engine.run(args.days)
+    elapsed = time.perf_counter() - started
+    print(format_summary(summary, elapsed))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'overrides': args.set, 'summary': summary, 'history': engine.history}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -36,34 +36,11 @@ echo "=== Inicializando dados no Redis ==="
 python3 init_redis.py
 
 echo "=== Iniciando serviços Python ==="
-# Fornecedor
-python3 supplier_redis.py    > debug_logs/supplier.log    &
-
-# Almoxarifado
-python3 warehouse_redis.py   > debug_logs/warehouse.log   &
-
-# Linhas da Fábrica 1 (empurrada)
-for i in {1..5}; do
-  echo "Iniciando linha $i da Fábrica 1 (empurrada)..."
-  python3 line_redis.py $i 1 > debug_logs/line1_$i.log &
-done
-
-# Linhas da Fábrica 2 (puxada)
-for i in {1..8}; do
-  echo "Iniciando linha $i da Fábrica 2 (puxada)..."
-  python3 line_redis.py $i 2 > debug_logs/line2_$i.log &
-done
-
-# Fábricas
-echo "Iniciando Fábrica 1 (empurrada)..."
-python3 factory_redis.py empurrada 1 5 > debug_logs/factory1.log &
-
-echo "Iniciando Fábrica 2 (puxada)..."
-python3 factory_redis.py puxada     2 8 > debug_logs/factory2.log &
-
-# Estoque de produtos acabados (simulador de clientes)
-echo "Iniciando estoque de produtos acabados..."
-python3 product_stock_redis.py > debug_logs/product_stock.log &
+# Fornecedor, almoxarifado, fábricas, linhas e estoque de produtos rodam sob o
+# supervisor, que lê a topologia de topology.json, agrupa as entidades em
+# processos worker e reinicia os que caírem.
+echo "Iniciando supervisor (topologia: topology.json)..."
+python3 supervisor.py topology.json > debug_logs/supervisor.log &
 
 # Kanban Web (Flask)
 echo "Iniciando Kanban Web..."
@@ -2,7 +2,10 @@
 
 echo "Encerrando todos os processos da simulação..."
 
-# Mata todos os scripts Python relacionados à simulação
+# O supervisor recebe SIGTERM e encerra seus workers de forma ordenada
+pkill -f supervisor.py
+
+# Mata todos os scripts Python relacionados à simulação (inclusive os iniciados à mão)
 pkill -f supplier_redis.py
 pkill -f warehouse_redis.py
 pkill -f line_redis.py
@@ -0,0 +1,229 @@
+# supervisor.py
+
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from async_runtime import main_async
+from supplier_model import supplier_specs
+from warehouse_shards import warehouse_specs
+from utils import print_update
+
+ENTITY_NAME = 'supervisor'
+
+# Intervalo entre verificações dos workers e entre relatórios de CPU/memória (segundos)
+CHECK_INTERVAL = 1
+STATS_INTERVAL = 30
+
+# Backoff de reinício: dobra a cada queda seguida, até RESTART_BACKOFF_MAX
+RESTART_BACKOFF_MIN = 1
+RESTART_BACKOFF_MAX = 60
+# Um worker que ficou vivo por esse tempo volta ao backoff mínimo
+RESTART_RESET_AFTER = 60
+
+# Tempo para os workers encerrarem após SIGTERM antes de receberem SIGKILL
+SHUTDOWN_TIMEOUT = 10
+
+
+def load_topology(path):
+    """
+    Lê a topologia (JSON) e retorna (especificações das entidades, entidades por worker, pin_cpus).
+    As especificações seguem o formato de async_runtime.build_entity.
+    """
+    with open(path, "r") as f:
+        topology = json.load(f)
+
+    specs = [*supplier_specs(), *warehouse_specs(), "product_stock"]
+    for factory in topology["factories"]:
+        specs.append(f"factory:{factory['type']}:{factory['id']}:{factory['lines']}")
+    for factory in topology["factories"]:
+        specs.extend(f"line:{line_id}:{factory['id']}" for line_id in range(1, factory["lines"] + 1))
+
+    return specs, int(topology.get("entities_per_worker", 4)), bool(topology.get("pin_cpus", False))
+
+
+def group_specs(specs, per_worker):
+    return [specs[i:i + per_worker] for i in range(0, len(specs), per_worker)]
+
+
+async def _serve(specs):
+    # SIGTERM cancela a tarefa principal; o asyncio cancela as entidades em cascata.
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        await main_async(specs)
+    except asyncio.CancelledError:
+        pass
+
+
+def worker_main(specs, cpu):
+    """Ponto de entrada de cada processo worker: hospeda suas entidades em um loop asyncio."""
+    # Ctrl+C vai para o grupo de processos inteiro; quem decide o encerramento é o supervisor.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    asyncio.run(_serve(specs))
+
+
+class Worker:
+    """Um processo filho e o estado necessário para reiniciá-lo e medir seu consumo."""
+
+    def __init__(self, index, specs, cpu):
+        self.index = index
+        self.specs = specs
+        self.cpu = cpu
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = RESTART_BACKOFF_MIN
+        self.restart_at = None
+        self._last_cpu_ticks = None
+        self._last_sample_at = None
+
+    @property
+    def name(self):
+        return f"worker-{self.index}"
+
+    def start(self):
+        self.process = multiprocessing.Process(
+            target=worker_main, args=(self.specs, self.cpu), name=self.name, daemon=False
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        self._last_cpu_ticks = None
+        print_update(f"{self.name} (pid {self.process.pid}, cpu {self.cpu}) iniciado com {self.specs}", ENTITY_NAME)
+
+    def stats(self):
+        """Retorna (CPU %, RSS em MB) lendo /proc, ou None se não estiver disponível."""
+        pid = self.process.pid
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+
+        # utime e stime são os campos 14 e 15 de /proc/[pid]/stat (11 e 12 após o nome)
+        ticks = int(fields[11]) + int(fields[12])
+        now = time.monotonic()
+        cpu_percent = 0.0
+        if self._last_cpu_ticks is not None and now > self._last_sample_at:
+            elapsed_ticks = (now - self._last_sample_at) * os.sysconf("SC_CLK_TCK")
+            cpu_percent = 100.0 * (ticks - self._last_cpu_ticks) / elapsed_ticks
+        self._last_cpu_ticks, self._last_sample_at = ticks, now
+        rss_mb = rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        return cpu_percent, rss_mb
+
+
+class Supervisor:
+
+    def __init__(self, specs, per_worker, pin_cpus):
+        if pin_cpus and not hasattr(os, "sched_setaffinity"):
+            # Afinidade de CPU só existe no Linux; nos outros sistemas os workers não são fixados.
+            print_update("pin_cpus ignorado: afinidade de CPU indisponível neste sistema.", ENTITY_NAME)
+            pin_cpus = False
+        cpus = sorted(os.sched_getaffinity(0)) if pin_cpus else None
+        self.workers = [
+            Worker(i, group, cpus[i % len(cpus)] if cpus else None)
+            for i, group in enumerate(group_specs(specs, per_worker))
+        ]
+        self.stopping = False
+
+    def _request_stop(self, signum, frame):
+        self.stopping = True
+
+    def check_workers(self):
+        """Agenda o reinício de workers que morreram, com backoff exponencial."""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            if worker.restart_at is None:
+                uptime = now - worker.started_at
+                if uptime >= RESTART_RESET_AFTER:
+                    worker.backoff = RESTART_BACKOFF_MIN
+                worker.restart_at = now + worker.backoff
+                print_update(
+                    f"{worker.name} caiu (código {worker.process.exitcode}) após {uptime:.0f}s. "
+                    f"Reiniciando em {worker.backoff}s.", ENTITY_NAME
+                )
+                worker.backoff = min(worker.backoff * 2, RESTART_BACKOFF_MAX)
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                worker.start()
+
+    def report_stats(self):
+        lines = []
+        for worker in self.workers:
+            if not worker.process.is_alive():
+                lines.append(f"{worker.name}: parado (reinícios: {worker.restarts})")
+                continue
+            stats = worker.stats()
+            if stats is None:
+                lines.append(f"{worker.name}: pid {worker.process.pid} (sem /proc)")
+                continue
+            cpu_percent, rss_mb = stats
+            lines.append(
+                f"{worker.name}: pid {worker.process.pid}, CPU {cpu_percent:.1f}%, "
+                f"RSS {rss_mb:.1f} MB, reinícios {worker.restarts}"
+            )
+        print_update("Estatísticas dos workers:\n" + "\n".join(lines), ENTITY_NAME)
+
+    def shutdown(self):
+        print_update("Encerrando workers...", ENTITY_NAME)
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in self.workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                print_update(f"{worker.name} não encerrou a tempo; enviando SIGKILL.", ENTITY_NAME)
+                worker.process.kill()
+                worker.process.join()
+        print_update("Todos os workers foram encerrados.", ENTITY_NAME)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for worker in self.workers:
+            worker.start()
+
+        last_stats = time.monotonic()
+        while not self.stopping:
+            time.sleep(CHECK_INTERVAL)
+            if self.stopping:
+                break
+            self.check_workers()
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                last_stats = time.monotonic()
+                self.report_stats()
+
+        self.shutdown()
+
+
+def main():
+    """Uso: python3 supervisor.py [arquivo de topologia (padrão: topology.json)]"""
+    path = sys.argv[1] if len(sys.argv) > 1 else "topology.json"
+    try:
+        specs, per_worker, pin_cpus = load_topology(path)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"ERRO CRÍTICO: Topologia inválida em '{path}'. Detalhes: {e}")
+        sys.exit(1)
+
+    supervisor = Supervisor(specs, per_worker, pin_cpus)
+    print_update(
+        f"{len(specs)} entidades em {len(supervisor.workers)} workers ({per_worker} por worker).",
+        ENTITY_NAME
+    )
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
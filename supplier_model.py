@@ -0,0 +1,181 @@
+# supplier_model.py
+
+import heapq
+import itertools
+import random
+import threading
+from collections import namedtuple
+import utils
+from utils import (
+    supplier_channel,
+    TIME_SLEEP,
+    NUM_PARTS,
+    SUPPLIER_DAILY_CAPACITY,
+    SUPPLIER_LEAD_TIME_MIN,
+    SUPPLIER_LEAD_TIME_MODE,
+    SUPPLIER_LEAD_TIME_MAX
+)
+from warehouse_shards import part_range, ShardRouter
+
+# Catálogo de um fornecedor: faixa de peças que ele fornece, tempo de entrega
+# (dias, distribuição triangular mín/moda/máx) e capacidade diária (unidades,
+# 0 = ilimitada).
+SupplierSpec = namedtuple('SupplierSpec', ['supplier_id', 'parts', 'lead_time', 'daily_capacity'])
+
+# Entrega agendada: instante de chegada (relógio da entidade, s), shard do
+# almoxarifado que pediu e vetor de quantidades.
+Delivery = namedtuple('Delivery', ['due', 'seq', 'shard', 'amounts'])
+
+# O que um pedido mudou na agenda, para o chamador persistir: remessas novas,
+# capacidade ocupada por dia de expedição ({dia: unidades}) e dias já passados
+# que saíram da contagem de capacidade.
+ScheduledOrder = namedtuple('ScheduledOrder', ['deliveries', 'booked', 'expired_days'])
+
+
+def supplier_catalogue(supplier_id):
+    return SupplierSpec(
+        supplier_id,
+        part_range(supplier_id, utils.SUPPLIERS),
+        (SUPPLIER_LEAD_TIME_MIN, SUPPLIER_LEAD_TIME_MODE, SUPPLIER_LEAD_TIME_MAX),
+        SUPPLIER_DAILY_CAPACITY,
+    )
+
+
+def supplier_specs():
+    """Especificações (async_runtime.build_entity) de todos os fornecedores."""
+    if utils.SUPPLIERS == 1:
+        return ["supplier"]
+    return [f"supplier:{supplier_id}" for supplier_id in range(utils.SUPPLIERS)]
+
+
+class SupplierRouter:
+    """Divide um pedido do almoxarifado entre os fornecedores donos das peças."""
+
+    def __init__(self):
+        self._router = ShardRouter(utils.SUPPLIERS)
+
+    def split(self, vector):
+        """Retorna [(fornecedor, canal, parte do vetor)] só dos fornecedores com alguma peça pedida."""
+        return [(supplier_id, supplier_channel(supplier_id), piece)
+                for supplier_id, piece in self._router.split(vector)]
+
+
+class DeliveryScheduler:
+    """
+    Agenda das entregas de um fornecedor. Cada pedido é consolidado com o que já
+    está em produção ou a caminho (só a diferença é agendada, então pedidos
+    repetidos pelo prazo vencido não duplicam a entrega), ocupa a capacidade dos
+    próximos dias e sai em uma remessa por dia de expedição, que chega depois de
+    um tempo de entrega sorteado. As remessas ficam em uma fila ordenada pelo
+    instante de chegada. Os instantes usam o relógio da entidade (segundos, um
+    dia = TIME_SLEEP s). A agenda não acessa o Redis: order() e pop_due() dizem o
+    que mudou, e restore() a reconstrói a partir do que foi persistido.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.in_flight = [0] * NUM_PARTS
+        self.consolidated = 0
+        self._booked = {}
+        self._open_day = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # Gerador próprio, semeado pelo global: os sorteios dos tempos de entrega
+        # não mudam a sequência de pedidos dos clientes de uma mesma semente.
+        self._random = random.Random(random.getrandbits(64))
+
+    def _lead_time(self):
+        low, mode, high = self.spec.lead_time
+        return self._random.triangular(low, high, mode) * TIME_SLEEP
+
+    def restore(self, deliveries, booked):
+        """Reconstrói a agenda (remessas a caminho e capacidade ocupada) persistida antes de um reinício."""
+        with self._lock:
+            self._queue = list(deliveries)
+            heapq.heapify(self._queue)
+            self.in_flight = [0] * NUM_PARTS
+            for delivery in self._queue:
+                for part, quantity in enumerate(delivery.amounts):
+                    self.in_flight[part] += quantity
+            self._booked = dict(booked)
+            self._open_day = 0
+            self._seq = itertools.count(max((delivery.seq for delivery in self._queue), default=-1) + 1)
+
+    def _book(self, amount, today):
+        """Ocupa a capacidade a partir de hoje; retorna [(dia de expedição, quantidade)]."""
+        capacity = self.spec.daily_capacity
+        if not capacity:
+            return [(today, amount)]
+        chunks = []
+        day = max(today, self._open_day)
+        while amount:
+            free = capacity - self._booked.get(day, 0)
+            if free <= 0:
+                day += 1
+                self._open_day = day
+                continue
+            take = min(free, amount)
+            self._booked[day] = self._booked.get(day, 0) + take
+            chunks.append((day, take))
+            amount -= take
+        return chunks
+
+    def order(self, amounts, shard, now):
+        """
+        Agenda um pedido (vetor de quantidades). Retorna o ScheduledOrder com o
+        que mudou na agenda; next_due() dá o temporizador a ajustar.
+        """
+        today = int(now // TIME_SLEEP)
+        shipments = {}
+        booked = {}
+        deliveries = []
+        with self._lock:
+            for part in self.spec.parts:
+                extra = amounts[part] - self.in_flight[part]
+                if amounts[part] and extra <= 0:
+                    self.consolidated += 1
+                if extra <= 0:
+                    continue
+                self.in_flight[part] += extra
+                for day, quantity in self._book(extra, today):
+                    shipments.setdefault(day, [0] * NUM_PARTS)[part] += quantity
+                    booked[day] = booked.get(day, 0) + quantity
+            for day, shipment in sorted(shipments.items()):
+                shipped_at = max(now, day * TIME_SLEEP)
+                delivery = Delivery(shipped_at + self._lead_time(), next(self._seq), shard, shipment)
+                heapq.heappush(self._queue, delivery)
+                deliveries.append(delivery)
+            expired_days = [day for day in self._booked if day < today]
+            for day in expired_days:
+                del self._booked[day]
+            return ScheduledOrder(deliveries, booked, expired_days)
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def next_due(self):
+        with self._lock:
+            return self._queue[0].due if self._queue else None
+
+    def pop_due(self, now):
+        """Retira as remessas que já chegaram, na ordem de chegada."""
+        arrived = []
+        with self._lock:
+            while self._queue and self._queue[0].due <= now:
+                delivery = heapq.heappop(self._queue)
+                for part, quantity in enumerate(delivery.amounts):
+                    self.in_flight[part] -= quantity
+                arrived.append(delivery)
+        return arrived
+
+
+def totals_by_shard(deliveries):
+    """Soma as remessas por shard do almoxarifado: [(shard, vetor)]."""
+    totals = {}
+    for delivery in deliveries:
+        total = totals.setdefault(delivery.shard, [0] * NUM_PARTS)
+        for part, quantity in enumerate(delivery.amounts):
+            total[part] += quantity
+    return list(totals.items())
@@ -1,78 +1,277 @@
 # supplier_redis.py
 
+import json
 import redis
+import sys
 import threading
 import time
+from metrics import EntityMetrics
+from supplier_model import Delivery, DeliveryScheduler, supplier_catalogue, totals_by_shard
+from transport_redis import make_transport
+from warehouse_shards import ShardRouter
 from utils import (
-    list_to_string,
-    string_to_list,
+    make_redis_client,
+    call_later,
+    async_call_later,
+    encode_message,
+    decode_message,
+    supplier_channel,
     print_update,
+    CURRENT_TRACE,
     PARTS_TO_SEND_AMOUNT_SUPPLIER,
+    NUM_PARTS,
     TIME_SLEEP,
     DAYS_MAX,
-    REDIS_HOST,
-    REDIS_PORT
+    SUPPLIERS
 )
 
+class DeliveryStore:
+    """
+    Agenda de um fornecedor persistida no Redis: o transporte confirma o pedido
+    assim que o handler retorna, então as remessas aceitas precisam sobreviver a
+    um reinício do processo. Hash supplier:{id}:deliveries (seq -> remessa em
+    JSON) e supplier:{id}:booked (dia de expedição -> unidades ocupadas).
+    """
+
+    def __init__(self, redis_client, supplier_id):
+        self.r = redis_client
+        self.deliveries_key = f"supplier:{supplier_id}:deliveries"
+        self.booked_key = f"supplier:{supplier_id}:booked"
+
+    def queue_order(self, pipe, scheduled):
+        """Enfileira no pipeline as mudanças de um ScheduledOrder."""
+        if scheduled.deliveries:
+            pipe.hset(self.deliveries_key, mapping={
+                delivery.seq: json.dumps([delivery.due, delivery.shard, delivery.amounts])
+                for delivery in scheduled.deliveries
+            })
+        for day, units in scheduled.booked.items():
+            pipe.hincrby(self.booked_key, day, units)
+        if scheduled.expired_days:
+            pipe.hdel(self.booked_key, *scheduled.expired_days)
+
+    def queue_remove(self, pipe, deliveries):
+        """Enfileira no pipeline a remoção das remessas entregues."""
+        if deliveries:
+            pipe.hdel(self.deliveries_key, *[delivery.seq for delivery in deliveries])
+
+    @staticmethod
+    def _parse(deliveries, booked):
+        parsed = []
+        for seq, payload in deliveries.items():
+            due, shard, amounts = json.loads(payload)
+            parsed.append(Delivery(due, int(seq), shard, amounts))
+        return parsed, {int(day): int(units) for day, units in booked.items()}
+
+    def load(self):
+        """Retorna as remessas a caminho e a capacidade ocupada por dia."""
+        return self._parse(self.r.hgetall(self.deliveries_key), self.r.hgetall(self.booked_key))
+
+class AsyncDeliveryStore(DeliveryStore):
+    """Variante asyncio da agenda persistida (os queue_* não mudam: só enfileiram)."""
+
+    async def load(self):
+        return self._parse(await self.r.hgetall(self.deliveries_key), await self.r.hgetall(self.booked_key))
+
 class SupplierRedis:
+    """
+    Fornecedor (ou um deles, com SUPPLIERS > 1) das peças do seu catálogo. Os
+    pedidos não são mais atendidos na hora: o DeliveryScheduler consolida,
+    encaixa na capacidade diária e sorteia o tempo de entrega, e um temporizador
+    entrega as remessas na ordem de chegada. A agenda é gravada no Redis junto
+    com cada pedido e recarregada quando o listener começa.
+    """
+    store_class = DeliveryStore
 
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, supplier_id=0):
         self.r = redis_client
-        self.entity_name = 'supplier'
+        self.supplier_id = int(supplier_id)
+        self.entity_name = 'supplier' if SUPPLIERS == 1 else f'supplier-{self.supplier_id}'
+        self.channel = supplier_channel(self.supplier_id)
+        self.transport = make_transport(self.r, self.entity_name)
+        self.metrics = EntityMetrics(self.entity_name, self.r)
+        # Entrega cada lote ao shard do almoxarifado que o pediu.
+        self.router = ShardRouter()
+        self.schedule = DeliveryScheduler(supplier_catalogue(self.supplier_id))
+        self.store = self.store_class(self.r, self.supplier_id)
+        self.call_later = call_later
+        # Relógio de parede: os instantes de chegada persistidos continuam valendo
+        # depois de um reinício.
+        self.clock = time.time
+        # Último pedido de cada shard (id e trace): as remessas respondem a ele,
+        # mesmo as agendadas por pedidos anteriores que foram consolidados.
+        self.latest_orders = {}
+        self._timer_at = None
+        self._timer_lock = threading.Lock()
+        self._restored = False
 
-    def send_parts(self, parts_ordered):
-        """
-        Prepara e envia um lote de peças para o almoxarifado com base no pedido recebido.
-        """
-        # <<< NOTA: O número total de peças diferentes é 100 (de 0 a 99)
-        parts_to_send = [0] * 100
+    def _parts_to_send(self, parts_ordered):
+        """Converte o vetor do pedido (flags ou quantidades) no vetor de quantidades a enviar."""
+        parts_to_send = [0] * NUM_PARTS
         for idx, needs_part in enumerate(parts_ordered):
-            # Se a posição na lista for 1, significa que aquela peça precisa ser enviada.
-            if needs_part:
+            # 1 é uma flag (lote padrão do fornecedor); valores maiores já são a quantidade pedida.
+            if needs_part == 1:
                 parts_to_send[idx] = PARTS_TO_SEND_AMOUNT_SUPPLIER
+            elif needs_part:
+                parts_to_send[idx] = needs_part
+        return parts_to_send
 
-        # <<< NOTA: A mensagem é simples: "comando/payload"
-        # O almoxarifado (warehouse) vai ouvir por "receive_parts"
-        payload = list_to_string(parts_to_send)
-        msg = f"receive_parts/{payload}"
-        
-        print_update(f"Recebeu pedido. Enviando peças para o Almoxarifado.", self.entity_name)
-        self.r.publish("channel:warehouse", msg)
+    def _reply_fields(self, request_id):
+        # Pedidos sem id (almoxarifado antigo) recebem a resposta original, só com o vetor.
+        return [request_id, self.supplier_id] if request_id else []
+
+    def _schedule_order(self, parts_ordered, request_id, shard):
+        """
+        Registra o pedido na agenda e retorna o pipeline que a persiste; o
+        temporizador só deve ser armado depois de executá-lo.
+        """
+        self.latest_orders[shard] = (request_id, CURRENT_TRACE.get())
+        scheduled = self.schedule.order(self._parts_to_send(parts_ordered), shard, self.clock())
+        print_update(f"Recebeu pedido {request_id}. Remessas a caminho: {self.schedule.pending}.", self.entity_name)
+        pipe = self.r.pipeline(transaction=False)
+        self.store.queue_order(pipe, scheduled)
+        return pipe
+
+    def _restore(self, deliveries, booked):
+        """Recoloca na agenda o que foi persistido e retorna o temporizador da próxima entrega."""
+        self._restored = True
+        self.schedule.restore(deliveries, booked)
+        if deliveries:
+            print_update(f"Agenda recarregada do Redis: {len(deliveries)} remessas a caminho.", self.entity_name)
+        return self._arm_timer(self.schedule.next_due(), self.clock())
+
+    def _arm_timer(self, due, now):
+        """Passa o temporizador para 'due' se ele vencer antes do atual; retorna (atraso, due) ou None."""
+        with self._timer_lock:
+            if due is None or (self._timer_at is not None and self._timer_at <= due):
+                return None
+            self._timer_at = due
+        return max(due - now, 0), due
+
+    def _start_timer(self, timer):
+        if timer is not None:
+            delay, due = timer
+            self.call_later(delay, self.metrics.timer(self.deliver_due), due)
+
+    def _fire_timer(self, armed_for):
+        """Retorna se este é o temporizador atual (os substituídos só entregam, sem rearmar)."""
+        with self._timer_lock:
+            if self._timer_at != armed_for:
+                return False
+            self._timer_at = None
+            return True
+
+    def _deliveries(self):
+        """
+        Retira da agenda as remessas que chegaram e retorna o pipeline que as
+        publica e as apaga da agenda persistida (ou None, se nada chegou).
+        """
+        arrived = self.schedule.pop_due(self.clock())
+        if not arrived:
+            return None
+        pipe = self.r.pipeline(transaction=False)
+        for shard, parts_to_send in totals_by_shard(arrived):
+            # <<< NOTA: A mensagem leva o id do pedido e o vetor de quantidades.
+            # O almoxarifado (warehouse) vai ouvir por "receive_parts"
+            request_id, trace_id = self.latest_orders.get(shard, (0, 0))
+            for channel, piece in self.router.route_delivery(parts_to_send, shard):
+                msg = encode_message("receive_parts", self._reply_fields(request_id), piece, trace_id=trace_id)
+                print_update("Remessa entregue ao Almoxarifado.", self.entity_name)
+                self.transport.queue_publish(pipe, channel, msg)
+        self.store.queue_remove(pipe, arrived)
+        return pipe
+
+    def send_parts(self, parts_ordered, request_id=0, shard=None):
+        """
+        Agenda o lote de peças pedido pelo almoxarifado (ou o shard que fez o
+        pedido); a entrega sai quando a remessa chegar.
+        """
+        self._schedule_order(parts_ordered, request_id, shard).execute()
+        self._start_timer(self._arm_timer(self.schedule.next_due(), self.clock()))
+
+    def deliver_due(self, armed_for=None):
+        """Entrega as remessas que chegaram e rearma o temporizador para a próxima."""
+        current = self._fire_timer(armed_for)
+        pipe = self._deliveries()
+        if pipe is not None:
+            pipe.execute()
+        if current:
+            self._start_timer(self._arm_timer(self.schedule.next_due(), self.clock()))
 
     def listen(self):
         """
-        Ouve continuamente o canal 'channel:supplier' por novas mensagens.
+        Ouve continuamente o canal do fornecedor por novas mensagens.
         """
-        pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:supplier")
-        print_update("Ouvindo o canal 'channel:supplier' por pedidos do almoxarifado...", self.entity_name)
+        if not self._restored:
+            self._start_timer(self._restore(*self.store.load()))
+        print_update(f"Ouvindo o canal '{self.channel}' por pedidos do almoxarifado...", self.entity_name)
         
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                payload = message['data']
-                parts = payload.split("/")
-                
-                # O comando esperado é "send_parts" vindo do almoxarifado
-                if parts[0] == "send_parts":
-                    ordered_list_str = parts[1]
-                    ordered_list = string_to_list(ordered_list_str)
-                    self.send_parts(ordered_list)
+        for data in self.transport.listen(self.channel):
+            self.metrics.dispatch(self.handle_message, data, self.transport)
+
+    def handle_message(self, data):
+        msg = decode_message(data)
+        # O comando esperado é "send_parts" vindo do almoxarifado: [request_id, shard]
+        if msg.command == "send_parts":
+            self.send_parts(msg.vector, *msg.fields[:2])
+
+class AsyncSupplierRedis(SupplierRedis):
+    """Variante asyncio do fornecedor (redis.asyncio), para várias entidades em um só processo."""
+    store_class = AsyncDeliveryStore
+
+    def __init__(self, redis_client, supplier_id=0):
+        super().__init__(redis_client, supplier_id)
+        self.call_later = async_call_later
+
+    async def send_parts(self, parts_ordered, request_id=0, shard=None):
+        await self._schedule_order(parts_ordered, request_id, shard).execute()
+        self._start_timer(self._arm_timer(self.schedule.next_due(), self.clock()))
+
+    async def deliver_due(self, armed_for=None):
+        current = self._fire_timer(armed_for)
+        pipe = self._deliveries()
+        if pipe is not None:
+            await pipe.execute()
+        if current:
+            self._start_timer(self._arm_timer(self.schedule.next_due(), self.clock()))
+
+    async def listen(self):
+        if not self._restored:
+            self._start_timer(self._restore(*await self.store.load()))
+        print_update(f"Ouvindo o canal '{self.channel}' por pedidos do almoxarifado...", self.entity_name)
+        async for data in self.transport.listen(self.channel):
+            await self.metrics.dispatch_async(self.handle_message, data, self.transport)
+
+    async def handle_message(self, data):
+        msg = decode_message(data)
+        if msg.command == "send_parts":
+            await self.send_parts(msg.vector, *msg.fields[:2])
+
+    async def run(self):
+        """O fornecedor é puramente reativo: não tem loop de dias."""
+        print_update("Processo iniciado. Aguardando reativamente por pedidos.", self.entity_name)
 
 def main():
     """
     Função principal para iniciar o processo do fornecedor.
+    Uso: python3 supplier_redis.py [supplier_id]
     """
+    if len(sys.argv) > 2:
+        print("Uso: python3 supplier_redis.py [supplier_id]")
+        sys.exit(1)
+    supplier_id = int(sys.argv[1]) if len(sys.argv) == 2 else 0
+
     try:
         # <<< MELHORIA: A conexão com o Redis é feita aqui e passada para a classe.
         # Isso torna o código mais limpo e fácil de testar.
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'supplier-main')
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Verifique se ele está rodando. Detalhes: {e}")
         return
 
-    sup = SupplierRedis(r)
+    sup = SupplierRedis(r, supplier_id)
     
     # Inicia o listener em uma thread separada para não bloquear o loop principal.
     listener_thread = threading.Thread(target=sup.listen, daemon=True)
@@ -0,0 +1,23 @@
+# test_demand_forecast.py
+
+from demand_forecast import plan_lots
+
+
+def test_one_line_per_product():
+    assert plan_lots([10, 20, 30], 3, max_lot=100) == [(0, 10, 0), (1, 20, 1), (2, 30, 2)]
+
+
+def test_extra_lines_go_to_largest_need_per_line():
+    # D'Hondt: 300/2 e 300/3 vencem 160/2; a última linha vai para 160/2 = 80 > 300/4.
+    lots = plan_lots([300, 160], 5, max_lot=1000)
+    assert [product for _, _, product in lots] == [0, 1, 0, 0, 1]
+    assert {product: lot for _, lot, product in lots} == {0: 100, 1: 80}
+
+
+def test_lot_is_rounded_up_and_capped():
+    assert plan_lots([7, 500], 3, max_lot=200) == [(0, 7, 0), (1, 200, 1), (2, 200, 1)]
+    assert plan_lots([7, 0], 3, max_lot=200) == [(0, 4, 0), (2, 4, 0)]
+
+
+def test_products_without_need_get_no_lot():
+    assert plan_lots([0, 0, 5], 3, max_lot=10) == [(2, 5, 2)]
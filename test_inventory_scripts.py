@@ -0,0 +1,111 @@
+# test_inventory_scripts.py
+
+import copy
+import pytest
+from inventory_redis import (
+    CONSUME_HASH_LUA,
+    CONSUME_KEYS_LUA,
+    CONSUME_UP_TO_HASH_LUA,
+    CONSUME_UP_TO_KEYS_LUA,
+    HashInventory,
+    KeyInventory,
+    Shortage
+)
+from simulation_engine import MemoryRedis
+
+SIZE = 6
+
+# Estoques iniciais: tudo com saldo, itens curtos, saldo negativo e itens sem chave.
+SCENARIOS = {
+    'enough': [50, 40, 30, 30, 20, 10],
+    'short': [50, 3, 30, 0, 20, 10],
+    'negative': [-5, 40, 30, 7, 20, 10],
+    'missing': [None, 40, 30, None, 20, 10],
+}
+
+
+def inventory(cls, stock):
+    r = MemoryRedis()
+    inv = cls(r, 'inv', SIZE)
+    for i, value in enumerate(stock):
+        if value is not None:
+            inv.incr(i, value)
+    return inv
+
+
+@pytest.mark.parametrize('cls', [KeyInventory, HashInventory])
+class TestEmulatedScripts:
+    """Contrato dos scripts de consumo, pela emulação do MemoryRedis."""
+
+    def test_consume_decrements_every_item(self, cls):
+        inv = inventory(cls, SCENARIOS['enough'])
+        assert inv.consume([1, 3], 10) is None
+        assert inv.get_all() == [50, 30, 30, 20, 20, 10]
+
+    def test_shortage_reports_available_and_short_items(self, cls):
+        inv = inventory(cls, SCENARIOS['short'])
+        assert inv.consume([0, 1, 3, 5], 10) == Shortage(0, [1, 3])
+        assert inv.consume([0, 1, 2], 10) == Shortage(3, [1])
+        # Nada é baixado quando falta algum item.
+        assert inv.get_all() == SCENARIOS['short']
+
+    def test_negative_and_missing_count_as_empty(self, cls):
+        assert inventory(cls, SCENARIOS['negative']).consume([0, 1], 5) == Shortage(0, [0])
+        assert inventory(cls, SCENARIOS['missing']).consume([1, 3], 5) == Shortage(0, [3])
+
+    def test_consume_up_to_takes_the_limiting_item(self, cls):
+        inv = inventory(cls, SCENARIOS['short'])
+        assert inv.consume_up_to([0, 1, 2], 10) == (3, [1])
+        assert inv.get_all() == [47, 0, 27, 0, 20, 10]
+        assert inv.consume_up_to([0, 2], 10) == (10, [])
+        assert inv.consume_up_to([1, 3], 10) == (0, [1, 3])
+        assert inv.get_all() == [37, 0, 17, 0, 20, 10]
+
+
+# --- Scripts Lua reais contra a emulação (precisa do lupa) ---
+
+SCRIPTS = [CONSUME_KEYS_LUA, CONSUME_HASH_LUA, CONSUME_UP_TO_KEYS_LUA, CONSUME_UP_TO_HASH_LUA]
+
+
+def run_lua(script, r, keys, args):
+    """Roda o script com redis.call sobre o MemoryRedis, convertendo valores como o Redis."""
+    lupa = pytest.importorskip('lupa')
+    lua = lupa.LuaRuntime()
+
+    def reply(value):
+        return False if value is None else str(value)
+
+    def call(command, *params):
+        if command == 'GET':
+            return reply(r.get(params[0]))
+        if command == 'DECRBY':
+            return r.incrby(params[0], -int(params[1]))
+        if command == 'HMGET':
+            return lua.table(*(reply(value) for value in r.hmget(params[0], params[1:])))
+        if command == 'HINCRBY':
+            return r.hincrby(params[0], params[1], int(params[2]))
+        raise AssertionError(f"comando inesperado: {command}")
+
+    lua.execute('unpack = unpack or table.unpack')
+    lua.globals().KEYS = lua.table(*keys)
+    lua.globals().ARGV = lua.table(*(str(arg) for arg in args))
+    lua.globals().redis = lua.table_from({'call': call})
+    result = lua.execute(script)
+    return [int(result[i]) for i in range(1, len(result) + 1)]
+
+
+@pytest.mark.parametrize('script', SCRIPTS, ids=['keys', 'hash', 'up_to_keys', 'up_to_hash'])
+@pytest.mark.parametrize('scenario', sorted(SCENARIOS))
+@pytest.mark.parametrize('qty', [1, 10, 45])
+def test_lua_matches_emulation(script, scenario, qty):
+    cls = HashInventory if script in (CONSUME_HASH_LUA, CONSUME_UP_TO_HASH_LUA) else KeyInventory
+    inv = inventory(cls, SCENARIOS[scenario])
+    indices = [0, 1, 3, 5]
+    if cls is KeyInventory:
+        keys, args = [inv._key(i) for i in indices], [qty]
+    else:
+        keys, args = [inv.key], [qty, *indices]
+    lua_redis = copy.deepcopy(inv.r)
+    expected = inv.r.register_script(script)(keys=keys, args=args)
+    assert run_lua(script, lua_redis, keys, args) == expected
+    assert lua_redis.data == inv.r.data
@@ -0,0 +1,50 @@
+# test_reorder_policy.py
+
+import numpy as np
+import pytest
+from reorder_policy import AdaptiveReorder
+from utils import REORDER_SAFETY_FACTOR, MAD_TO_STD, REORDER_MIN_DAYS, REORDER_MIN_QTY
+
+
+def observe(policy, days):
+    for consumed in days:
+        policy.record_consumption(consumed)
+        policy.close_day()
+
+
+def test_steady_consumption_covers_protection_days():
+    policy = AdaptiveReorder(2, lead_time=1, cover_days=3)
+    observe(policy, [[10, 0]] * REORDER_MIN_DAYS)
+    # Reposição de 1 dia arredondada para uma revisão de 2 dias, mais a revisão atual.
+    assert policy.protection_days() == 4
+    assert policy.reorder_points().tolist() == [40, 0]
+
+
+def test_deviation_adds_safety_stock():
+    policy = AdaptiveReorder(1, lead_time=1, cover_days=3)
+    observe(policy, [[10], [20]])
+    # velocidade 10 -> 13 e desvio 0 -> 3 com suavização 0,3
+    expected = 13 * 4 + REORDER_SAFETY_FACTOR * MAD_TO_STD * 3 * 2
+    assert policy.reorder_points()[0] == pytest.approx(expected)
+
+
+def test_floor_applies_to_parts_without_consumption():
+    policy = AdaptiveReorder(2, lead_time=1, cover_days=3, floor=25)
+    observe(policy, [[10, 0]] * REORDER_MIN_DAYS)
+    assert policy.reorder_points().tolist() == [40, 25]
+
+
+def test_static_level_until_ready():
+    policy = AdaptiveReorder(2, lead_time=1, cover_days=3)
+    observe(policy, [[10, 0]] * (REORDER_MIN_DAYS - 1))
+    assert policy.levels(7).tolist() == [7, 7]
+    observe(policy, [[10, 0]])
+    assert policy.levels(7).tolist() == [40, 0]
+
+
+def test_order_quantities_only_below_reorder_point():
+    policy = AdaptiveReorder(3, lead_time=1, cover_days=3)
+    observe(policy, [[10, 10, 1]] * REORDER_MIN_DAYS)
+    # Ponto de pedido 40 e 4; alvo = ponto + 3 dias de consumo.
+    quantities = policy.order_quantities(np.array([10, 40, 0]))
+    assert quantities == [60, 0, REORDER_MIN_QTY]
@@ -0,0 +1,75 @@
+# test_restock_requests.py
+
+import pytest
+import restock_requests
+from restock_requests import RequestTracker
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(restock_requests, 'RESTOCK_RETRY_BASE', 1.0)
+    monkeypatch.setattr(restock_requests, 'RESTOCK_RETRY_MAX', 6.0)
+    return RequestTracker(timeout=10)
+
+
+def test_open_sets_deadline_and_fresh_ids(tracker):
+    first = tracker.open(now=100)
+    assert (first.sent_at, first.deadline) == (100, 110)
+    second = tracker.open(now=105)
+    assert second.request_id == first.request_id + 1
+    assert tracker.current == second
+
+
+def test_backoff_doubles_until_max(tracker):
+    waits = []
+    for _ in range(5):
+        request = tracker.open(now=0)
+        tracker.close(request.request_id, False)
+        waits.append(tracker.backoff())
+    assert waits == [1.0, 2.0, 4.0, 6.0, 6.0]
+
+
+def test_success_resets_failures(tracker):
+    for ok in (False, False, True):
+        request = tracker.open(now=0)
+        closed = tracker.close(request.request_id, ok)
+    assert closed.ok
+    assert tracker.failures == 0
+    assert tracker.backoff() == 1.0
+
+
+def test_timeout_closes_whole_request_and_counts_failure(tracker):
+    # O prazo vencido encerra o pedido sem atendente, mesmo faltando respostas.
+    request = tracker.open(now=0, responders=(0, 1, 2))
+    tracker.close(request.request_id, True, responder=0)
+    closed = tracker.close(request.request_id, False)
+    assert closed.request_id == request.request_id
+    assert not closed.ok
+    assert not tracker.outstanding
+    assert tracker.failures == 1
+
+
+def test_stale_replies_are_ignored(tracker):
+    old = tracker.open(now=0)
+    new = tracker.open(now=1)
+    assert tracker.close(old.request_id, False) is None
+    assert tracker.failures == 0
+    assert tracker.current == new
+    tracker.close(new.request_id, True)
+    # Resposta repetida de um pedido já encerrado.
+    assert tracker.close(new.request_id, True) is None
+
+
+def test_id_zero_matches_current_request(tracker):
+    request = tracker.open(now=0)
+    assert tracker.close(0, True).request_id == request.request_id
+
+
+def test_split_request_waits_for_every_responder(tracker):
+    request = tracker.open(now=0, responders=(0, 1))
+    assert tracker.close(request.request_id, False, responder=1) is None
+    assert tracker.outstanding
+    closed = tracker.close(request.request_id, True, responder=0)
+    # Uma resposta parcial basta para o pedido inteiro contar como falha.
+    assert not closed.ok
+    assert tracker.failures == 1
@@ -0,0 +1,84 @@
+# test_supplier_model.py
+
+import random
+import pytest
+from supplier_model import DeliveryScheduler, SupplierSpec, totals_by_shard
+from utils import NUM_PARTS, TIME_SLEEP
+
+
+def spec(capacity=0, lead_time=(1, 1, 1)):
+    return SupplierSpec(0, range(NUM_PARTS), lead_time, capacity)
+
+
+def vector(**amounts):
+    result = [0] * NUM_PARTS
+    for name, quantity in amounts.items():
+        result[int(name[1:])] = quantity
+    return result
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    random.seed(1)
+
+
+def test_repeated_order_is_consolidated():
+    scheduler = DeliveryScheduler(spec())
+    first = scheduler.order(vector(p3=50), shard=0, now=0)
+    assert len(first.deliveries) == 1
+    # Repetição pelo prazo vencido: nada novo a caminho.
+    again = scheduler.order(vector(p3=50), shard=0, now=1)
+    assert again.deliveries == []
+    assert scheduler.consolidated == 1
+    # Só a diferença sobre o que está a caminho é agendada.
+    more = scheduler.order(vector(p3=80), shard=0, now=2)
+    assert more.deliveries[0].amounts[3] == 30
+    assert scheduler.in_flight[3] == 80
+
+
+def test_capacity_spills_into_later_days():
+    scheduler = DeliveryScheduler(spec(capacity=100))
+    scheduled = scheduler.order(vector(p0=150, p1=120), shard=0, now=0)
+    assert scheduled.booked == {0: 100, 1: 100, 2: 70}
+    shipped = sorted(sum(delivery.amounts) for delivery in scheduled.deliveries)
+    assert shipped == [70, 100, 100]
+    # O dia de expedição atrasa a chegada: um dia de entrega depois da expedição.
+    dues = sorted(delivery.due for delivery in scheduled.deliveries)
+    assert dues == [TIME_SLEEP, 2 * TIME_SLEEP, 3 * TIME_SLEEP]
+    # Pedidos seguintes começam no primeiro dia com capacidade livre.
+    later = scheduler.order(vector(p2=40), shard=0, now=1)
+    assert later.booked == {2: 30, 3: 10}
+
+
+def test_past_days_expire_from_capacity():
+    scheduler = DeliveryScheduler(spec(capacity=100))
+    scheduler.order(vector(p0=60), shard=0, now=0)
+    scheduled = scheduler.order(vector(p1=10), shard=0, now=2 * TIME_SLEEP)
+    assert scheduled.expired_days == [0]
+    assert scheduled.booked == {2: 10}
+
+
+def test_pop_due_releases_in_flight_in_arrival_order():
+    scheduler = DeliveryScheduler(spec(lead_time=(1, 2, 3)))
+    scheduler.order(vector(p0=10), shard=0, now=0)
+    scheduler.order(vector(p1=20), shard=1, now=TIME_SLEEP)
+    assert scheduler.pop_due(0) == []
+    arrived = scheduler.pop_due(10 * TIME_SLEEP)
+    assert [delivery.due for delivery in arrived] == sorted(delivery.due for delivery in arrived)
+    assert scheduler.in_flight == [0] * NUM_PARTS
+    assert scheduler.next_due() is None
+    assert dict(totals_by_shard(arrived)) == {0: vector(p0=10), 1: vector(p1=20)}
+
+
+def test_restore_rebuilds_schedule():
+    original = DeliveryScheduler(spec(capacity=100))
+    scheduled = original.order(vector(p0=150), shard=0, now=0)
+    restored = DeliveryScheduler(spec(capacity=100))
+    restored.restore(scheduled.deliveries, scheduled.booked)
+    assert restored.in_flight == original.in_flight
+    assert restored.next_due() == original.next_due()
+    # A capacidade ocupada e a consolidação continuam valendo depois do reinício.
+    more = restored.order(vector(p0=150, p1=60), shard=0, now=1)
+    assert more.booked == {1: 50, 2: 10}
+    assert {delivery.seq for delivery in more.deliveries}.isdisjoint(
+        delivery.seq for delivery in scheduled.deliveries)
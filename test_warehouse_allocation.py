@@ -0,0 +1,82 @@
+# test_warehouse_allocation.py
+
+import pytest
+import warehouse_redis
+from restock_requests import REPLY_COMPLETE, REPLY_PARTIAL
+from simulation_engine import MemoryRedis
+from utils import decode_message, line_channel, NUM_PARTS
+from warehouse_redis import RestockRequest, WarehouseRedis
+
+
+def request(factory_id, line_id, starvation=0, **amounts):
+    vector = [0] * NUM_PARTS
+    for name, quantity in amounts.items():
+        vector[int(name[1:])] = quantity
+    return RestockRequest(line_id, factory_id, vector, starvation, 0, 0)
+
+
+def stocks(**amounts):
+    return request(0, 0, **amounts).amounts
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []
+
+    def queue_publish(self, pipe, channel, data):
+        self.sent.append((channel, decode_message(data)))
+
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    monkeypatch.setattr(warehouse_redis, 'FACTORY_PRIORITY', {'2': 1})
+    return WarehouseRedis(MemoryRedis())
+
+
+def test_priority_factory_is_served_first(warehouse):
+    regular = request(1, 0, p0=30)
+    priority = request(2, 0, p0=30)
+    shipments = warehouse._allocate([regular, priority], stocks(p0=40))
+    assert [(r.factory_id, sent[0], status) for r, sent, status in shipments] == [
+        (2, 30, REPLY_COMPLETE),
+        (1, 10, REPLY_PARTIAL),
+    ]
+
+
+def test_starving_line_goes_first_within_factory(warehouse):
+    calm = request(1, 0, starvation=0, p0=30)
+    starving = request(1, 1, starvation=5, p0=30)
+    shipments = warehouse._allocate([calm, starving], stocks(p0=30))
+    assert [(r.line_id, status) for r, _, status in shipments] == [(1, REPLY_COMPLETE), (0, None)]
+
+
+def test_unfilled_rounds_raise_priority(warehouse):
+    first = request(1, 0, p0=30)
+    second = request(1, 1, p0=30)
+    # A linha 1 fica sem nada e sobe na fila da rodada seguinte.
+    shipments = warehouse._allocate([first, second], stocks(p0=30))
+    assert [r.line_id for r, sent, _ in shipments if sent is None] == [1]
+    assert warehouse.unfilled_rounds == {('1', '1'): 1}
+    shipments = warehouse._allocate([first, second], stocks(p0=30))
+    assert [(r.line_id, status) for r, _, status in shipments] == [(1, REPLY_COMPLETE), (0, None)]
+    assert warehouse.unfilled_rounds == {('1', '0'): 1}
+
+
+def test_partial_fill_sends_what_is_left_per_part(warehouse):
+    shipments = warehouse._allocate([request(1, 0, p0=30, p1=20, p2=5)], stocks(p0=50, p1=8, p2=-3))
+    (_, sent, status), = shipments
+    assert sent[:3] == [30, 8, 0]
+    assert status == REPLY_PARTIAL
+
+
+def test_allocation_round_ships_and_replies(warehouse):
+    warehouse.transport = RecordingTransport()
+    warehouse.call_later = lambda delay, callback, *args: None
+    warehouse.inventory.add(stocks(p0=40))
+    warehouse.send_parts(0, 1, stocks(p0=30))
+    warehouse.send_parts(1, 1, stocks(p1=30))
+    warehouse.allocate_pending_requests()
+    assert warehouse.inventory.get_all()[:2] == [10, 0]
+    commands = [(channel, msg.command) for channel, msg in warehouse.transport.sent]
+    assert commands == [(line_channel(1, 0), 'receive_parts'), (line_channel(1, 1), 'reject_parts')]
+    assert warehouse.pending_requests == []
@@ -0,0 +1,67 @@
+# test_wire_format.py
+
+import pytest
+import utils
+from utils import decode_message, encode_message, peek_header, UNKNOWN_COMMAND, NUM_PARTS
+
+VECTORS = {
+    'none': None,
+    'dense': [i * 7 - 300 for i in range(NUM_PARTS)],
+    'sparse': [0] * 40 + [12, 0, 99999] + [0] * (NUM_PARTS - 43),
+    'uniform': [0, 1440] * (NUM_PARTS // 2),
+    'zeros': [0] * NUM_PARTS,
+}
+
+
+@pytest.fixture
+def wire_version(monkeypatch):
+    def use(version):
+        monkeypatch.setattr(utils, 'WIRE_VERSION', version)
+    return use
+
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+@pytest.mark.parametrize('kind', sorted(VECTORS))
+def test_round_trip(wire_version, version, kind):
+    wire_version(version)
+    vector = VECTORS[kind]
+    # Na versão 1 os comandos com vetor sempre o levam (é o último campo).
+    command = 'receive_order' if vector is None else 'receive_parts'
+    fields = [3, 2, 17, -1]
+    msg = decode_message(encode_message(command, fields, vector, trace_id=0xABCDEF))
+    assert msg.command == command
+    assert msg.fields == fields
+    assert msg.vector == vector
+    assert msg.trace_id == (0xABCDEF if version == 3 else 0)
+
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_every_command_round_trips(wire_version, version):
+    wire_version(version)
+    for command in utils.COMMANDS:
+        vector = VECTORS['sparse'] if command in ('send_parts', 'receive_parts', 'update_factory') else None
+        data = encode_message(command, [1, 2, 3], vector)
+        assert decode_message(data).command == command
+        assert peek_header(data)[0] == command
+
+
+def test_legacy_line_request_layout(wire_version):
+    # Pedido de peças da linha no formato original: "id_linha/id_fabrica/send_parts/payload".
+    wire_version(1)
+    data = encode_message('send_parts', [4, 1], VECTORS['uniform'])
+    assert data.split('/')[:3] == ['4', '1', 'send_parts']
+    assert decode_message(data).fields == [4, 1]
+
+
+def test_header_carries_trace_and_send_time(wire_version):
+    wire_version(3)
+    data = encode_message('receive_order', [1, 2, 3, 4], trace_id=42)
+    command, trace_id, sent_at = peek_header(data.encode('ascii'))
+    assert (command, trace_id) == ('receive_order', 42)
+    assert sent_at == decode_message(data).sent_at
+
+
+@pytest.mark.parametrize('data', ['foo/bar', 'send_parts/1/x', '#!!!!', '#AAAA', '#' + 'A' * 40, b'\xff\xfe'])
+def test_malformed_messages_decode_as_unknown(data):
+    assert decode_message(data).command == UNKNOWN_COMMAND
+    assert peek_header(data) == (UNKNOWN_COMMAND, 0, None)
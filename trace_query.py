@@ -0,0 +1,207 @@
+# trace_query.py
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+import redis
+from utils import make_redis_client, TRACE_STREAM_KEY
+
+# Comandos que abrem cada tipo de trace e os que o encerram.
+PRODUCTION_START = "receive_order"
+PRODUCTION_END = "receive_products"
+RESTOCK_START = "send_parts"
+RESTOCK_REPLIES = ("receive_parts", "reject_parts")
+
+
+def load_spans(r, since=None, count=None):
+    """Lê os spans do stream (todos ou os dos últimos 'since' segundos), agrupados por trace."""
+    start = "-" if since is None else str(int((time.time() - since) * 1000))
+    entries = r.xrange(TRACE_STREAM_KEY, min=start, max="+", count=count)
+    traces = defaultdict(list)
+    for _, span in entries:
+        span = {_text(key): _text(value) for key, value in span.items()}
+        for key in ("sent_at", "received_at", "finished_at"):
+            span[key] = float(span[key])
+        traces[span['trace']].append(span)
+    for spans in traces.values():
+        spans.sort(key=lambda span: span['sent_at'])
+    return traces
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _first(spans, commands):
+    for span in spans:
+        if span['command'] in commands:
+            return span
+    return None
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def _stats(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': _percentile(values, 0.50),
+        'p90': _percentile(values, 0.90),
+        'p99': _percentile(values, 0.99),
+    }
+
+
+def _production(spans):
+    """Lead time da ordem: da emissão pela fábrica à entrada dos produtos no estoque."""
+    order = _first(spans, (PRODUCTION_START,))
+    done = _first(spans, (PRODUCTION_END,))
+    if done is None:
+        return {'line': order['entity'], 'complete': False}
+    return {'line': order['entity'], 'complete': True,
+            'lead_time': done['finished_at'] - order['sent_at'],
+            'queue': order['received_at'] - order['sent_at']}
+
+
+def _restock(spans):
+    """
+    Ciclo de reposição: do pedido à última resposta tratada por quem pediu (com o
+    almoxarifado particionado, o pedido vai em partes, uma por shard), dividido em
+    fila (até o atendente mais lento começar a tratar a sua parte), atendimento
+    (até a última resposta sair) e retorno (entrega e tratamento dela).
+    """
+    requests = [span for span in spans if span['command'] == RESTOCK_START]
+    served_by = {span['entity'] for span in requests}
+    replies = [span for span in spans if span['command'] in RESTOCK_REPLIES and span['entity'] not in served_by]
+    if len(replies) < len(requests):
+        return {'requester': None, 'complete': False}
+    sent_at = min(span['sent_at'] for span in requests)
+    queue = max(span['received_at'] - span['sent_at'] for span in requests)
+    last = max(replies, key=lambda span: span['finished_at'])
+    cycle_time = last['finished_at'] - sent_at
+    return {'requester': last['entity'], 'complete': True,
+            'rejected': any(span['command'] == "reject_parts" for span in replies),
+            'cycle_time': cycle_time,
+            'queue': queue,
+            'service': cycle_time - queue - (last['finished_at'] - last['sent_at']),
+            'return': last['finished_at'] - last['sent_at']}
+
+
+def analyze(traces):
+    """
+    Classifica os traces (ordens de produção, pedidos das linhas ao almoxarifado e
+    do almoxarifado ao fornecedor) e calcula lead time e ciclos de reposição.
+    Traces sem o fim (linha quebrada, pedido substituído ou perdido) são só contados.
+    """
+    samples = {
+        'production': defaultdict(list),
+        'line_restock': defaultdict(list),
+        'supplier_restock': defaultdict(list),
+    }
+    incomplete = defaultdict(int)
+    rejected = 0
+    for spans in traces.values():
+        if _first(spans, (PRODUCTION_START,)) is not None:
+            kind, result = 'production', _production(spans)
+            key = result['line']
+        else:
+            request = _first(spans, (RESTOCK_START,))
+            if request is None:
+                continue
+            kind = 'supplier_restock' if request['entity'].startswith('supplier') else 'line_restock'
+            result = _restock(spans)
+            key = result['requester']
+            rejected += result.get('rejected', False)
+        if not result['complete']:
+            incomplete[kind] += 1
+            continue
+        samples[kind][key].append(result)
+
+    report = {'traces': len(traces), 'rejected_restocks': rejected, 'kinds': {}}
+    for kind, by_key in samples.items():
+        metric = 'lead_time' if kind == 'production' else 'cycle_time'
+        results = [result for values in by_key.values() for result in values]
+        components = ('queue',) if kind == 'production' else ('queue', 'service', 'return')
+        report['kinds'][kind] = {
+            'incomplete': incomplete[kind],
+            metric: _stats(result[metric] for result in results),
+            'breakdown': {name: _stats(result[name] for result in results)['mean'] for name in components},
+            'by_entity': {key: _stats(result[metric] for result in values)
+                          for key, values in sorted(by_key.items())},
+        }
+    return report
+
+
+STEP_NAMES = {'queue': "fila", 'service': "atendimento", 'return': "retorno"}
+
+KIND_TITLES = {
+    'production': "Lead time das ordens de produção (fábrica -> estoque de produtos)",
+    'line_restock': "Ciclo de reposição das linhas (pedido -> resposta do almoxarifado)",
+    'supplier_restock': "Ciclo de reposição do almoxarifado (pedido -> entrega do fornecedor)",
+}
+
+
+def format_report(report):
+    lines = [f"Traces analisados: {report['traces']}  (pedidos recusados: {report['rejected_restocks']})"]
+    for kind, data in report['kinds'].items():
+        stats = data.get('lead_time') or data.get('cycle_time')
+        lines.append("")
+        lines.append(KIND_TITLES[kind])
+        lines.append(f"  completos: {stats['count']}  incompletos: {data['incomplete']}")
+        if not stats['count']:
+            continue
+        lines.append(f"  p50 {stats['p50']:.3f}s  p90 {stats['p90']:.3f}s  p99 {stats['p99']:.3f}s  "
+                     f"média {stats['mean']:.3f}s")
+        lines.append("  média por etapa: " + ", ".join(
+            f"{STEP_NAMES[name]} {seconds:.3f}s" for name, seconds in data['breakdown'].items()))
+        for entity, entity_stats in data['by_entity'].items():
+            lines.append(f"    {entity:<14} n={entity_stats['count']:<6} p50 {entity_stats['p50']:.3f}s  "
+                         f"p90 {entity_stats['p90']:.3f}s")
+    return "\n".join(lines)
+
+
+def format_timeline(trace_id, spans):
+    """Linha do tempo de um trace, em ms a partir do primeiro envio."""
+    if not spans:
+        return f"Trace {trace_id} não encontrado."
+    origin = spans[0]['sent_at']
+    lines = [f"Trace {trace_id}", f"{'enviado':>10}{'recebido':>10}{'terminado':>11}  entidade / comando"]
+    for span in spans:
+        lines.append(f"{(span['sent_at'] - origin) * 1000:>10.1f}{(span['received_at'] - origin) * 1000:>10.1f}"
+                     f"{(span['finished_at'] - origin) * 1000:>11.1f}  {span['entity']} / {span['command']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead time e ciclos de reposição a partir dos spans de rastreamento.")
+    parser.add_argument("--since", type=float, help="só os spans dos últimos N segundos")
+    parser.add_argument("--count", type=int, help="no máximo N spans (os mais antigos primeiro)")
+    parser.add_argument("--trace", help="mostra a linha do tempo de um trace (id em hexadecimal)")
+    parser.add_argument("--json", help="salva o relatório neste arquivo")
+    args = parser.parse_args()
+
+    try:
+        r = make_redis_client()
+        traces = load_spans(r, args.since, args.count)
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        sys.exit(1)
+
+    if args.trace:
+        print(format_timeline(args.trace, traces.get(args.trace.lower().zfill(16), [])))
+        return
+    report = analyze(traces)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
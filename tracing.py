@@ -0,0 +1,81 @@
+# tracing.py
+
+import threading
+import time
+from contextlib import contextmanager
+from utils import (
+    CURRENT_TRACE,
+    TRACING_ENABLED,
+    TRACE_STREAM_KEY,
+    TRACE_STREAM_MAXLEN,
+    TRACE_FLUSH_INTERVAL
+)
+
+
+@contextmanager
+def continue_trace(trace_id):
+    """Faz as mensagens codificadas dentro do bloco herdarem 'trace_id'."""
+    token = CURRENT_TRACE.set(trace_id)
+    try:
+        yield
+    finally:
+        CURRENT_TRACE.reset(token)
+
+
+class SpanRecorder:
+    """
+    Spans de uma entidade: cada mensagem com trace tratada vira um span (trace,
+    entidade, comando, enviado em, recebido em, terminado em). Os spans ficam em
+    memória e vão em lote para o stream TRACE_STREAM_KEY (XADD com MAXLEN
+    aproximado, então o stream não cresce sem limite) no máximo a cada
+    TRACE_FLUSH_INTERVAL segundos, como o push das métricas.
+    """
+
+    def __init__(self, entity_name, redis_client):
+        self.entity_name = entity_name
+        self.r = redis_client
+        self._pending = []
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, trace_id, command, sent_at, received_at, finished_at):
+        if not TRACING_ENABLED or not trace_id:
+            return
+        span = {
+            'trace': f"{trace_id:016x}",
+            'entity': self.entity_name,
+            'command': command,
+            'sent_at': repr(sent_at),
+            'received_at': repr(received_at),
+            'finished_at': repr(finished_at),
+        }
+        with self._lock:
+            self._pending.append(span)
+
+    def _due_spans(self):
+        now = time.monotonic()
+        if not self._pending or now - self._last_flush < TRACE_FLUSH_INTERVAL:
+            return None
+        self._last_flush = now
+        with self._lock:
+            spans, self._pending = self._pending, []
+        return spans
+
+    @staticmethod
+    def _queue_spans(pipe, spans):
+        for span in spans:
+            pipe.xadd(TRACE_STREAM_KEY, span, maxlen=TRACE_STREAM_MAXLEN, approximate=True)
+
+    def flush_if_due(self):
+        spans = self._due_spans()
+        if spans:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_spans(pipe, spans)
+            pipe.execute()
+
+    async def flush_if_due_async(self):
+        spans = self._due_spans()
+        if spans:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_spans(pipe, spans)
+            await pipe.execute()
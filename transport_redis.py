@@ -0,0 +1,251 @@
+# transport_redis.py
+
+import time
+import redis
+import redis.asyncio
+from utils import (
+    TRANSPORT_BACKEND,
+    STREAM_BATCH_SIZE,
+    STREAM_BLOCK_MS,
+    STREAM_MAXLEN,
+    STREAM_CLAIM_IDLE_MS,
+    STREAM_MAX_DELIVERIES
+)
+
+
+class PubSubTransport:
+    """Transporte original: PUBLISH/SUBSCRIBE, sem persistência (fire-and-forget)."""
+
+    def __init__(self, redis_client, group, consumer=None):
+        self.r = redis_client
+        self.group = group
+        # O Pub/Sub não informa quando a mensagem foi publicada.
+        self.last_lag = None
+
+    def publish(self, channel, data):
+        self.r.publish(channel, data)
+
+    def queue_publish(self, pipe, channel, data):
+        """Enfileira a publicação em um pipeline do chamador (enviada no execute())."""
+        pipe.publish(channel, data)
+
+    def listen(self, channel):
+        """Gera o conteúdo de cada mensagem recebida no canal."""
+        pubsub = self.r.pubsub()
+        pubsub.subscribe(channel)
+        for message in pubsub.listen():
+            if message['type'] == 'message':
+                yield message['data']
+
+
+class StreamTransport:
+    """
+    Transporte durável sobre Redis Streams.
+
+    Cada canal vira um stream (XADD com MAXLEN aproximado, o que também limita a
+    memória se um consumidor ficar para trás). Cada entidade lê com seu próprio
+    consumer group, então canais compartilhados continuam funcionando como
+    broadcast entre entidades, e vários processos da mesma entidade dividem as
+    mensagens entre si. Cada mensagem recebe XACK assim que o seu tratamento
+    termina (erros do handler são registrados e descartados pelo dispatch de
+    metrics.py): o que estava pendente quando o processo caiu é relido ao
+    reiniciar (mesmo consumidor) ou reivindicado com XAUTOCLAIM por outro
+    consumidor após STREAM_CLAIM_IDLE_MS. Uma entrada relida mais de
+    STREAM_MAX_DELIVERIES vezes (derruba o processo a cada tentativa) vai para o
+    stream '{canal}:dead' em vez de ser tratada de novo.
+    """
+
+    def __init__(self, redis_client, group, consumer=None):
+        self.r = redis_client
+        self.group = group
+        self.consumer = consumer or group
+        # Atraso (segundos) da última mensagem entregue pelo listen(), pelo id da entrada.
+        self.last_lag = None
+
+    @staticmethod
+    def _entry_lag(entry_id):
+        """O id de uma entrada de stream começa com o instante do XADD em ms ('1700000000000-0')."""
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode('ascii')
+        return time.time() - int(entry_id.split('-')[0]) / 1000
+
+    def publish(self, channel, data):
+        self.r.xadd(channel, {'data': data}, maxlen=STREAM_MAXLEN, approximate=True)
+
+    def queue_publish(self, pipe, channel, data):
+        """Enfileira a publicação em um pipeline do chamador (enviada no execute())."""
+        pipe.xadd(channel, {'data': data}, maxlen=STREAM_MAXLEN, approximate=True)
+
+    def _ensure_group(self, channel):
+        try:
+            # id='0': um grupo novo também lê o que foi publicado antes de ele existir.
+            self.r.xgroup_create(channel, self.group, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _read_own_pending(self, channel):
+        """Entradas entregues a este consumidor e ainda sem XACK (ex.: antes de um crash)."""
+        resp = self.r.xreadgroup(self.group, self.consumer, {channel: '0'}, count=STREAM_BATCH_SIZE)
+        return resp[0][1] if resp else []
+
+    def _claim_stale(self, channel):
+        """Reivindica entradas pendentes há muito tempo em consumidores que sumiram."""
+        resp = self.r.xautoclaim(
+            channel, self.group, self.consumer,
+            min_idle_time=STREAM_CLAIM_IDLE_MS, start_id='0-0', count=STREAM_BATCH_SIZE
+        )
+        return resp[1]
+
+    def _read_new(self, channel):
+        resp = self.r.xreadgroup(
+            self.group, self.consumer, {channel: '>'},
+            count=STREAM_BATCH_SIZE, block=STREAM_BLOCK_MS
+        )
+        return resp[0][1] if resp else []
+
+    def _pending_range(self, channel, entries):
+        return self.r.xpending_range(channel, self.group, min=entries[0][0], max=entries[-1][0], count=len(entries))
+
+    def _split_poisoned(self, entries, pending):
+        """Separa as entradas relidas em (a tratar, a descartar) pelo contador de entregas do XPENDING."""
+        poisoned = {info['message_id'] for info in pending if info['times_delivered'] > STREAM_MAX_DELIVERIES}
+        if not poisoned:
+            return entries, []
+        return ([entry for entry in entries if entry[0] not in poisoned],
+                [entry for entry in entries if entry[0] in poisoned])
+
+    def _queue_dead_letters(self, pipe, channel, poisoned):
+        for entry_id, fields in poisoned:
+            pipe.xadd(channel + ":dead", {**fields, 'group': self.group}, maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.xack(channel, self.group, entry_id)
+
+    def _recover(self, channel, entries):
+        """Manda para o stream de mensagens mortas as entradas relidas vezes demais; retorna as demais."""
+        if not entries:
+            return entries
+        entries, poisoned = self._split_poisoned(entries, self._pending_range(channel, entries))
+        if poisoned:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_dead_letters(pipe, channel, poisoned)
+            pipe.execute()
+        return entries
+
+    def listen(self, channel):
+        """Gera o conteúdo das mensagens (lidas em lotes de até STREAM_BATCH_SIZE), com XACK por mensagem."""
+        self._ensure_group(channel)
+
+        recovering = True
+        last_claim = 0.0
+        while True:
+            entries = []
+            if recovering:
+                entries = self._read_own_pending(channel)
+                recovering = bool(entries)
+                entries = self._recover(channel, entries)
+            if not entries and time.monotonic() - last_claim >= STREAM_CLAIM_IDLE_MS / 1000:
+                last_claim = time.monotonic()
+                entries = self._recover(channel, self._claim_stale(channel))
+            if not entries:
+                entries = self._read_new(channel)
+
+            for entry_id, fields in entries:
+                # Entradas já removidas pelo MAXLEN voltam sem campos; só confirmamos.
+                if fields:
+                    self.last_lag = self._entry_lag(entry_id)
+                    yield fields['data']
+                # O listen() retoma aqui depois do tratamento: confirma só esta
+                # entrada, para uma falha adiante não reprocessar as já tratadas.
+                self.r.xack(channel, self.group, entry_id)
+
+
+class AsyncPubSubTransport(PubSubTransport):
+    """PubSubTransport sobre redis.asyncio; listen() é um gerador assíncrono."""
+
+    async def publish(self, channel, data):
+        await self.r.publish(channel, data)
+
+    async def listen(self, channel):
+        pubsub = self.r.pubsub()
+        await pubsub.subscribe(channel)
+        async for message in pubsub.listen():
+            if message['type'] == 'message':
+                yield message['data']
+
+
+class AsyncStreamTransport(StreamTransport):
+    """StreamTransport sobre redis.asyncio; mesma semântica de grupos, lotes e XACK."""
+
+    async def publish(self, channel, data):
+        await self.r.xadd(channel, {'data': data}, maxlen=STREAM_MAXLEN, approximate=True)
+
+    async def _ensure_group(self, channel):
+        try:
+            await self.r.xgroup_create(channel, self.group, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _read_own_pending(self, channel):
+        resp = await self.r.xreadgroup(self.group, self.consumer, {channel: '0'}, count=STREAM_BATCH_SIZE)
+        return resp[0][1] if resp else []
+
+    async def _claim_stale(self, channel):
+        resp = await self.r.xautoclaim(
+            channel, self.group, self.consumer,
+            min_idle_time=STREAM_CLAIM_IDLE_MS, start_id='0-0', count=STREAM_BATCH_SIZE
+        )
+        return resp[1]
+
+    async def _read_new(self, channel):
+        resp = await self.r.xreadgroup(
+            self.group, self.consumer, {channel: '>'},
+            count=STREAM_BATCH_SIZE, block=STREAM_BLOCK_MS
+        )
+        return resp[0][1] if resp else []
+
+    async def _recover(self, channel, entries):
+        if not entries:
+            return entries
+        entries, poisoned = self._split_poisoned(entries, await self._pending_range(channel, entries))
+        if poisoned:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_dead_letters(pipe, channel, poisoned)
+            await pipe.execute()
+        return entries
+
+    async def listen(self, channel):
+        await self._ensure_group(channel)
+
+        recovering = True
+        last_claim = 0.0
+        while True:
+            entries = []
+            if recovering:
+                entries = await self._read_own_pending(channel)
+                recovering = bool(entries)
+                entries = await self._recover(channel, entries)
+            if not entries and time.monotonic() - last_claim >= STREAM_CLAIM_IDLE_MS / 1000:
+                last_claim = time.monotonic()
+                entries = await self._recover(channel, await self._claim_stale(channel))
+            if not entries:
+                entries = await self._read_new(channel)
+
+            for entry_id, fields in entries:
+                if fields:
+                    self.last_lag = self._entry_lag(entry_id)
+                    yield fields['data']
+                await self.r.xack(channel, self.group, entry_id)
+
+
+def make_transport(redis_client, group, consumer=None):
+    """
+    Cria o transporte configurado em utils.TRANSPORT_BACKEND ('streams' ou 'pubsub').
+    Com um cliente redis.asyncio, retorna a variante assíncrona do mesmo transporte.
+    """
+    is_async = isinstance(redis_client, redis.asyncio.Redis)
+    if TRANSPORT_BACKEND == 'pubsub':
+        cls = AsyncPubSubTransport if is_async else PubSubTransport
+    else:
+        cls = AsyncStreamTransport if is_async else StreamTransport
+    return cls(redis_client, group, consumer)
@@ -1,11 +1,67 @@
 # utils.py
 
+import asyncio
+import atexit
+import base64
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
 import os
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+import redis
+import redis.asyncio
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from redis.asyncio.retry import Retry as AsyncRetry
 
 # Configurações de conexão Redis
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 
+# Pool de conexões compartilhado por todas as threads/tarefas de um processo
+REDIS_POOL_SIZE = 32               # Máximo de conexões abertas por processo
+# No async_runtime cada listener segura uma conexão enquanto vive (SUBSCRIBE ou
+# XREADGROUP bloqueante): o pool tem uma por entidade mais esta folga para os
+# comandos das rotinas, temporizadores e métricas, e nunca menos que REDIS_POOL_SIZE.
+REDIS_POOL_HEADROOM = 16
+REDIS_POOL_TIMEOUT = 5             # Segundos esperando uma conexão livre antes de falhar
+REDIS_SOCKET_KEEPALIVE = True
+REDIS_HEALTH_CHECK_INTERVAL = 30   # Conexões ociosas por mais tempo levam um PING antes do uso
+REDIS_RETRIES = 3                  # Tentativas extras em erros de conexão/timeout
+REDIS_BACKOFF_BASE = 0.05          # Backoff exponencial entre tentativas (segundos)
+REDIS_BACKOFF_CAP = 2
+
+# --- Log ---
+LOG_DIR = 'output'
+LOG_LEVEL = 'INFO'             # 'DEBUG' mostra também os traces de mensagens brutas
+LOG_JSON = False               # True: uma linha JSON por registro em vez do banner
+LOG_CONSOLE = True             # Também escreve no stdout (capturado em debug_logs/)
+LOG_BATCH_SIZE = 256           # Máximo de registros escritos por flush
+LOG_MAX_BYTES = 5 * 1024 * 1024  # Tamanho para rotacionar output/{entidade}.txt (0 desliga)
+LOG_BACKUP_COUNT = 3
+
+# Layout do estoque no Redis: 'hash' (um hash por entidade) ou 'keys' (legado,
+# uma chave string por item). Bases antigas são convertidas com migrate_inventory.py.
+INVENTORY_BACKEND = 'hash'
+
+# Transporte das mensagens entre entidades: 'streams' (Redis Streams com consumer
+# groups, durável) ou 'pubsub' (PUBLISH/SUBSCRIBE, mensagens perdidas se o
+# processo destino estiver fora do ar).
+TRANSPORT_BACKEND = 'streams'
+STREAM_BATCH_SIZE = 50          # Entradas lidas por XREADGROUP (COUNT)
+STREAM_BLOCK_MS = 1000          # Tempo máximo bloqueado esperando mensagens novas
+STREAM_MAXLEN = 10000           # Tamanho aproximado máximo de cada stream
+STREAM_CLAIM_IDLE_MS = 30000    # Pendências mais antigas que isso são reivindicadas
+STREAM_MAX_DELIVERIES = 5       # Entregas de uma mesma entrada antes de ir para o stream '{canal}:dead'
+
 # Intervalo de tempo entre "dias" na simulação (em segundos)
 TIME_SLEEP = 5
 
@@ -31,23 +87,251 @@ RED_ALERT_WAREHOUSE = BATCH_SIZE * 390
 # Alerta para o estoque de PRODUTOS ACABADOS
 RED_ALERT_PRODUCT_STOCK = 500
 
+# Modo de produção das linhas: 'all_or_nothing' (a ordem inteira falha se faltar
+# qualquer peça) ou 'partial' (produz o máximo possível e pede só as peças que
+# limitaram a produção).
+PRODUCTION_MODE = 'all_or_nothing'
+
 # --- Parâmetros de Reabastecimento e Pedidos ---
 
+# Janela (segundos) em que o almoxarifado junta pedidos de várias linhas antes de
+# ler o estoque uma vez e alocar tudo em um único pipeline.
+WAREHOUSE_BATCH_WINDOW = 0.5
+
+# Prioridade de cada fábrica na alocação do almoxarifado (maior primeiro; fábricas
+# ausentes valem 0). A Fábrica 2 (puxada) produz contra a demanda, então vem antes.
+FACTORY_PRIORITY = {'2': 1}
+
 # Quantidade de peças que o Fornecedor envia em um lote
 PARTS_TO_SEND_AMOUNT_SUPPLIER = BATCH_SIZE * 1950
 
+# --- Fornecedores (supplier_model.py) ---
+
+# Número de fornecedores; cada um fornece uma faixa contígua de peças e ouve o
+# seu próprio canal (supplier_channel).
+SUPPLIERS = 1
+# Tempo de entrega (dias) de cada remessa: distribuição triangular mín/moda/máx
+SUPPLIER_LEAD_TIME_MIN = 1
+SUPPLIER_LEAD_TIME_MODE = 2
+SUPPLIER_LEAD_TIME_MAX = 4
+# Unidades que cada fornecedor expede por dia (0 = ilimitado); o que passar
+# disso sai nos dias seguintes.
+SUPPLIER_DAILY_CAPACITY = BATCH_SIZE * 4000
+
 # Quantidade de peças que o Almoxarifado envia para uma linha em um lote
 PARTS_TO_SEND_AMOUNT_WAREHOUSE = BATCH_SIZE * 30
 
+# --- Pontos de pedido adaptativos (linhas e almoxarifado) ---
+
+# Razão entre o desvio padrão e o desvio médio absoluto de uma distribuição normal
+# (~1,25); converte o erro suavizado em desvio padrão no estoque de segurança.
+MAD_TO_STD = 1.25
+
+# 'adaptive' calcula ponto de pedido e quantidade por peça a partir da velocidade
+# de consumo (reorder_policy.py); 'static' usa só os alertas fixos acima.
+REORDER_POLICY = 'adaptive'
+# Suavização da velocidade, do desvio e do tempo de reposição medidos
+REORDER_SMOOTHING = 0.3
+# Dias observados antes de a política adaptativa substituir os alertas fixos
+REORDER_MIN_DAYS = 3
+# Período de revisão do estoque (dias) usado no ponto de pedido e fator de segurança (z).
+# A verificação é diária, mas 2 dias cobrem as linhas excedentes que trocam de produto.
+REORDER_REVIEW_DAYS = 2
+REORDER_SAFETY_FACTOR = 1.65
+# Dias de consumo que cada pedido cobre além do ponto de pedido
+REORDER_COVER_DAYS_LINE = 3
+REORDER_COVER_DAYS_WAREHOUSE = 10
+# Estimativa inicial do tempo de reposição (dias), refinada a cada entrega
+REORDER_LEAD_TIME_LINE = 0.1
+REORDER_LEAD_TIME_WAREHOUSE = SUPPLIER_LEAD_TIME_MODE
+# Menor quantidade pedida por peça. Nos vetores de pedido o valor 1 continua
+# significando "lote padrão", então este mínimo precisa ser maior que 1.
+REORDER_MIN_QTY = BATCH_SIZE
+# Revisão do estoque disparada na própria baixa (produção da linha, envios do
+# almoxarifado) quando alguma peça cruza o ponto de pedido, além da revisão diária.
+RESTOCK_TRIGGERS = True
+# Espera (segundos) entre a primeira baixa que cruzou o limite e a revisão: as
+# baixas seguintes dentro da janela entram na mesma revisão.
+RESTOCK_TRIGGER_DEBOUNCE = 0.2
+
+# --- Pedidos de reabastecimento em andamento (restock_requests.py) ---
+
+# Prazo (segundos) para a resposta de um pedido; vencido, o pedido é dado como perdido
+RESTOCK_REQUEST_TIMEOUT = TIME_SLEEP
+# O do fornecedor cobre o maior tempo de entrega (mais um dia de expedição).
+SUPPLIER_REQUEST_TIMEOUT = TIME_SLEEP * (SUPPLIER_LEAD_TIME_MAX + 1)
+# Espera antes de pedir de novo após recusa, envio parcial ou prazo vencido:
+# começa em RESTOCK_RETRY_BASE segundos e dobra a cada falha seguida, até o máximo.
+RESTOCK_RETRY_BASE = 1.0
+RESTOCK_RETRY_MAX = TIME_SLEEP * 2
+
+# --- Previsão de demanda (fábrica puxada) ---
+
+# 'forecast' dimensiona os lotes pela previsão de demanda (demand_forecast.py);
+# 'status' usa o lote fixo pela cor do estoque (BATCH_SIZE/2, BATCH_SIZE ou 2x).
+PULL_LOT_POLICY = 'forecast'
+# Suavização do nível e da tendência (Holt)
+FORECAST_ALPHA = 0.3
+FORECAST_BETA = 0.1
+# Dias observados antes de a previsão substituir a política por cor
+FORECAST_MIN_OBSERVATIONS = 3
+# Dias de demanda que o estoque deve cobrir e fator de segurança (z) sobre o erro.
+# Com 2 dias a fábrica puxada perdia de 3 a 6 vendas por ano (sementes 1-5, 365
+# dias) contra nenhuma da política 'status'; com 3 não perde nenhuma.
+FORECAST_COVER_DAYS = 3
+FORECAST_SAFETY_FACTOR = 1.65
+# Maior lote que uma linha recebe em um dia
+FORECAST_MAX_LOT = BATCH_SIZE * 4
+
 # Limites para os pedidos aleatórios de clientes
 MIN_ORDERED_AMOUNT = 50
 MAX_ORDERED_AMOUNT = 250
 
+# Cada linha tem seu próprio canal: uma mensagem só chega à linha a que se destina.
+def line_channel(factory_id, line_id):
+    """Canal endereçado a uma única linha de produção."""
+    return f"channel:line:{factory_id}:{line_id}"
+
+# Almoxarifado particionado (warehouse_shards.py): cada um dos WAREHOUSE_SHARDS
+# processos é dono de uma faixa contígua de peças e tem o seu próprio canal. Todos
+# gravam no mesmo hash de estoque, cada um só nos campos das suas peças.
+WAREHOUSE_SHARDS = 1
+
+def warehouse_channel(shard=0):
+    """Canal de um shard do almoxarifado (o canal original quando não há partição)."""
+    return "channel:warehouse" if WAREHOUSE_SHARDS == 1 else f"channel:warehouse:{shard}"
+
+def supplier_channel(supplier_id=0):
+    """Canal de um fornecedor (o canal original quando há um só)."""
+    return "channel:supplier" if SUPPLIERS == 1 else f"channel:supplier:{supplier_id}"
+
+# --- Métricas (metrics.py, servidas em /metrics pelo kanban_web.py) ---
+
+METRICS_ENABLED = True
+# Cada entidade grava o seu snapshot em METRICS_KEY_PREFIX + entidade no máximo a
+# cada METRICS_PUSH_INTERVAL segundos; o snapshot expira se a entidade parar.
+METRICS_PUSH_INTERVAL = 2
+METRICS_TTL = 60
+METRICS_KEY_PREFIX = "metrics:"
+METRICS_ENTITIES_KEY = "metrics:entities"
+# Limites (segundos) dos buckets dos histogramas de latência e de atraso na fila
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# --- Rastreamento (tracing.py, consultado pelo trace_query.py) ---
+
+TRACING_ENABLED = True
+# Spans (uma mensagem tratada por uma entidade) vão para um stream limitado a
+# ~TRACE_STREAM_MAXLEN entradas, gravados em lote a cada TRACE_FLUSH_INTERVAL s.
+TRACE_STREAM_KEY = "trace:spans"
+TRACE_STREAM_MAXLEN = 100000
+TRACE_FLUSH_INTERVAL = 1
+
 LOG_RESTOCK_KEY = "log:restock_requests"
 LOG_CONSUMPTION_KEY = "log:consumer_consumption"
 MAX_LOG = 20  # quantos eventos exibir
 
 
+# Idas ao Redis do handler em andamento na thread (ou tarefa asyncio) atual: as
+# métricas colocam aqui um contador ([0]) e as conexões o incrementam a cada
+# envio ao servidor (um comando, um script ou um pipeline inteiro).
+REDIS_ROUND_TRIPS = contextvars.ContextVar('redis_round_trips', default=None)
+
+def _count_round_trip():
+    counter = REDIS_ROUND_TRIPS.get()
+    if counter is not None:
+        counter[0] += 1
+
+class RoundTripConnection(redis.Connection):
+    def send_packed_command(self, command, check_health=True):
+        _count_round_trip()
+        return super().send_packed_command(command, check_health)
+
+class AsyncRoundTripConnection(redis.asyncio.Connection):
+    async def send_packed_command(self, command, check_health=True):
+        _count_round_trip()
+        return await super().send_packed_command(command, check_health)
+
+def _pool_kwargs(pool_size, connection_class):
+    return dict(
+        connection_class=connection_class,
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=True,
+        max_connections=pool_size,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_error=[redis.exceptions.ConnectionError, redis.exceptions.TimeoutError],
+    )
+
+def make_redis_client(pool_size=REDIS_POOL_SIZE):
+    """
+    Cria um cliente Redis sobre um BlockingConnectionPool: o listener e o loop de
+    dias pegam conexões diferentes do pool (sem disputar a mesma conexão) e, se o
+    pool esgotar, a chamada espera REDIS_POOL_TIMEOUT em vez de abrir mais conexões.
+    """
+    retry = Retry(ExponentialBackoff(cap=REDIS_BACKOFF_CAP, base=REDIS_BACKOFF_BASE), REDIS_RETRIES)
+    pool = redis.BlockingConnectionPool(retry=retry, **_pool_kwargs(pool_size, RoundTripConnection))
+    return redis.Redis(connection_pool=pool)
+
+def make_async_redis_client(pool_size=REDIS_POOL_SIZE):
+    """Equivalente de make_redis_client para redis.asyncio."""
+    retry = AsyncRetry(ExponentialBackoff(cap=REDIS_BACKOFF_CAP, base=REDIS_BACKOFF_BASE), REDIS_RETRIES)
+    pool = redis.asyncio.BlockingConnectionPool(retry=retry, **_pool_kwargs(pool_size, AsyncRoundTripConnection))
+    return redis.asyncio.Redis(connection_pool=pool)
+
+def _pool_usage(pool):
+    """
+    Conexões (em uso, ociosas) do pool. Lê atributos internos do redis-py, que
+    não expõe essa contagem: retorna None se a versão instalada os renomeou.
+    """
+    try:
+        if hasattr(pool, '_in_use_connections'):
+            # ConnectionPool e BlockingConnectionPool do redis.asyncio
+            return len(pool._in_use_connections), len(pool._available_connections)
+        # BlockingConnectionPool síncrono: fila com conexões livres e None para vagas não abertas
+        available = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return len(pool._connections) - available, available
+    except (AttributeError, TypeError):
+        return None
+
+def pool_stats(redis_client):
+    """Retorna a utilização do pool de conexões do cliente (em uso, disponíveis, máximo); só o máximo se a contagem não estiver disponível."""
+    pool = redis_client.connection_pool
+    stats = {'max': pool.max_connections}
+    usage = _pool_usage(pool)
+    if usage is not None:
+        in_use, available = usage
+        stats.update(in_use=in_use, available=available, utilization=in_use / pool.max_connections)
+    return stats
+
+def format_pool_stats(redis_client):
+    stats = pool_stats(redis_client)
+    if 'in_use' not in stats:
+        return f"Pool Redis: máximo de {stats['max']} conexões (uso indisponível nesta versão do redis-py)"
+    return (f"Pool Redis: {stats['in_use']}/{stats['max']} conexões em uso, "
+            f"{stats['available']} ociosas ({stats['utilization']:.0%})")
+
+# --- Temporizadores ---
+
+def call_later(delay, callback, *args):
+    """Executa callback(*args) após 'delay' segundos em uma thread daemon."""
+    timer = threading.Timer(delay, callback, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+_background_tasks = set()
+
+def async_call_later(delay, callback, *args):
+    """Versão asyncio de call_later: agenda a corrotina callback(*args) no loop atual."""
+    def start():
+        task = asyncio.ensure_future(callback(*args))
+        # O loop só guarda referências fracas às tarefas.
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return asyncio.get_running_loop().call_later(delay, start)
+
 def list_to_string(lst):
     """Converte uma lista de números em uma string separada por ponto e vírgula."""
     return ';'.join(str(item) for item in lst)
@@ -56,16 +340,329 @@ def string_to_list(string):
     """Converte uma string separada por ponto e vírgula de volta para uma lista de inteiros."""
     return [int(item) for item in string.split(';') if item]
 
-def print_update(msg, entity_name):
-    """Imprime uma mensagem formatada no console e a salva em um arquivo de log."""
-    final_msg = (
-        "\n"
-        "===============================================================================\n"
-        f"[{entity_name.upper()}] {msg}\n"
-        "===============================================================================\n"
-    )
-    print(final_msg)
-    
-    os.makedirs('output', exist_ok=True)
-    with open(f'output/{entity_name}.txt', 'a', encoding='utf-8') as file:
-        file.write(final_msg)
\ No newline at end of file
+# --- Formato das mensagens (wire format) ---
+#
+# Versão 1: texto legado, campos separados por '/' e vetores por ';'.
+# Versão 2: binário compacto (struct/array), transportado em base64 com o prefixo
+# WIRE_PREFIX para continuar compatível com clientes decode_responses=True.
+#
+# Layout da versão 2 (little-endian):
+#   B versão | B comando | B nº de campos | i * campos | B tipo do vetor | vetor
+# Tipos de vetor: 0 = sem vetor, 1 = denso (int32), 2 = esparso (índices uint16 +
+# valores int32), 3 = uniforme (bitset dos itens não nulos + um valor int32, que
+# cobre vetores de flags e lotes de tamanho fixo). O encoder escolhe o menor.
+#
+# Versão 3: a versão 2 com metadados de rastreamento logo após o cabeçalho:
+#   B versão | B comando | B nº de campos | Q trace_id | d enviado em (epoch s) | ...
+# trace_id 0 significa mensagem fora de um trace (tracing.py).
+#
+# Os decoders aceitam todas as versões, então a troca pode ser feita aos poucos
+# mudando apenas WIRE_VERSION nos publicadores.
+WIRE_VERSION = 3
+WIRE_PREFIX = '#'
+_HEADER = struct.Struct('<BBB')
+_TRACE_HEADER = struct.Struct('<BBBQd')
+
+# Trace da mensagem sendo tratada (ou da operação iniciada) na thread/tarefa
+# atual: as mensagens codificadas nesse contexto herdam o id.
+CURRENT_TRACE = contextvars.ContextVar('current_trace', default=0)
+
+def new_trace_id():
+    # os.urandom para não consumir o gerador 'random', que a simulação semeia.
+    return int.from_bytes(os.urandom(8), 'little') or 1
+
+# Novos comandos entram no fim da tupla: o código de cada um é a sua posição.
+COMMANDS = ('send_parts', 'receive_parts', 'receive_order', 'receive_products', 'update_factory',
+            'reject_parts')
+_COMMAND_CODES = {command: code for code, command in enumerate(COMMANDS)}
+_VECTOR_COMMANDS = ('send_parts', 'receive_parts', 'update_factory')
+
+_VEC_NONE, _VEC_DENSE, _VEC_SPARSE, _VEC_UNIFORM = range(4)
+
+Message = namedtuple('Message', ['command', 'fields', 'vector', 'trace_id', 'sent_at'], defaults=(0, None))
+
+# Comando das mensagens malformadas: os handlers as registram como não
+# reconhecidas, como qualquer comando desconhecido, e seguem ouvindo.
+UNKNOWN_COMMAND = 'unknown'
+# binascii.Error (base64) e UnicodeDecodeError são subclasses de ValueError.
+_MALFORMED_ERRORS = (ValueError, struct.error, IndexError)
+
+
+def _pack_vector(vector):
+    if vector is None:
+        return struct.pack('<B', _VEC_NONE)
+    n = len(vector)
+    nonzero = [i for i, value in enumerate(vector) if value]
+    values = {vector[i] for i in nonzero}
+    if len(values) <= 1:
+        bits = sum(1 << i for i in nonzero)
+        value = values.pop() if values else 0
+        return struct.pack('<BHi', _VEC_UNIFORM, n, value) + bits.to_bytes((n + 7) // 8, 'little')
+    # Cada item esparso custa 6 bytes (uint16 + int32) contra 4 bytes no denso.
+    if len(nonzero) * 6 < n * 4:
+        values = [vector[i] for i in nonzero]
+        return (struct.pack('<BHH', _VEC_SPARSE, n, len(nonzero))
+                + struct.pack(f'<{len(nonzero)}H{len(nonzero)}i', *nonzero, *values))
+    return struct.pack('<BH', _VEC_DENSE, n) + array('i', vector).tobytes()
+
+
+def _unpack_vector(buf, offset):
+    (kind,) = struct.unpack_from('<B', buf, offset)
+    offset += 1
+    if kind == _VEC_NONE:
+        return None
+    (n,) = struct.unpack_from('<H', buf, offset)
+    offset += 2
+    if kind == _VEC_DENSE:
+        vector = array('i')
+        vector.frombytes(buf[offset:offset + 4 * n])
+        return vector.tolist()
+    if kind == _VEC_UNIFORM:
+        (value,) = struct.unpack_from('<i', buf, offset)
+        bits = int.from_bytes(buf[offset + 4:offset + 4 + (n + 7) // 8], 'little')
+        return [value if (bits >> i) & 1 else 0 for i in range(n)]
+    (count,) = struct.unpack_from('<H', buf, offset)
+    unpacked = struct.unpack_from(f'<{count}H{count}i', buf, offset + 2)
+    vector = [0] * n
+    for i, value in zip(unpacked[:count], unpacked[count:]):
+        vector[i] = value
+    return vector
+
+
+def _encode_legacy(command, fields, vector):
+    parts = [str(field) for field in fields]
+    if vector is not None:
+        parts.append(list_to_string(vector))
+    # Pedido de peças da linha: "id_linha/id_fabrica/send_parts/payload"
+    if command == 'send_parts' and len(fields) == 2:
+        return '/'.join(parts[:2] + [command] + parts[2:])
+    return '/'.join([command] + parts)
+
+
+def _decode_legacy(data):
+    parts = data.split('/')
+    if len(parts) > 3 and parts[2] == 'send_parts':
+        parts = [parts[2], parts[0], parts[1]] + parts[3:]
+    command, rest = parts[0], parts[1:]
+    vector = None
+    if command in _VECTOR_COMMANDS and rest:
+        vector = string_to_list(rest.pop())
+    return Message(command, [int(field) for field in rest], vector)
+
+
+def encode_message(command, fields=(), vector=None, trace_id=None):
+    """
+    Codifica uma mensagem (comando, campos inteiros e vetor opcional) no formato
+    WIRE_VERSION. Na versão 3 a mensagem leva trace_id (padrão: o trace do
+    contexto atual) e o instante do envio.
+    """
+    fields = [int(field) for field in fields]
+    if WIRE_VERSION == 1:
+        return _encode_legacy(command, fields, vector)
+    code = _COMMAND_CODES[command]
+    if WIRE_VERSION == 3:
+        trace_id = CURRENT_TRACE.get() if trace_id is None else trace_id
+        header = _TRACE_HEADER.pack(3, code, len(fields), trace_id, time.time())
+    else:
+        header = _HEADER.pack(2, code, len(fields))
+    buf = header + struct.pack(f'<{len(fields)}i', *fields) + _pack_vector(vector)
+    return WIRE_PREFIX + base64.b64encode(buf).decode('ascii')
+
+
+def peek_header(data):
+    """
+    Só (comando, trace_id, enviado em) da mensagem, decodificando apenas o
+    cabeçalho (usado pelas métricas e pelo tracing a cada mensagem recebida).
+    """
+    try:
+        return _peek_header(data)
+    except _MALFORMED_ERRORS:
+        return UNKNOWN_COMMAND, 0, None
+
+
+def _peek_header(data):
+    if isinstance(data, bytes):
+        data = data.decode('ascii')
+    if not data.startswith(WIRE_PREFIX):
+        return _decode_legacy(data).command, 0, None
+    start = len(WIRE_PREFIX)
+    # 4 caracteres base64 = 3 bytes (cabeçalho v2); 28 = 21 bytes (cobre o da v3).
+    version, code, _ = _HEADER.unpack(base64.b64decode(data[start:start + 4]))
+    if version == 2:
+        return COMMANDS[code], 0, None
+    if version != 3:
+        raise ValueError(f"Versão de mensagem desconhecida: {version}")
+    _, _, _, trace_id, sent_at = _TRACE_HEADER.unpack_from(base64.b64decode(data[start:start + 28]))
+    return COMMANDS[code], trace_id, sent_at
+
+
+def decode_message(data):
+    """
+    Decodifica uma mensagem em qualquer versão do wire format e retorna um
+    Message; uma mensagem malformada vira um Message com UNKNOWN_COMMAND.
+    """
+    try:
+        return _decode_message(data)
+    except _MALFORMED_ERRORS:
+        return Message(UNKNOWN_COMMAND, [], None)
+
+
+def _decode_message(data):
+    if isinstance(data, bytes):
+        data = data.decode('ascii')
+    if not data.startswith(WIRE_PREFIX):
+        return _decode_legacy(data)
+    buf = base64.b64decode(data[len(WIRE_PREFIX):])
+    version, code, n_fields = _HEADER.unpack_from(buf, 0)
+    if version == 2:
+        trace_id, sent_at, offset = 0, None, _HEADER.size
+    elif version == 3:
+        _, _, _, trace_id, sent_at = _TRACE_HEADER.unpack_from(buf, 0)
+        offset = _TRACE_HEADER.size
+    else:
+        raise ValueError(f"Versão de mensagem desconhecida: {version}")
+    fields = list(struct.unpack_from(f'<{n_fields}i', buf, offset))
+    vector = _unpack_vector(buf, offset + 4 * n_fields)
+    return Message(COMMANDS[code], fields, vector, trace_id, sent_at)
+
+
+class _LogWriter(threading.Thread):
+    """
+    Escritor de log em segundo plano: consome a fila do processo em lotes de até
+    LOG_BATCH_SIZE registros, escreve cada um no console e em output/{entidade}.txt
+    e só faz flush uma vez por lote. Arquivos que passam de LOG_MAX_BYTES são
+    rotacionados ({arquivo}.1, {arquivo}.2, ...).
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue = log_queue
+        self.files = {}
+
+    def _format(self, record):
+        entity = getattr(record, 'entity', 'sim')
+        if LOG_JSON:
+            return json.dumps({
+                'ts': round(record.created, 3),
+                'level': record.levelname,
+                'entity': entity,
+                'pid': record.process,
+                'msg': record.getMessage(),
+            }, ensure_ascii=False) + "\n"
+        return (
+            "\n"
+            "===============================================================================\n"
+            f"[{entity.upper()}] {record.getMessage()}\n"
+            "===============================================================================\n"
+        )
+
+    def _file_for(self, entity):
+        file = self.files.get(entity)
+        if file is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            file = open(os.path.join(LOG_DIR, f'{entity}.txt'), 'a', encoding='utf-8')
+            self.files[entity] = file
+        return file
+
+    def _rotate(self, entity):
+        file = self.files.pop(entity)
+        file.close()
+        path = file.name
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f'{path}.{i}'):
+                os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+        if LOG_BACKUP_COUNT > 0:
+            os.replace(path, f'{path}.1')
+        else:
+            os.remove(path)
+
+    def write_batch(self, records):
+        touched = set()
+        for record in records:
+            entity = getattr(record, 'entity', 'sim')
+            text = self._format(record)
+            if LOG_CONSOLE:
+                sys.stdout.write(text if LOG_JSON else text + "\n")
+            self._file_for(entity).write(text)
+            touched.add(entity)
+        if LOG_CONSOLE:
+            sys.stdout.flush()
+        for entity in touched:
+            file = self.files[entity]
+            file.flush()
+            if LOG_MAX_BYTES and file.tell() >= LOG_MAX_BYTES:
+                self._rotate(entity)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            self.write_batch(batch)
+        for file in self.files.values():
+            file.close()
+
+
+_log_lock = threading.Lock()
+_log_pid = None
+_log_writer = None
+_logger = logging.getLogger('simulation')
+_logger.propagate = False
+
+
+def _stop_logging():
+    """Drena a fila antes de o processo terminar (registrado com atexit e Finalize)."""
+    if _log_writer is not None and _log_pid == os.getpid() and _log_writer.is_alive():
+        _log_writer.queue.put(None)
+        _log_writer.join(timeout=5)
+
+
+def _ensure_logging():
+    """Inicializa a fila e o escritor na primeira chamada de cada processo (inclusive após fork)."""
+    global _log_pid, _log_writer
+    if _log_pid == os.getpid():
+        return
+    with _log_lock:
+        if _log_pid == os.getpid():
+            return
+        log_queue = queue.SimpleQueue()
+        for handler in list(_logger.handlers):
+            _logger.removeHandler(handler)
+        _logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _logger.setLevel(LOG_LEVEL)
+        _log_writer = _LogWriter(log_queue)
+        _log_writer.start()
+        if _log_pid is None:
+            atexit.register(_stop_logging)
+        # Os processos do multiprocessing (workers do supervisor) terminam com
+        # os._exit, sem atexit; os finalizadores deles rodam antes disso.
+        multiprocessing.util.Finalize(None, _stop_logging, exitpriority=10)
+        _log_pid = os.getpid()
+
+
+def set_log_level(level):
+    """Muda o nível mínimo de log do processo (ex.: 'DEBUG' para ver os traces de mensagens)."""
+    _ensure_logging()
+    _logger.setLevel(level)
+
+
+def print_update(msg, entity_name, level=logging.INFO):
+    """
+    Registra uma mensagem da entidade no console e em output/{entidade}.txt.
+    Só enfileira o registro: a escrita acontece na thread de log, fora do caminho
+    de tratamento das mensagens.
+    """
+    _ensure_logging()
+    _logger.log(level, msg, extra={'entity': entity_name})
+
+
+def print_debug(msg, entity_name):
+    """Traces de depuração (mensagens brutas etc.), desligados com LOG_LEVEL acima de DEBUG."""
+    print_update(msg, entity_name, logging.DEBUG)
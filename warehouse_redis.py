@@ -1,129 +1,483 @@
 # warehouse_redis.py
 
+import asyncio
 import redis
+import sys
 import threading
 import time
+from collections import namedtuple
+from inventory_redis import warehouse_inventory
+from metrics import EntityMetrics
+from reorder_policy import AdaptiveReorder, RestockTrigger
+from restock_requests import RequestTracker, REPLY_COMPLETE, REPLY_PARTIAL
+from supplier_model import SupplierRouter
+from transport_redis import make_transport
+from warehouse_shards import part_range
 from utils import (
-    list_to_string,
-    string_to_list,
+    make_redis_client,
+    call_later,
+    async_call_later,
+    format_pool_stats,
+    encode_message,
+    decode_message,
+    line_channel,
+    warehouse_channel,
+    new_trace_id,
     print_update,
+    print_debug,
+    CURRENT_TRACE,
     PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    WAREHOUSE_BATCH_WINDOW,
+    FACTORY_PRIORITY,
+    REORDER_POLICY,
+    REORDER_LEAD_TIME_WAREHOUSE,
+    REORDER_COVER_DAYS_WAREHOUSE,
+    RESTOCK_TRIGGER_DEBOUNCE,
+    SUPPLIER_REQUEST_TIMEOUT,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_WAREHOUSE,
     YELLOW_ALERT_WAREHOUSE,
-    REDIS_HOST,
-    REDIS_PORT,
-    NUM_PARTS
+    NUM_PARTS,
+    WAREHOUSE_SHARDS
 )
 
+# Pedido de peças de uma linha aguardando a próxima rodada de alocação.
+# amounts: quantidade pedida de cada peça; starvation: quantas peças a linha tem
+# em vermelho e request_id: id do pedido na linha (ambos 0 para linhas antigas).
+# trace_id: trace do pedido, repassado à resposta, que sai da thread da alocação.
+RestockRequest = namedtuple('RestockRequest', ['line_id', 'factory_id', 'amounts', 'starvation', 'request_id', 'trace_id'])
+
+def requested_amounts(parts_ordered, default_amount):
+    """Nos vetores de pedido, 1 é uma flag (lote padrão) e valores maiores são a quantidade pedida."""
+    return [default_amount if value == 1 else value for value in parts_ordered]
+
 class WarehouseRedis:
+    """
+    Almoxarifado, ou um dos seus shards: com WAREHOUSE_SHARDS > 1, cada instância
+    só atende, envia e pede ao fornecedor as peças da sua faixa (part_range), e
+    ouve o seu próprio canal. O estoque continua no mesmo hash para todos.
+    """
 
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, shard=0):
         self.r = redis_client
-        self.entity_name = 'warehouse'
+        self.shard = int(shard)
+        self.parts = part_range(self.shard)
+        self.entity_name = 'warehouse' if WAREHOUSE_SHARDS == 1 else f'warehouse-{self.shard}'
+        self.channel = warehouse_channel(self.shard)
         self.waiting_for_supplier_order = False
+        self.inventory = warehouse_inventory(self.r)
+        self.transport = make_transport(self.r, self.entity_name)
+        self.metrics = EntityMetrics(self.entity_name, self.r)
+        self.call_later = call_later
+        # Pedidos das linhas recebidos na janela atual e rodadas seguidas em que
+        # cada linha ficou sem o lote completo (sobe a prioridade dela).
+        self.pending_requests = []
+        self.unfilled_rounds = {}
+        self._pending_lock = threading.Lock()
+        self._allocation_lock = threading.Lock()
+        # Velocidade de saída por peça e tempo de reposição do fornecedor.
+        self.reorder = AdaptiveReorder(
+            NUM_PARTS, REORDER_LEAD_TIME_WAREHOUSE, REORDER_COVER_DAYS_WAREHOUSE,
+            floor=PARTS_TO_SEND_AMOUNT_WAREHOUSE
+        )
+        self.clock = time.monotonic
+        self._ordered_at = None
+        # Revisão do estoque disparada pelos próprios envios ao cruzar o ponto de pedido.
+        self.restock_trigger = RestockTrigger()
+        # Pedido aos fornecedores aguardando resposta (id, prazo e falhas seguidas).
+        # Cada fornecedor recebe só as peças do seu catálogo.
+        self.supplier_requests = RequestTracker(SUPPLIER_REQUEST_TIMEOUT)
+        self.suppliers = SupplierRouter()
+        # Revisões do loop de dias, do gatilho e das novas tentativas rodam em
+        # threads diferentes: a verificação e o pedido ao fornecedor são serializados.
+        self._review_lock = threading.Lock()
 
-    def receive_parts(self, parts_received):
+    def receive_parts(self, parts_received, request_id=0, supplier_id=0):
         print_update(f"Recebendo lote de peças do fornecedor.", self.entity_name)
-        for i, amount in enumerate(parts_received):
-            if amount > 0:
-                self.r.incrby(f"warehouse:part:{i}", amount)
-        self.waiting_for_supplier_order = False
+        self.inventory.add(parts_received)
+        self._parts_received(parts_received, request_id, supplier_id)
+
+    def _parts_received(self, parts_received, request_id, supplier_id):
+        """Atualiza o gatilho e o pedido ao fornecedor depois que as peças entraram no estoque."""
+        self.restock_trigger.add(parts_received)
+        # Entrega atrasada de um pedido já vencido: as peças entram, o pedido atual segue.
+        # Remessas seguintes do mesmo pedido (capacidade do fornecedor) também só entram.
+        if self.supplier_requests.close(request_id, ok=True, responder=supplier_id):
+            self._record_delivery()
         print_update("Estoque do almoxarifado reabastecido.", self.entity_name)
 
-    def send_parts(self, line_id, factory_id, parts_ordered_flags):
-        to_send = [0] * NUM_PARTS
-        
-        for i, needs_part in enumerate(parts_ordered_flags):
-            if needs_part:
-                stock = int(self.r.get(f"warehouse:part:{i}") or 0)
-                if stock < PARTS_TO_SEND_AMOUNT_WAREHOUSE:
-                    print_update(f"QUEBRA DE ESTOQUE! Não há peças '{i}' suficientes para a linha {factory_id}-{line_id}.", self.entity_name)
-                    return 
-                to_send[i] = PARTS_TO_SEND_AMOUNT_WAREHOUSE
-
-        for i, amount_to_send in enumerate(to_send):
-            if amount_to_send > 0:
-                self.r.decrby(f"warehouse:part:{i}", amount_to_send)
-
-        payload = list_to_string(to_send)
-        msg = f"receive_parts/{line_id}/{factory_id}/{payload}"
-        
-        print_update(f"Enviando lote de peças para a linha {factory_id}-{line_id}.", self.entity_name)
-        self.r.publish("channel:line", msg)
+    def _supplier_deadline(self, request_id):
+        self._expire_supplier_order(request_id)
 
-    def check_and_order_parts_from_supplier(self):
-        if self.waiting_for_supplier_order:
+    def _expire_supplier_order(self, request_id):
+        """Prazo do pedido ao fornecedor: sem resposta, agenda um novo pedido com espera crescente."""
+        request = self.supplier_requests.close(request_id, ok=False)
+        if request is None:
             return
+        delay = self.supplier_requests.backoff()
+        print_update(f"PRAZO ESGOTADO sem resposta do fornecedor (pedido {request.request_id}). "
+                     f"Nova tentativa em {delay:.1f}s.", self.entity_name)
+        self.call_later(delay, self.metrics.timer(self._retry_supplier_order))
+
+    def _retry_supplier_order(self):
+        with self._review_lock:
+            if self._reopen_reviews():
+                self._review_stock()
+
+    def _reopen_reviews(self):
+        """Libera as revisões para a nova tentativa; retorna False se outro pedido já saiu."""
+        if self.supplier_requests.outstanding:
+            return False
+        self.waiting_for_supplier_order = False
+        return True
+
+    def _record_delivery(self):
+        self.waiting_for_supplier_order = False
+        if self._ordered_at is not None:
+            self.reorder.record_lead_time((self.clock() - self._ordered_at) / TIME_SLEEP)
+            self._ordered_at = None
+
+    def _enqueue_request(self, request):
+        """Guarda o pedido; retorna True se ele abriu uma nova janela de alocação."""
+        with self._pending_lock:
+            self.pending_requests.append(request)
+            return len(self.pending_requests) == 1
+
+    def _take_requests(self):
+        """Retira os pedidos da janela, juntando pedidos repetidos da mesma linha."""
+        with self._pending_lock:
+            requests, self.pending_requests = self.pending_requests, []
+        merged = {}
+        for request in requests:
+            line = (str(request.factory_id), str(request.line_id))
+            previous = merged.get(line)
+            if previous is not None:
+                request = request._replace(
+                    amounts=[max(a, b) for a, b in zip(previous.amounts, request.amounts)],
+                    starvation=max(previous.starvation, request.starvation),
+                )
+            merged[line] = request
+        return list(merged.values())
+
+    def _priority(self, request):
+        """Chave de ordenação: fábrica prioritária, linha mais faminta, mais rodadas sem lote completo."""
+        line = (str(request.factory_id), str(request.line_id))
+        return (
+            -FACTORY_PRIORITY.get(str(request.factory_id), 0),
+            -request.starvation,
+            -self.unfilled_rounds.get(line, 0),
+        )
+
+    def _allocate(self, requests, stocks):
+        """
+        Distribui o estoque lido uma única vez entre os pedidos, em ordem de
+        prioridade. Cada peça recebe a quantidade pedida, ou o que restar (envio
+        parcial). Retorna a lista de (pedido, vetor a enviar, status), com vetor
+        None para os pedidos recusados (nenhuma peça disponível).
+        """
+        available = list(stocks)
+        shipments = []
+        for request in sorted(requests, key=self._priority):
+            to_send = [0] * NUM_PARTS
+            short = []
+            for i, requested in enumerate(request.amounts):
+                if not requested:
+                    continue
+                amount = min(requested, max(available[i], 0))
+                if amount < requested:
+                    short.append(i)
+                to_send[i] = amount
+                available[i] -= amount
 
+            line = (str(request.factory_id), str(request.line_id))
+            if short:
+                self.unfilled_rounds[line] = self.unfilled_rounds.get(line, 0) + 1
+                kind = "ENVIO PARCIAL" if any(to_send) else "QUEBRA DE ESTOQUE!"
+                print_update(f"{kind} Sem lote completo das peças {short} para a linha "
+                             f"{request.factory_id}-{request.line_id}.", self.entity_name)
+            else:
+                self.unfilled_rounds.pop(line, None)
+            if not any(to_send):
+                shipments.append((request, None, None))
+            else:
+                shipments.append((request, to_send, REPLY_PARTIAL if short else REPLY_COMPLETE))
+        return shipments
+
+    def _queue_shipments(self, pipe, shipments):
+        """
+        Enfileira a baixa do estoque e todas as respostas às linhas (envio, envio
+        parcial ou recusa) em um único pipeline. Retorna o total baixado de cada peça.
+        O consumo registrado para o ponto de pedido é o pedido pelas linhas (inclusive
+        o recusado), não o enviado: com estoque curto, o enviado subestima a demanda.
+        """
+        sent = [to_send for _, to_send, _ in shipments if to_send is not None]
+        total = [sum(amounts) for amounts in zip(*sent)] or [0] * NUM_PARTS
+        self.inventory.queue_add(pipe, [-amount for amount in total])
+        requested = [sum(amounts) for amounts in zip(*(request.amounts for request, _, _ in shipments))]
+        self.reorder.record_consumption(requested or [0] * NUM_PARTS)
+        for request, to_send, status in shipments:
+            ids = [request.line_id, request.factory_id, request.request_id]
+            if to_send is None:
+                msg = encode_message("reject_parts", ids + [self.shard], trace_id=request.trace_id)
+            else:
+                msg = encode_message("receive_parts", ids + [status, self.shard], to_send, trace_id=request.trace_id)
+            self.transport.queue_publish(pipe, line_channel(request.factory_id, request.line_id), msg)
+        return total
+
+    def _after_shipments(self, total):
+        """Agenda uma revisão do estoque se os envios fizeram alguma peça cruzar o ponto de pedido."""
+        if self.restock_trigger.consume(total, self.reorder.levels(YELLOW_ALERT_WAREHOUSE)):
+            self.call_later(RESTOCK_TRIGGER_DEBOUNCE, self.metrics.timer(self._triggered_review))
+
+    def _own(self, vector):
+        """Zera as peças fora da faixa deste shard."""
+        start, stop = self.parts.start, self.parts.stop
+        if start == 0 and stop >= len(vector):
+            return vector
+        owned = [0] * len(vector)
+        owned[start:stop] = vector[start:stop]
+        return owned
+
+    def _line_request(self, line_id, factory_id, parts_ordered, starvation, request_id):
+        # Linhas antigas mandam o pedido inteiro: cada shard atende só a sua faixa.
+        amounts = self._own(requested_amounts(parts_ordered, PARTS_TO_SEND_AMOUNT_WAREHOUSE))
+        return RestockRequest(line_id, factory_id, amounts, starvation, request_id, CURRENT_TRACE.get())
+
+    def send_parts(self, line_id, factory_id, parts_ordered, starvation=0, request_id=0):
+        """Enfileira o pedido da linha; a alocação roda WAREHOUSE_BATCH_WINDOW s após o primeiro da janela."""
+        if self._enqueue_request(self._line_request(line_id, factory_id, parts_ordered, starvation, request_id)):
+            self.call_later(WAREHOUSE_BATCH_WINDOW, self.metrics.timer(self.allocate_pending_requests))
+
+    def allocate_pending_requests(self):
+        # Uma rodada por vez: a leitura do estoque e a baixa não podem se intercalar.
+        with self._allocation_lock:
+            requests = self._take_requests()
+            if not requests:
+                return
+            shipments = self._allocate(requests, self.inventory.get_all())
+            pipe = self.r.pipeline(transaction=False)
+            total = self._queue_shipments(pipe, shipments)
+            pipe.execute()
+            self._after_allocation(requests, shipments, total)
+
+    def _after_allocation(self, requests, shipments, total):
+        """Depois da baixa e dos envios: agenda a revisão se preciso e registra a rodada."""
+        self._after_shipments(total)
+        print_update(f"Alocação: {len(requests)} pedidos de linhas, {self._shipped(shipments)} envios.", self.entity_name)
+
+    @staticmethod
+    def _shipped(shipments):
+        return sum(1 for _, to_send, _ in shipments if to_send is not None)
+
+    def _parts_to_order_from_supplier(self, stocks):
+        """Retorna o vetor de flags das peças abaixo do alerta e se há algum alerta."""
         parts_to_order = [0] * NUM_PARTS
         is_alert = False
         
-        for i in range(NUM_PARTS):
-            stock = int(self.r.get(f"warehouse:part:{i}") or 0)
+        for i in self.parts:
+            stock = stocks[i]
             if stock < RED_ALERT_WAREHOUSE:
                 parts_to_order[i] = 1
                 is_alert = True
             elif stock < YELLOW_ALERT_WAREHOUSE:
                 parts_to_order[i] = 1
                 is_alert = True
+        return parts_to_order, is_alert
+
+    def _supplier_order(self, stocks):
+        """
+        Vetor do pedido ao fornecedor e se há algo a pedir: quantidades pelos pontos
+        de pedido adaptativos ou, sem histórico suficiente, as flags dos alertas fixos.
+        """
+        if REORDER_POLICY == 'adaptive' and self.reorder.ready:
+            parts_to_order = self._own(self.reorder.order_quantities(stocks))
+            return parts_to_order, any(parts_to_order)
+        return self._parts_to_order_from_supplier(stocks)
+
+    def check_and_order_parts_from_supplier(self):
+        # Chamado uma vez por dia: fecha a saída do dia para a velocidade por peça.
+        self.reorder.close_day()
+        self.review_stock()
+
+    def _triggered_review(self):
+        self.restock_trigger.release()
+        self.review_stock()
 
+    def _queue_supplier_order(self, pipe, parts_to_order):
+        """
+        Abre o pedido, dividido entre os fornecedores donos das peças, enfileira
+        as partes no pipeline e arma o prazo.
+        """
+        self.waiting_for_supplier_order = True
+        if self._ordered_at is None:
+            self._ordered_at = self.clock()
+        pieces = self.suppliers.split(parts_to_order)
+        request = self.supplier_requests.open(self.clock(), [supplier_id for supplier_id, _, _ in pieces])
+        print_update("Nível de estoque baixo. Enviando pedido para o Fornecedor.", self.entity_name)
+        # Cada pedido ao fornecedor abre o seu próprio trace (ciclo de reposição),
+        # o mesmo para todas as partes.
+        trace_id = new_trace_id()
+        for _, channel, piece in pieces:
+            msg = encode_message("send_parts", [request.request_id, self.shard], piece, trace_id=trace_id)
+            self.transport.queue_publish(pipe, channel, msg)
+        self.call_later(self.supplier_requests.timeout, self.metrics.timer(self._supplier_deadline), request.request_id)
+
+    def review_stock(self):
+        """Lê o estoque e pede ao fornecedor as peças abaixo do ponto de pedido."""
+        with self._review_lock:
+            self._review_stock()
+
+    def _review_stock(self):
+        if self.waiting_for_supplier_order:
+            return
+        parts_to_order = self._stock_order(self.inventory.get_all())
+        if parts_to_order:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_supplier_order(pipe, parts_to_order)
+            pipe.execute()
+
+    def _stock_order(self, stocks):
+        """Decide a revisão a partir do estoque lido: o vetor do pedido ao fornecedor, ou None se nada falta."""
+        self.restock_trigger.sync(stocks)
+        parts_to_order, is_alert = self._supplier_order(stocks)
         if is_alert:
-            self.waiting_for_supplier_order = True
-            payload = list_to_string(parts_to_order)
-            msg = f"send_parts/{payload}"
-            
-            print_update("Nível de estoque baixo. Enviando pedido para o Fornecedor.", self.entity_name)
-            self.r.publish("channel:supplier", msg)
-        else:
-            print_update("Nível de estoque: VERDE.", self.entity_name)
+            return parts_to_order
+        print_update("Nível de estoque: VERDE.", self.entity_name)
+        return None
 
     def listen(self):
-        """Ouve o canal 'channel:warehouse' e LOGA TUDO para depuração."""
-        pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:warehouse")
-        print_update("Ouvindo o canal 'channel:warehouse'...", self.entity_name)
+        """Ouve o canal do almoxarifado (ou do shard) e LOGA TUDO para depuração."""
+        print_update(f"Ouvindo o canal '{self.channel}'...", self.entity_name)
         
-        for message in pubsub.listen():
+        for data in self.transport.listen(self.channel):
             # <<< PASSO DE DEBUG: Logar toda e qualquer mensagem que chegar >>>
-            print_update(f"!!! MENSAGEM RECEBIDA: {message}", self.entity_name)
-            
-            if message['type'] != 'message':
-                continue
-            
-            data = message['data']
-            parts = data.split("/")
-            
-            # Mensagem do Fornecedor: "receive_parts/payload"
-            if parts[0] == "receive_parts":
-                print_update(">>> Mensagem identificada como do FORNECEDOR.", self.entity_name)
-                payload = parts[1]
-                rec = string_to_list(payload)
-                self.receive_parts(rec)
+            print_debug(f"!!! MENSAGEM RECEBIDA: {data}", self.entity_name)
             
-            # Mensagem da Linha: "line_id/factory_id/send_parts/payload"
-            elif len(parts) > 2 and parts[2] == "send_parts":
-                print_update(">>> Mensagem identificada como da LINHA.", self.entity_name)
-                line_id = parts[0]
-                factory_id = parts[1]
-                payload = parts[3]
-                parts_to_order_flags = string_to_list(payload)
-                self.send_parts(line_id, factory_id, parts_to_order_flags)
-            else:
-                # <<< PASSO DE DEBUG: Logar se uma mensagem não for reconhecida >>>
-                print_update(f"XXX MENSAGEM NÃO RECONHECIDA: {data}", self.entity_name)
+            self.metrics.dispatch(self.handle_message, data, self.transport)
+
+    def _route(self, msg):
+        """Retorna o handler e os argumentos de uma mensagem, ou None se ela não é reconhecida."""
+        # Mensagem do Fornecedor: "receive_parts" com o vetor de quantidades e [request_id, supplier_id]
+        if msg.command == "receive_parts" and len(msg.fields) <= 2:
+            print_debug(">>> Mensagem identificada como do FORNECEDOR.", self.entity_name)
+            return self.receive_parts, (msg.vector, *msg.fields)
+        
+        # Mensagem da Linha: "send_parts" com line_id, factory_id, [peças em vermelho, request_id] e vetor
+        if msg.command == "send_parts" and 2 <= len(msg.fields) <= 4:
+            print_debug(">>> Mensagem identificada como da LINHA.", self.entity_name)
+            return self.send_parts, (*msg.fields[:2], msg.vector, *msg.fields[2:])
+
+        # <<< PASSO DE DEBUG: Logar se uma mensagem não for reconhecida >>>
+        print_debug(f"XXX MENSAGEM NÃO RECONHECIDA: {msg}", self.entity_name)
+        return None
+
+    def handle_message(self, data):
+        route = self._route(decode_message(data))
+        if route:
+            handler, args = route
+            handler(*args)
+
+class AsyncWarehouseRedis(WarehouseRedis):
+    """
+    Variante asyncio do almoxarifado (redis.asyncio), para várias entidades em
+    um só processo. As decisões ficam nos helpers do WarehouseRedis; aqui só as
+    idas ao Redis e ao transporte são aguardadas.
+    """
+
+    # Último dia começado pelo run(): reiniciada pelo async_runtime, a tarefa continua dele.
+    day = 0
+
+    def __init__(self, redis_client, shard=0):
+        super().__init__(redis_client, shard)
+        self.call_later = async_call_later
+        self._allocation_lock = asyncio.Lock()
+        self._review_lock = asyncio.Lock()
+
+    async def receive_parts(self, parts_received, request_id=0, supplier_id=0):
+        print_update(f"Recebendo lote de peças do fornecedor.", self.entity_name)
+        await self.inventory.add(parts_received)
+        self._parts_received(parts_received, request_id, supplier_id)
+
+    async def _supplier_deadline(self, request_id):
+        self._expire_supplier_order(request_id)
+
+    async def _retry_supplier_order(self):
+        async with self._review_lock:
+            if self._reopen_reviews():
+                await self._review_stock()
+
+    async def send_parts(self, line_id, factory_id, parts_ordered, starvation=0, request_id=0):
+        super().send_parts(line_id, factory_id, parts_ordered, starvation, request_id)
+
+    async def allocate_pending_requests(self):
+        async with self._allocation_lock:
+            requests = self._take_requests()
+            if not requests:
+                return
+            shipments = self._allocate(requests, await self.inventory.get_all())
+            pipe = self.r.pipeline(transaction=False)
+            total = self._queue_shipments(pipe, shipments)
+            await pipe.execute()
+            self._after_allocation(requests, shipments, total)
+
+    async def check_and_order_parts_from_supplier(self):
+        self.reorder.close_day()
+        await self.review_stock()
+
+    async def _triggered_review(self):
+        self.restock_trigger.release()
+        await self.review_stock()
+
+    async def review_stock(self):
+        async with self._review_lock:
+            await self._review_stock()
+
+    async def _review_stock(self):
+        if self.waiting_for_supplier_order:
+            return
+        parts_to_order = self._stock_order(await self.inventory.get_all())
+        if parts_to_order:
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_supplier_order(pipe, parts_to_order)
+            await pipe.execute()
+
+    async def listen(self):
+        print_update(f"Ouvindo o canal '{self.channel}'...", self.entity_name)
+        async for data in self.transport.listen(self.channel):
+            print_debug(f"!!! MENSAGEM RECEBIDA: {data}", self.entity_name)
+            await self.metrics.dispatch_async(self.handle_message, data, self.transport)
+
+    async def handle_message(self, data):
+        route = self._route(decode_message(data))
+        if route:
+            handler, args = route
+            await handler(*args)
+
+    async def run(self):
+        """Loop de dias, equivalente ao de main()."""
+        while self.day < DAYS_MAX:
+            self.day += 1
+            print_update(f"--- Dia {self.day} ---", self.entity_name)
+            await self.metrics.step_async(self.check_and_order_parts_from_supplier)
+            await asyncio.sleep(TIME_SLEEP)
+        print_update("Simulação terminada.", self.entity_name)
 
 def main():
+    if len(sys.argv) > 2:
+        print("Uso: python3 warehouse_redis.py [shard]")
+        sys.exit(1)
+    shard = int(sys.argv[1]) if len(sys.argv) == 2 else 0
+
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r = make_redis_client()
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'warehouse-main')
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
         return
 
-    wh = WarehouseRedis(r)
+    wh = WarehouseRedis(r, shard)
     
     listener_thread = threading.Thread(target=wh.listen, daemon=True)
     listener_thread.start()
@@ -132,7 +486,8 @@ def main():
     while days < DAYS_MAX:
         days += 1
         print_update(f"--- Dia {days} ---", wh.entity_name)
-        wh.check_and_order_parts_from_supplier()
+        wh.metrics.step(wh.check_and_order_parts_from_supplier)
+        print_update(format_pool_stats(r), wh.entity_name)
         time.sleep(TIME_SLEEP)
         
     print_update("Simulação terminada.", wh.entity_name)
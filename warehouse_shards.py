@@ -0,0 +1,53 @@
+# warehouse_shards.py
+
+import utils
+from utils import warehouse_channel, NUM_PARTS
+
+
+def part_range(shard, shards=None):
+    """Faixa de peças (índices 0-based) de um shard; as sobras vão para os primeiros."""
+    shards = utils.WAREHOUSE_SHARDS if shards is None else shards
+    size, extra = divmod(NUM_PARTS, shards)
+    start = shard * size + min(shard, extra)
+    return range(start, start + size + (1 if shard < extra else 0))
+
+
+def warehouse_specs():
+    """Especificações (async_runtime.build_entity) de todos os shards do almoxarifado."""
+    if utils.WAREHOUSE_SHARDS == 1:
+        return ["warehouse"]
+    return [f"warehouse:{shard}" for shard in range(utils.WAREHOUSE_SHARDS)]
+
+
+class ShardRouter:
+    """
+    Divide vetores de peças entre os shards do almoxarifado. As partes mantêm o
+    tamanho NUM_PARTS (zeros fora da faixa do shard), então o formato das
+    mensagens não muda e o vetor esparso continua barato no wire format.
+    Usado pelas linhas (pedidos) e pelo fornecedor (entregas).
+    """
+
+    def __init__(self, shards=None):
+        self.shards = utils.WAREHOUSE_SHARDS if shards is None else shards
+        self.ranges = [part_range(shard, self.shards) for shard in range(self.shards)]
+
+    def split(self, vector):
+        """Retorna [(shard, parte do vetor)] só dos shards com alguma peça no vetor."""
+        if self.shards == 1:
+            return [(0, list(vector))] if any(vector) else []
+        pieces = []
+        for shard, parts in enumerate(self.ranges):
+            if any(vector[i] for i in parts):
+                piece = [0] * len(vector)
+                piece[parts.start:parts.stop] = vector[parts.start:parts.stop]
+                pieces.append((shard, piece))
+        return pieces
+
+    def route_delivery(self, vector, shard=None):
+        """
+        Canais e partes de uma entrega do fornecedor: inteira para o shard que fez o
+        pedido ou, em pedidos sem shard (almoxarifado antigo), dividida pelas faixas.
+        """
+        if self.shards == 1 or (shard is not None and 0 <= shard < self.shards):
+            return [(warehouse_channel(shard or 0), vector)]
+        return [(warehouse_channel(shard), piece) for shard, piece in self.split(vector)]